@@ -0,0 +1,289 @@
+import abc
+import asyncio
+import ipaddress
+import itertools
+import math
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple, Union
+
+from starlette.responses import JSONResponse
+
+
+@dataclass
+class PriorityClass:
+    """Admission settings for one class of routes"""
+    name: str
+    priority: int  # higher is more important
+    max_concurrency: int  # per-class cap on in-flight requests
+    share: float  # fraction of the global capacity this class may occupy
+    latency_budget: float  # seconds a request may queue before being shed
+    max_queue: int  # waiting requests beyond this are shed immediately
+    rate: float  # token bucket refill per second, per client
+    burst: int  # token bucket size, per client
+    in_flight: int = field(default=0, init=False)
+    queued: int = field(default=0, init=False)
+    admitted: int = field(default=0, init=False)
+    shed: int = field(default=0, init=False)
+    rate_limited: int = field(default=0, init=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "rate_limited": self.rate_limited
+        }
+
+
+def default_priority_classes(capacity: int) -> Dict[str, PriorityClass]:
+    """
+    checkout > cart > browse: browse is shed first and checkout may queue for any
+    free slot, but each class is capped below the capacity so a flood of one kind
+    of request always leaves room for the others.
+    """
+    def cap(fraction: float) -> int:
+        return max(1, int(capacity * fraction))
+
+    return {
+        "checkout": PriorityClass(
+            "checkout", priority=3, max_concurrency=cap(0.3), share=1.0,
+            latency_budget=float(os.environ.get('ADMISSION_CHECKOUT_BUDGET', 5.0)),
+            max_queue=capacity, rate=2.0, burst=10
+        ),
+        "cart": PriorityClass(
+            "cart", priority=2, max_concurrency=cap(0.4), share=0.85,
+            latency_budget=float(os.environ.get('ADMISSION_CART_BUDGET', 1.0)),
+            max_queue=capacity, rate=10.0, burst=30
+        ),
+        "browse": PriorityClass(
+            "browse", priority=1, max_concurrency=cap(0.5), share=0.6,
+            latency_budget=float(os.environ.get('ADMISSION_BROWSE_BUDGET', 0.25)),
+            max_queue=capacity // 2, rate=50.0, burst=100
+        ),
+    }
+
+
+def classify_request(method: str, path: str) -> str:
+    """Map a request onto its priority class"""
+    if method == "POST" and (path == "/api/orders" or path.endswith("/reorder")):
+        return "checkout"
+    if path.startswith("/api/cart/"):
+        return "cart"
+    return "browse"
+
+
+class AdmissionController:
+    """
+    Global concurrency limit shared by priority classes with per-class caps and
+    queues. Freed slots go to waiting requests highest priority first (oldest first
+    within a class), and a new request never overtakes a queued one of equal or
+    higher priority.
+    """
+
+    def __init__(self, capacity: int, classes: Dict[str, PriorityClass]):
+        self.capacity = capacity
+        self.classes = classes
+        self.in_flight = 0
+        # (-priority, arrival, class, future) of queued requests
+        self._waiters: List[Tuple[int, int, PriorityClass, asyncio.Future]] = []
+        self._arrivals = itertools.count()
+
+    def _can_admit(self, cls: PriorityClass) -> bool:
+        return (cls.in_flight < cls.max_concurrency and
+                self.in_flight < max(1, int(self.capacity * cls.share)))
+
+    async def acquire(self, cls: PriorityClass) -> bool:
+        """Take a slot for the class, queueing up to its latency budget. False means shed."""
+        ahead = any(-priority >= cls.priority for priority, _, _, _ in self._waiters)
+        if not ahead and self._can_admit(cls):
+            self._admit(cls)
+            return True
+        if cls.queued >= cls.max_queue:
+            cls.shed += 1
+            return False
+
+        waiter = (-cls.priority, next(self._arrivals), cls, asyncio.get_running_loop().create_future())
+        admitted = waiter[3]
+        self._waiters.append(waiter)
+        cls.queued += 1
+        # Queued requests ahead of this one may only be blocked by their own class cap
+        self._wake()
+        try:
+            await asyncio.wait([admitted], timeout=cls.latency_budget)
+        except asyncio.CancelledError:
+            # The client went away; give back a slot handed over meanwhile
+            if admitted.done():
+                self.release(cls)
+            else:
+                self._drop(waiter)
+            raise
+        finally:
+            cls.queued -= 1
+        if admitted.done():
+            return True
+        self._drop(waiter)
+        cls.shed += 1
+        return False
+
+    def _drop(self, waiter) -> None:
+        self._waiters.remove(waiter)
+        waiter[3].cancel()
+
+    def _admit(self, cls: PriorityClass) -> None:
+        cls.in_flight += 1
+        cls.admitted += 1
+        self.in_flight += 1
+
+    def _wake(self) -> None:
+        """Hand free slots to waiters in priority order"""
+        self._waiters.sort(key=lambda waiter: waiter[:2])
+        for waiter in list(self._waiters):
+            cls, admitted = waiter[2], waiter[3]
+            if self._can_admit(cls):
+                self._waiters.remove(waiter)
+                self._admit(cls)
+                admitted.set_result(True)
+            elif self.in_flight >= self.capacity:
+                break
+
+    def release(self, cls: PriorityClass) -> None:
+        cls.in_flight -= 1
+        self.in_flight -= 1
+        self._wake()
+
+    def stats(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "classes": {name: cls.stats() for name, cls in self.classes.items()}
+        }
+
+
+class RateLimitBackend(abc.ABC):
+    """Token bucket storage. Subclass to share buckets across workers (e.g. Redis)."""
+
+    @abc.abstractmethod
+    async def consume(self, key: str, rate: float, burst: int) -> float:
+        """Take one token; return 0 when allowed, otherwise seconds until a token is available"""
+
+
+class InMemoryRateLimitBackend(RateLimitBackend):
+    """Per-process token buckets, bounded to the most recently seen clients"""
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def consume(self, key: str, rate: float, burst: int) -> float:
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (float(burst), now))
+        tokens = min(float(burst), tokens + (now - updated) * rate)
+        if tokens >= 1:
+            self._store(key, tokens - 1, now)
+            return 0.0
+        self._store(key, tokens, now)
+        return (1 - tokens) / rate
+
+    def _store(self, key: str, tokens: float, now: float) -> None:
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+
+Network = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+
+def parse_networks(raw: str) -> List[Network]:
+    """Comma separated IPs or CIDR ranges"""
+    return [ipaddress.ip_network(part.strip(), strict=False) for part in raw.split(",") if part.strip()]
+
+
+def _in_networks(address: str, networks: List[Network]) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in networks)
+
+
+def client_key(scope, trusted_proxies: List[Network] = ()) -> str:
+    """
+    Rate limit key: the client IP. Session ids and forwarding headers are chosen by
+    the client, so X-Forwarded-For is only believed when the connection comes from
+    a trusted proxy, and then the client is the nearest hop that is not a proxy.
+    """
+    client = scope.get("client")
+    address = client[0] if client else "unknown"
+    if trusted_proxies and _in_networks(address, trusted_proxies):
+        forwarded = dict(scope.get("headers") or []).get(b"x-forwarded-for")
+        if forwarded:
+            hops = [hop.strip() for hop in forwarded.decode("latin-1").split(",") if hop.strip()]
+            for hop in reversed(hops):
+                address = hop
+                if not _in_networks(hop, trusted_proxies):
+                    break
+    return f"ip:{address}"
+
+
+class AdmissionControlMiddleware:
+    """
+    ASGI middleware that rate limits each client per priority class and caps
+    concurrency, answering fast 429/503 responses with Retry-After instead of
+    letting requests pile up on the Mongo connection pool.
+    """
+
+    exempt_paths = {"/api/", "/api/metrics"}
+
+    def __init__(self, app, controller: Optional[AdmissionController] = None,
+                 rate_limiter: Optional[RateLimitBackend] = None, enabled: bool = True,
+                 trusted_proxies: List[Network] = ()):
+        self.app = app
+        self.controller = controller or admission_controller
+        self.rate_limiter = rate_limiter or InMemoryRateLimitBackend()
+        self.enabled = enabled
+        self.trusted_proxies = list(trusted_proxies)
+
+    async def __call__(self, scope, receive, send):
+        if (not self.enabled or scope["type"] != "http" or scope["method"] == "OPTIONS" or
+                not scope["path"].startswith("/api/") or scope["path"] in self.exempt_paths):
+            await self.app(scope, receive, send)
+            return
+
+        cls = self.controller.classes[classify_request(scope["method"], scope["path"])]
+
+        key = f"{cls.name}:{client_key(scope, self.trusted_proxies)}"
+        retry_after = await self.rate_limiter.consume(key, cls.rate, cls.burst)
+        if retry_after > 0:
+            cls.rate_limited += 1
+            await self._reject(scope, receive, send, 429, "Too many requests", retry_after)
+            return
+
+        if not await self.controller.acquire(cls):
+            await self._reject(scope, receive, send, 503, "Server is busy, please retry", cls.latency_budget)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(cls)
+
+    async def _reject(self, scope, receive, send, status_code: int, detail: str, retry_after: float):
+        response = JSONResponse(
+            {"detail": detail},
+            status_code=status_code,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+        await response(scope, receive, send)
+
+
+ADMISSION_CAPACITY = int(os.environ.get('ADMISSION_MAX_CONCURRENCY', 200))
+admission_controller = AdmissionController(ADMISSION_CAPACITY, default_priority_classes(ADMISSION_CAPACITY))
+admission_enabled = os.environ.get('ADMISSION_ENABLED', 'true').lower() != 'false'
+# Load balancers / reverse proxies whose X-Forwarded-For is trusted, e.g. "10.0.0.0/8"
+admission_trusted_proxies = parse_networks(os.environ.get('ADMISSION_TRUSTED_PROXIES', ''))
@@ -0,0 +1,269 @@
+import asyncio
+import logging
+import os
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from database import db, materials_collection, orders_collection
+
+logger = logging.getLogger(__name__)
+
+# One document per (dimension, key, day) with running totals
+sales_rollups_collection = db.sales_rollups
+
+DIMENSIONS = ("material", "supplier", "category")
+BACKFILL_BATCH_SIZE = 500
+
+# orders.rollup_applied: absent until an updater claims the order, CLAIMED while its
+# increments are applied, True once they are. Claims are atomic, so the live updater
+# and a backfill never both count one order.
+CLAIMED = "pending"
+UNCLAIMED = {"rollup_applied": {"$exists": False}}
+
+RollupKey = Tuple[str, object, str]
+
+# Trending scores are stored relative to a fixed epoch: an order adds
+# 2 ** (hours since epoch / half-life), so one $inc per checkout keeps every
+# material's score proportional to its decayed order count without rewriting
+# the others. Scores stay finite for about 1000 half-lives (eight years at the
+# default); before then move TRENDING_EPOCH forward and run
+# `manage.py backfill-rollups --rebuild`.
+TRENDING_EPOCH = datetime.fromisoformat(os.environ.get('TRENDING_EPOCH', '2025-01-01'))
+TRENDING_HALF_LIFE_HOURS = float(os.environ.get('TRENDING_HALF_LIFE_HOURS', 72))
+
+
+async def ensure_rollup_indexes():
+    """Create the indexes used by rollup upserts and dashboard queries"""
+    await sales_rollups_collection.create_index(
+        [("dimension", 1), ("key", 1), ("day", 1)], unique=True
+    )
+    await sales_rollups_collection.create_index([("dimension", 1), ("day", 1)])
+
+
+def day_of(timestamp: datetime) -> str:
+    return timestamp.strftime("%Y-%m-%d")
+
+
+async def material_dimensions(material_ids: Iterable[int]) -> Dict[int, dict]:
+    """Resolve supplier and category for the ordered materials in one $in query"""
+    material_ids = list(set(material_ids))
+    cursor = materials_collection.find(
+        {"id": {"$in": material_ids}},
+        {"_id": 0, "id": 1, "supplier_id": 1, "category": 1}
+    )
+    return {material["id"]: material for material in await cursor.to_list(len(material_ids))}
+
+
+async def accumulate_orders(orders: List[dict]) -> Dict[RollupKey, Dict[str, float]]:
+    """Fold a batch of orders into per-dimension daily increments"""
+    dimensions = await material_dimensions(
+        item["material_id"] for order in orders for item in order.get("items", [])
+    )
+    totals: Dict[RollupKey, Dict[str, float]] = defaultdict(lambda: {"quantity": 0, "revenue": 0, "orders": 0})
+
+    for order in orders:
+        day = day_of(order["created_at"])
+        seen = set()
+        for item in order.get("items", []):
+            material = dimensions.get(item["material_id"], {})
+            keys = [("material", item["material_id"], day)]
+            if "supplier_id" in material:
+                keys.append(("supplier", material["supplier_id"], day))
+            if "category" in material:
+                keys.append(("category", material["category"], day))
+            for key in keys:
+                totals[key]["quantity"] += item["quantity"]
+                totals[key]["revenue"] += item.get("total", item["price"] * item["quantity"])
+                # An order counts once per rollup even if it has several matching lines
+                if key not in seen:
+                    totals[key]["orders"] += 1
+                    seen.add(key)
+    return totals
+
+
+async def apply_increments(totals: Dict[RollupKey, Dict[str, float]]) -> int:
+    """Upsert increments into the rollup documents with one unordered bulk write"""
+    if not totals:
+        return 0
+    now = datetime.utcnow()
+    operations = [
+        UpdateOne(
+            {"dimension": dimension, "key": key, "day": day},
+            {"$inc": increments, "$set": {"updated_at": now}},
+            upsert=True
+        )
+        for (dimension, key, day), increments in totals.items()
+    ]
+    await sales_rollups_collection.bulk_write(operations, ordered=False)
+    return len(operations)
+
+
+def trending_weight(at: datetime) -> float:
+    return 2 ** ((at - TRENDING_EPOCH).total_seconds() / 3600 / TRENDING_HALF_LIFE_HOURS)
+
+
+async def apply_popularity(orders: List[dict]) -> int:
+    """Bump order_count and trending_score on the ordered materials, once per order"""
+    increments: Dict[int, Dict[str, float]] = defaultdict(lambda: {"order_count": 0, "trending_score": 0.0})
+    for order in orders:
+        weight = trending_weight(order["created_at"])
+        for material_id in {item["material_id"] for item in order.get("items", [])}:
+            increments[material_id]["order_count"] += 1
+            increments[material_id]["trending_score"] += weight
+    if not increments:
+        return 0
+    await materials_collection.bulk_write([
+        UpdateOne({"id": material_id}, {"$inc": inc}) for material_id, inc in increments.items()
+    ], ordered=False)
+    return len(increments)
+
+
+async def record_order_sales(order: dict) -> None:
+    """Incrementally fold a newly inserted order into the rollups, unless a backfill claimed it first"""
+    claimed = await orders_collection.find_one_and_update(
+        {"_id": order["_id"], **UNCLAIMED}, {"$set": {"rollup_applied": CLAIMED}}, projection={"_id": 1}
+    )
+    if claimed is None:
+        return
+    try:
+        totals = await accumulate_orders([order])
+    except Exception:
+        # Nothing was written yet, so the next backfill may take the order
+        await orders_collection.update_one(
+            {"_id": order["_id"], "rollup_applied": CLAIMED}, {"$unset": {"rollup_applied": ""}}
+        )
+        raise
+    await apply_increments(totals)
+    await apply_popularity([order])
+    await orders_collection.update_one({"_id": order["_id"]}, {"$set": {"rollup_applied": True}})
+
+
+_pending_rollups = set()
+
+
+def schedule_order_rollup(order: dict) -> None:
+    """Update rollups in the background so checkout latency is unaffected"""
+    async def run():
+        try:
+            await record_order_sales(order)
+        except Exception as e:
+            # A failure before any rollup write leaves the order to the next backfill; one after it
+            # keeps the claim, since applying the order again could count it twice
+            logger.error(f"Error updating sales rollups for order {order.get('_id')}: {e}")
+
+    task = asyncio.create_task(run())
+    _pending_rollups.add(task)
+    task.add_done_callback(_pending_rollups.discard)
+
+
+async def drain_pending_rollups() -> None:
+    """Wait for in-flight rollup updates, e.g. on shutdown"""
+    if _pending_rollups:
+        await asyncio.gather(*list(_pending_rollups), return_exceptions=True)
+
+
+async def backfill_rollups(rebuild: bool = False, batch_size: int = BACKFILL_BATCH_SIZE) -> dict:
+    """
+    Fold every unclaimed order into the rollups and popularity counters, streaming
+    the orders collection in batches so memory stays bounded. Each batch is claimed
+    atomically first, so this is safe while the server takes orders.
+
+    With rebuild=True both are dropped and recomputed from scratch, including orders
+    left claimed by a failed or interrupted update. That also resets claims held by
+    in-flight checkouts, so rebuild only with order writes stopped.
+    """
+    if rebuild:
+        await sales_rollups_collection.delete_many({})
+        await materials_collection.update_many({}, {"$unset": {"order_count": "", "trending_score": ""}})
+        await orders_collection.update_many(
+            {"rollup_applied": {"$exists": True}}, {"$unset": {"rollup_applied": "", "rollup_claim": ""}}
+        )
+
+    processed = 0
+    upserts = 0
+    cursor = orders_collection.find(UNCLAIMED, {"_id": 1, "items": 1, "created_at": 1}).batch_size(batch_size)
+
+    batch = []
+    async for order in cursor:
+        batch.append(order)
+        if len(batch) >= batch_size:
+            batch_processed, batch_upserts = await _backfill_batch(batch)
+            processed, upserts = processed + batch_processed, upserts + batch_upserts
+            batch = []
+    if batch:
+        batch_processed, batch_upserts = await _backfill_batch(batch)
+        processed, upserts = processed + batch_processed, upserts + batch_upserts
+
+    # In-flight checkouts, plus any update that failed part way and needs a rebuild
+    claimed = await orders_collection.count_documents({"rollup_applied": CLAIMED})
+    return {"orders_processed": processed, "rollups_upserted": upserts, "orders_claimed": claimed}
+
+
+async def _backfill_batch(orders: List[dict]) -> Tuple[int, int]:
+    """Claim the batch's still-unclaimed orders, then fold in exactly those"""
+    claim = uuid.uuid4().hex
+    order_ids = [order["_id"] for order in orders]
+    await orders_collection.update_many(
+        {"_id": {"$in": order_ids}, **UNCLAIMED},
+        {"$set": {"rollup_applied": CLAIMED, "rollup_claim": claim}}
+    )
+    claimed = {
+        order["_id"] for order in await orders_collection.find(
+            {"_id": {"$in": order_ids}, "rollup_claim": claim}, {"_id": 1}
+        ).to_list(None)
+    }
+    orders = [order for order in orders if order["_id"] in claimed]
+    if not orders:
+        return 0, 0
+
+    upserts = await apply_increments(await accumulate_orders(orders))
+    await apply_popularity(orders)
+    await orders_collection.update_many(
+        {"_id": {"$in": list(claimed)}, "rollup_claim": claim},
+        {"$set": {"rollup_applied": True}, "$unset": {"rollup_claim": ""}}
+    )
+    return len(orders), upserts
+
+
+def day_range(start: Optional[str], end: Optional[str], default_days: int = 30) -> Tuple[str, str]:
+    """Normalize an inclusive YYYY-MM-DD range, defaulting to the last `default_days` days"""
+    end_day = end or day_of(datetime.utcnow())
+    start_day = start or day_of(datetime.strptime(end_day, "%Y-%m-%d") - timedelta(days=default_days - 1))
+    # Validate the format
+    datetime.strptime(start_day, "%Y-%m-%d")
+    datetime.strptime(end_day, "%Y-%m-%d")
+    return start_day, end_day
+
+
+async def get_daily_sales(dimension: str, key, start: Optional[str] = None, end: Optional[str] = None) -> List[dict]:
+    """Daily series for one material, supplier or category read straight from the rollups"""
+    start_day, end_day = day_range(start, end)
+    cursor = sales_rollups_collection.find(
+        {"dimension": dimension, "key": key, "day": {"$gte": start_day, "$lte": end_day}},
+        {"_id": 0, "day": 1, "quantity": 1, "revenue": 1, "orders": 1}
+    ).sort("day", 1)
+    return await cursor.to_list(None)
+
+
+async def get_top_sellers(dimension: str, start: Optional[str] = None, end: Optional[str] = None,
+                          sort_by: str = "revenue", limit: int = 10) -> List[dict]:
+    """Rank materials, suppliers or categories over a day range using only the rollups"""
+    start_day, end_day = day_range(start, end)
+    pipeline = [
+        {"$match": {"dimension": dimension, "day": {"$gte": start_day, "$lte": end_day}}},
+        {"$group": {
+            "_id": "$key",
+            "quantity": {"$sum": "$quantity"},
+            "revenue": {"$sum": "$revenue"},
+            "orders": {"$sum": "$orders"}
+        }},
+        {"$sort": {sort_by: -1}},
+        {"$limit": limit},
+        {"$project": {"_id": 0, "key": "$_id", "quantity": 1, "revenue": 1, "orders": 1}}
+    ]
+    return await sales_rollups_collection.aggregate(pipeline).to_list(limit)
+
@@ -0,0 +1,95 @@
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+import os
+import time
+
+
+class LRUCache:
+    """Bounded least-recently-used cache with optional TTL and explicit invalidation"""
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _lookup(self, key: Hashable) -> Tuple[bool, Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return False, None
+        expires_at, value = entry
+        if expires_at and expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return False, None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return True, value
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get a cached value and mark it as recently used"""
+        found, value = self._lookup(key)
+        return value if found else default
+
+    def get_many(self, keys: Iterable[Hashable]) -> Tuple[Dict[Hashable, Any], List[Hashable]]:
+        """Split keys into cached values and keys that still need loading"""
+        found = {}
+        missing = []
+        for key in keys:
+            hit, value = self._lookup(key)
+            if hit:
+                found[key] = value
+            else:
+                missing.append(key)
+        return found, missing
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Store a value, evicting the least recently used entry when full"""
+        expires_at = time.monotonic() + self.ttl if self.ttl else 0
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        """Drop a single entry"""
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        """Drop every entry"""
+        self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+# Per-id cache of formatted materials (with supplier) for detail and batch lookups.
+# The TTL bounds staleness for edits made directly in the database.
+material_cache = LRUCache(
+    maxsize=int(os.environ.get('MATERIAL_CACHE_SIZE', 1024)),
+    ttl=float(os.environ.get('MATERIAL_CACHE_TTL', 300))
+)
+
+
+def invalidate_material(material_id: int) -> None:
+    """Invalidate a single material after it has been written"""
+    material_cache.invalidate(material_id)
+
+
+def invalidate_materials() -> None:
+    """Invalidate every cached material, e.g. after a supplier change"""
+    material_cache.clear()
+
+
+def invalidate_catalog_caches(material_ids: Optional[Iterable[int]] = None) -> None:
+    """Catalog coherence listener: drop the changed materials, or everything when unknown"""
+    if material_ids is None:
+        invalidate_materials()
+        return
+    for material_id in material_ids:
+        invalidate_material(material_id)
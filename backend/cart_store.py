@@ -0,0 +1,246 @@
+import abc
+import asyncio
+import copy
+import logging
+import os
+import time
+import weakref
+from contextlib import asynccontextmanager
+from typing import Dict, Iterable, Optional, Set
+
+from pymongo import DeleteOne, ReplaceOne
+
+logger = logging.getLogger(__name__)
+
+
+class CartEdit:
+    """A private copy of one cart; nothing is stored unless save() or delete() is called"""
+
+    def __init__(self, cart: Optional[Dict]):
+        self.cart = copy.deepcopy(cart)
+        self.action: Optional[str] = None
+
+    def save(self, cart: Dict) -> None:
+        self.cart = cart
+        self.action = "save"
+
+    def delete(self) -> None:
+        self.cart = None
+        self.action = "delete"
+
+
+class CartStore(abc.ABC):
+    """
+    Cart persistence behind a per-session lock. Handlers read with get() and change
+    a cart inside `async with store.edit(session_id) as edit`, so two requests for
+    the same session cannot interleave their read-modify-write.
+    """
+
+    # Reported by stats(); each store names where carts live
+    backend: str = "custom"
+
+    def __init__(self):
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    def _lock(self, session_id: str) -> asyncio.Lock:
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = self._locks[session_id] = asyncio.Lock()
+        return lock
+
+    @asynccontextmanager
+    async def edit(self, session_id: str):
+        async with self._lock(session_id):
+            edit = CartEdit(await self._load(session_id))
+            yield edit
+            if edit.action == "save":
+                await self._save(session_id, edit.cart)
+            elif edit.action == "delete":
+                await self._delete(session_id)
+
+    async def delete(self, session_id: str) -> None:
+        async with self.edit(session_id) as edit:
+            edit.delete()
+
+    @abc.abstractmethod
+    async def get(self, session_id: str, projection: Optional[Dict] = None) -> Optional[Dict]:
+        """The committed cart; stores that read from MongoDB apply `projection`"""
+
+    @abc.abstractmethod
+    async def _load(self, session_id: str) -> Optional[Dict]:
+        """The cart an edit starts from"""
+
+    @abc.abstractmethod
+    async def _save(self, session_id: str, cart: Dict) -> None:
+        """Commit an edited cart"""
+
+    @abc.abstractmethod
+    async def _delete(self, session_id: str) -> None:
+        """Commit a cart's removal"""
+
+    async def flush(self, session_ids: Optional[Iterable[str]] = None) -> int:
+        """Make pending writes durable; a no-op for stores that write through"""
+        return 0
+
+    def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": self.backend}
+
+
+class MongoCartStore(CartStore):
+    """Writes every change straight through to the carts collection"""
+
+    backend = "mongo"
+
+    def __init__(self, collection, causal_sessions):
+        super().__init__()
+        self.collection = collection
+        self.causal_sessions = causal_sessions
+
+    async def get(self, session_id: str, projection: Optional[Dict] = None) -> Optional[Dict]:
+        async with self.causal_sessions.start() as session:
+            return await self.causal_sessions.reader(self.collection).find_one(
+                {"session_id": session_id}, projection, session=session
+            )
+
+    async def _load(self, session_id: str) -> Optional[Dict]:
+        # Read-modify-write always reads the primary
+        return await self.collection.find_one({"session_id": session_id})
+
+    async def _save(self, session_id: str, cart: Dict) -> None:
+        async with self.causal_sessions.start() as session:
+            await self.collection.replace_one({"session_id": session_id}, cart, upsert=True, session=session)
+
+    async def _delete(self, session_id: str) -> None:
+        async with self.causal_sessions.start() as session:
+            await self.collection.delete_one({"session_id": session_id}, session=session)
+
+
+class WriteBehindCartStore(CartStore):
+    """
+    Keeps active carts in process memory and coalesces their changes: a background
+    task writes every cart changed since the last pass in one unordered bulk_write,
+    so a burst of edits to one cart costs a single write. Checkout and shutdown
+    flush synchronously. Idle, clean carts are evicted.
+
+    Memory is authoritative for carts it holds, so every request for a session must
+    reach the same process: run a single worker or route sessions stickily.
+    """
+
+    backend = "memory"
+
+    def __init__(self, collection, flush_interval: float = 1.0, idle_seconds: float = 900.0):
+        super().__init__()
+        self.collection = collection
+        self.flush_interval = flush_interval
+        self.idle_seconds = idle_seconds
+        # None marks a cart known to be absent (or deleted, until flushed)
+        self.carts: Dict[str, Optional[Dict]] = {}
+        self.last_used: Dict[str, float] = {}
+        self.dirty: Set[str] = set()
+        self.edits = 0
+        self.writes = 0
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    async def _load(self, session_id: str) -> Optional[Dict]:
+        self.last_used[session_id] = time.monotonic()
+        if session_id not in self.carts:
+            cart = await self.collection.find_one({"session_id": session_id})
+            # An edit committed while the read was in flight wins
+            return self.carts.setdefault(session_id, cart)
+        return self.carts[session_id]
+
+    async def get(self, session_id: str, projection: Optional[Dict] = None) -> Optional[Dict]:
+        # Committed carts are replaced, never mutated, so readers may share them
+        return await self._load(session_id)
+
+    async def _save(self, session_id: str, cart: Dict) -> None:
+        self.carts[session_id] = cart
+        self.dirty.add(session_id)
+        self.edits += 1
+
+    async def _delete(self, session_id: str) -> None:
+        self.carts[session_id] = None
+        self.dirty.add(session_id)
+        self.edits += 1
+
+    async def flush(self, session_ids: Optional[Iterable[str]] = None) -> int:
+        async with self._flush_lock:
+            pending = set(self.dirty) if session_ids is None else self.dirty.intersection(session_ids)
+            if not pending:
+                return 0
+            operations = []
+            for session_id in pending:
+                cart = self.carts.get(session_id)
+                if cart is None:
+                    operations.append(DeleteOne({"session_id": session_id}))
+                else:
+                    operations.append(ReplaceOne({"session_id": session_id}, cart, upsert=True))
+            # Edits made while the write is in flight mark the cart dirty again
+            self.dirty -= pending
+            try:
+                await self.collection.bulk_write(operations, ordered=False)
+            except Exception:
+                self.dirty |= pending
+                raise
+            self.writes += len(operations)
+            return len(operations)
+
+    def evict_idle(self) -> int:
+        cutoff = time.monotonic() - self.idle_seconds
+        idle = [
+            session_id for session_id, used in self.last_used.items()
+            if used < cutoff and session_id not in self.dirty and session_id not in self._locks
+        ]
+        for session_id in idle:
+            self.carts.pop(session_id, None)
+            self.last_used.pop(session_id, None)
+        return len(idle)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                self.evict_idle()
+            except Exception as e:
+                logger.error(f"Error flushing carts: {e}")
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend,
+            "carts": len(self.carts),
+            "dirty": len(self.dirty),
+            "edits": self.edits,
+            "writes": self.writes
+        }
+
+
+def create_cart_store(collection, causal_sessions) -> CartStore:
+    """CART_STORE=memory enables the write-behind store; the default writes through"""
+    if os.environ.get('CART_STORE', 'mongo').lower() == 'memory':
+        return WriteBehindCartStore(
+            collection,
+            flush_interval=float(os.environ.get('CART_FLUSH_INTERVAL', 1.0)),
+            idle_seconds=float(os.environ.get('CART_IDLE_SECONDS', 900))
+        )
+    return MongoCartStore(collection, causal_sessions)
@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Union
+
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Listener receives the set of changed material IDs, or None when everything must be dropped
+CatalogListener = Callable[[Optional[Set[int]]], Union[None, Awaitable[None]]]
+
+CATALOG_VERSION_ID = "catalog"
+# Replaying more events than this is slower than simply dropping every cache
+MAX_REPLAY_EVENTS = 500
+
+
+class CatalogCoherence:
+    """
+    Keeps per-process catalog caches coherent across worker processes.
+
+    Every catalog write bumps a version stamp in `catalog_versions` and records an
+    event in `catalog_events`. Each worker tracks the last version it applied and
+    replays newer events into its local caches, woken by a change stream on
+    `catalog_events` when MongoDB runs as a replica set and by polling otherwise.
+    """
+
+    def __init__(self, database, poll_interval: float = 1.0, event_ttl: int = 86400, change_log=None):
+        self.versions = database.catalog_versions
+        self.change_log = change_log
+        self.events = database.catalog_events
+        self.poll_interval = poll_interval
+        self.event_ttl = event_ttl
+        self.version = 0
+        self.mode = "stopped"
+        self._listeners: List[CatalogListener] = []
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    def subscribe(self, listener: CatalogListener) -> None:
+        """Register a callback that invalidates a local cache"""
+        self._listeners.append(listener)
+
+    async def current_version(self) -> int:
+        """Read the cluster-wide catalog version"""
+        doc = await self.versions.find_one({"_id": CATALOG_VERSION_ID})
+        return doc["version"] if doc else 0
+
+    async def start(self) -> None:
+        """Start watching for catalog changes made by any worker"""
+        await self.events.create_index("version", unique=True)
+        await self.events.create_index("created_at", expireAfterSeconds=self.event_ttl)
+        self.version = await self.current_version()
+        self._task = asyncio.create_task(self._run())
+
+    @property
+    def running(self) -> bool:
+        """False before start() and once the watch loop has died"""
+        return self._task is not None and not self._task.done()
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.mode = "stopped"
+
+    async def publish(self, material_ids: Optional[Iterable[int]] = None, reason: str = "",
+                      changes: Optional[Dict[str, Iterable]] = None) -> int:
+        """
+        Record a catalog change and return the new version. Pass the changed
+        material IDs for targeted invalidation, or None to drop every cache.
+        `changes` ({"suppliers": [...], ...}) feeds the delta-sync change log and
+        defaults to the changed materials.
+        """
+        if material_ids is not None:
+            material_ids = sorted(set(material_ids))
+        if changes is None and material_ids is not None:
+            changes = {"materials": material_ids}
+        now = datetime.utcnow()
+        # Bump the version and mark it in flight in one atomic update, so delta-sync
+        # clients are never told a version whose changes are not logged yet
+        doc = await self.versions.find_one_and_update(
+            {"_id": CATALOG_VERSION_ID},
+            [
+                {"$set": {"version": {"$add": [{"$ifNull": ["$version", 0]}, 1]}}},
+                {"$set": {"pending": {"$concatArrays": [
+                    {"$ifNull": ["$pending", []]}, [{"version": "$version", "at": now}]
+                ]}}}
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        version = doc["version"]
+        try:
+            if self.change_log is not None:
+                await self.change_log.record(version, changes)
+            await self.events.insert_one({
+                "version": version,
+                "material_ids": material_ids,
+                "reason": reason,
+                "created_at": now
+            })
+        finally:
+            await self.versions.update_one({"_id": CATALOG_VERSION_ID}, {"$pull": {"pending": {"version": version}}})
+        # Apply locally right away instead of waiting for the watcher
+        await self.sync()
+        return version
+
+    async def sync(self) -> None:
+        """Replay catalog events newer than the locally applied version"""
+        async with self._lock:
+            latest = await self.current_version()
+            if latest <= self.version:
+                return
+
+            changed: Optional[Set[int]] = set()
+            if latest - self.version > MAX_REPLAY_EVENTS:
+                changed = None
+            else:
+                events = await self.events.find(
+                    {"version": {"$gt": self.version, "$lte": latest}}
+                ).sort("version", 1).to_list(MAX_REPLAY_EVENTS)
+                # A missing event (not yet inserted or already expired) forces a full drop
+                if len(events) != latest - self.version:
+                    changed = None
+                else:
+                    for event in events:
+                        if event.get("material_ids") is None:
+                            changed = None
+                            break
+                        changed.update(event["material_ids"])
+
+            await self._notify(changed)
+            self.version = latest
+
+    async def _notify(self, changed: Optional[Set[int]]) -> None:
+        for listener in self._listeners:
+            try:
+                result = listener(changed)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                logger.error(f"Catalog invalidation listener failed: {e}")
+
+    async def _run(self) -> None:
+        try:
+            self.mode = "change_stream"
+            async with self.events.watch([{"$match": {"operationType": "insert"}}]) as stream:
+                # Catch up on anything written between start() and opening the stream
+                await self.sync()
+                async for _ in stream:
+                    await self.sync()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Standalone servers reject change streams; fall back to polling
+            logger.info(f"Change streams unavailable ({e}); polling catalog version every {self.poll_interval}s")
+
+        self.mode = "polling"
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.sync()
+            except PyMongoError as e:
+                logger.warning(f"Catalog version poll failed: {e}")
+
+    def stats(self) -> dict:
+        return {"version": self.version, "mode": self.mode, "listeners": len(self._listeners)}
+
+
+def create_catalog_coherence(database, change_log=None) -> CatalogCoherence:
+    return CatalogCoherence(
+        database,
+        poll_interval=float(os.environ.get('CATALOG_SYNC_INTERVAL', 1.0)),
+        event_ttl=int(os.environ.get('CATALOG_EVENT_TTL', 86400)),
+        change_log=change_log
+    )
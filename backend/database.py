@@ -1,9 +1,12 @@
 from motor.motor_asyncio import AsyncIOMotorClient
 from models import SupplierDB, CategoryDB, RawMaterialDB
 import os
+import re
 
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+from read_routing import catalog_read_preference
+from fields import MATERIAL_SELECTABLE_FIELDS, subfields, to_projection
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
@@ -17,6 +20,31 @@ materials_collection = db.raw_materials
 carts_collection = db.carts
 orders_collection = db.orders
 
+# Read-mostly catalog queries, routed per CATALOG_READ_PREFERENCE (bounded staleness on secondaries).
+# Everything that fills the material cache (per-id lookups, startup priming) stays on the primary,
+# so entries are never older than the catalog version coherence has already recorded.
+catalog_db = db.with_options(read_preference=catalog_read_preference)
+catalog_suppliers = catalog_db.suppliers
+catalog_categories = catalog_db.categories
+catalog_materials = catalog_db.raw_materials
+
+async def ensure_indexes():
+    """Create the indexes used by catalog lookups"""
+    await materials_collection.create_index("id", unique=True)
+    await suppliers_collection.create_index("id", unique=True)
+    await categories_collection.create_index("id", unique=True)
+    # Compound indexes backing category / supplier / flag filters combined with price ranges
+    await materials_collection.create_index([("category", 1), ("price", 1)])
+    await materials_collection.create_index([("supplier_id", 1), ("price", 1)])
+    await materials_collection.create_index([("hasGroupDeal", 1), ("price", 1)])
+    await materials_collection.create_index("price")
+    # Popularity sorts, maintained at checkout by analytics.apply_popularity
+    await materials_collection.create_index([("order_count", -1), ("name", 1)])
+    await materials_collection.create_index([("trending_score", -1), ("name", 1)])
+    # Order history and date-range exports
+    await orders_collection.create_index([("session_id", 1), ("created_at", -1)])
+    await orders_collection.create_index("created_at")
+
 async def seed_database():
     """Seed the database with initial data"""
     
@@ -26,11 +54,16 @@ async def seed_database():
     
     # Seed Suppliers
     suppliers_data = [
-        {"id": 1, "name": "Fresh Farm Co.", "verified": True, "location": "Mumbai"},
-        {"id": 2, "name": "Green Valley Suppliers", "verified": True, "location": "Delhi"},
-        {"id": 3, "name": "Spice Master Ltd.", "verified": False, "location": "Chennai"},
-        {"id": 4, "name": "Quality Foods Inc.", "verified": True, "location": "Bangalore"},
-        {"id": 5, "name": "Local Market Hub", "verified": False, "location": "Pune"}
+        {"id": 1, "name": "Fresh Farm Co.", "verified": True, "location": "Mumbai",
+         "geo": {"type": "Point", "coordinates": [72.8777, 19.0760]}},
+        {"id": 2, "name": "Green Valley Suppliers", "verified": True, "location": "Delhi",
+         "geo": {"type": "Point", "coordinates": [77.2090, 28.6139]}},
+        {"id": 3, "name": "Spice Master Ltd.", "verified": False, "location": "Chennai",
+         "geo": {"type": "Point", "coordinates": [80.2707, 13.0827]}},
+        {"id": 4, "name": "Quality Foods Inc.", "verified": True, "location": "Bangalore",
+         "geo": {"type": "Point", "coordinates": [77.5946, 12.9716]}},
+        {"id": 5, "name": "Local Market Hub", "verified": False, "location": "Pune",
+         "geo": {"type": "Point", "coordinates": [73.8567, 18.5204]}}
     ]
     await suppliers_collection.insert_many(suppliers_data)
     
@@ -53,63 +86,65 @@ async def seed_database():
             "id": 1, "name": "Fresh Tomatoes", "category": "tomatoes", "price": 45, "unit": "kg",
             "supplier_id": 1, "image": "https://images.unsplash.com/photo-1546470427-227527c9e1eb?w=400&h=300&fit=crop",
             "inStock": True, "description": "Fresh red tomatoes, perfect for street food preparation",
-            "groupPrice": 38, "minGroupQuantity": 50
+            "groupPrice": 38, "minGroupQuantity": 50, "available_qty": 500
         },
         {
             "id": 2, "name": "Wheat Flour", "category": "flour", "price": 35, "unit": "kg",
             "supplier_id": 2, "image": "https://images.unsplash.com/photo-1574323347407-f5e1ad6d020b?w=400&h=300&fit=crop",
             "inStock": True, "description": "Premium quality wheat flour for breads and rotis",
-            "groupPrice": 30, "minGroupQuantity": 100
+            "groupPrice": 30, "minGroupQuantity": 100, "available_qty": 1000
         },
         {
             "id": 3, "name": "Sunflower Oil", "category": "oil", "price": 120, "unit": "liter",
             "supplier_id": 4, "image": "https://images.unsplash.com/photo-1474979266404-7eaacbcd87c5?w=400&h=300&fit=crop",
             "inStock": True, "description": "Pure sunflower oil for cooking and frying",
-            "groupPrice": 110, "minGroupQuantity": 20
+            "groupPrice": 110, "minGroupQuantity": 20, "available_qty": 200
         },
         {
             "id": 4, "name": "Red Chili Powder", "category": "spices", "price": 180, "unit": "kg",
             "supplier_id": 3, "image": "https://images.unsplash.com/photo-1596040033229-a9821ebd058d?w=400&h=300&fit=crop",
             "inStock": False, "description": "Spicy red chili powder for authentic taste",
-            "groupPrice": 160, "minGroupQuantity": 10
+            "groupPrice": 160, "minGroupQuantity": 10, "available_qty": 0
         },
         {
             "id": 5, "name": "Large Onions", "category": "onions", "price": 30, "unit": "kg",
             "supplier_id": 1, "image": "https://images.unsplash.com/photo-1518977676601-b53f82aba655?w=400&h=300&fit=crop",
             "inStock": True, "description": "Fresh large onions for cooking base",
-            "groupPrice": 25, "minGroupQuantity": 100
+            "groupPrice": 25, "minGroupQuantity": 100, "available_qty": 800
         },
         {
             "id": 6, "name": "Basmati Rice", "category": "rice", "price": 85, "unit": "kg",
             "supplier_id": 2, "image": "https://images.unsplash.com/photo-1586201375761-83865001e31c?w=400&h=300&fit=crop",
             "inStock": True, "description": "Premium basmati rice for biryanis and pulao",
-            "groupPrice": 78, "minGroupQuantity": 50
+            "groupPrice": 78, "minGroupQuantity": 50, "available_qty": 400
         },
         {
             "id": 7, "name": "Turmeric Powder", "category": "spices", "price": 220, "unit": "kg",
             "supplier_id": 3, "image": "https://images.unsplash.com/photo-1615485500704-8e990f9900f7?w=400&h=300&fit=crop",
             "inStock": True, "description": "Pure turmeric powder for color and flavor",
-            "groupPrice": 200, "minGroupQuantity": 5
+            "groupPrice": 200, "minGroupQuantity": 5, "available_qty": 60
         },
         {
             "id": 8, "name": "Green Vegetables Mix", "category": "vegetables", "price": 55, "unit": "kg",
             "supplier_id": 5, "image": "https://images.unsplash.com/photo-1540420773420-3366772f4999?w=400&h=300&fit=crop",
             "inStock": True, "description": "Fresh mixed green vegetables",
-            "groupPrice": 48, "minGroupQuantity": 30
+            "groupPrice": 48, "minGroupQuantity": 30, "available_qty": 150
         },
         {
             "id": 9, "name": "Chicken (Fresh)", "category": "meat", "price": 280, "unit": "kg",
             "supplier_id": 4, "image": "https://images.unsplash.com/photo-1604503468506-a8da13d82791?w=400&h=300&fit=crop",
             "inStock": True, "description": "Fresh chicken for non-veg preparations",
-            "groupPrice": 260, "minGroupQuantity": 20
+            "groupPrice": 260, "minGroupQuantity": 20, "available_qty": 120
         },
         {
             "id": 10, "name": "Cumin Seeds", "category": "spices", "price": 350, "unit": "kg",
             "supplier_id": 3, "image": "https://images.unsplash.com/photo-1506905925346-21bda4d32df4?w=400&h=300&fit=crop",
             "inStock": True, "description": "Aromatic cumin seeds for seasoning",
-            "groupPrice": 320, "minGroupQuantity": 5
+            "groupPrice": 320, "minGroupQuantity": 5, "available_qty": 40
         }
     ]
+    for material in materials_data:
+        material["hasGroupDeal"] = has_group_deal(material["price"], material["groupPrice"])
     await materials_collection.insert_many(materials_data)
     
     return "Database seeded successfully"
@@ -119,67 +154,157 @@ async def get_supplier_by_id(supplier_id: int):
     supplier = await suppliers_collection.find_one({"id": supplier_id})
     return supplier
 
-async def get_all_suppliers():
+async def get_all_suppliers(projection=None):
     """Get all suppliers"""
-    suppliers = await suppliers_collection.find().to_list(100)
+    suppliers = await catalog_suppliers.find({}, projection).to_list(100)
     return suppliers
 
-async def get_all_categories():
+async def get_all_categories(projection=None):
     """Get all categories"""
-    categories = await categories_collection.find().to_list(100)
+    categories = await catalog_categories.find({}, projection).to_list(100)
     return categories
 
+def supplier_lookup_stages(supplier_fields=None):
+    """
+    Pipeline stages that join each material with its supplier. With supplier_fields
+    only those fields are read through a $lookup sub-pipeline; an empty set skips
+    the join altogether.
+    """
+    lookup = {
+        "from": "suppliers",
+        "localField": "supplier_id",
+        "foreignField": "id",
+        "as": "supplier"
+    }
+    if supplier_fields is not None:
+        if not supplier_fields:
+            return []
+        lookup["pipeline"] = [{"$project": {"_id": 0, **{field: 1 for field in sorted(supplier_fields)}}}]
+    return [
+        {
+            "$lookup": lookup
+        },
+        {
+            "$unwind": "$supplier"
+        }
+    ]
+
+async def get_materials_by_ids(material_ids):
+    """Get materials with their supplier information for many IDs in one $in query"""
+    material_ids = list(material_ids)
+    if not material_ids:
+        return []
+    
+    pipeline = [{"$match": {"id": {"$in": material_ids}}}] + supplier_lookup_stages()
+    materials = await materials_collection.aggregate(pipeline).to_list(len(material_ids))
+    return materials
+
+async def get_materials_for_cache(limit):
+    """Up to `limit` materials with their suppliers, read from the primary like every material cache fill"""
+    pipeline = [{"$sort": {"name": 1}}, {"$limit": limit}] + supplier_lookup_stages()
+    return await materials_collection.aggregate(pipeline).to_list(limit)
+
+def split_csv(value):
+    """Split a comma separated query value into a list of non-empty tokens"""
+    if not value:
+        return []
+    if isinstance(value, (list, tuple, set)):
+        return [str(token) for token in value if str(token).strip()]
+    return [token.strip() for token in str(value).split(",") if token.strip()]
+
+def has_group_deal(price, group_price):
+    """Precomputed flag stored on each material so group-deal filters can use an index"""
+    return group_price < price
+
+async def backfill_group_deal_flags():
+    """Store hasGroupDeal on materials written before the flag existed"""
+    result = await materials_collection.update_many(
+        {"hasGroupDeal": {"$exists": False}},
+        [{"$set": {"hasGroupDeal": {"$lt": ["$groupPrice", "$price"]}}}]
+    )
+    return result.modified_count
+
+async def resolve_supplier_ids(query_params):
+    """
+    Compile supplier-side filters (explicit IDs, location, verified, nearby) into a
+    list of supplier IDs so materials can be filtered on the indexed supplier_id field
+    before the $lookup. Returns None when no supplier filter applies.
+    """
+    supplier_ids = query_params.get('supplier_ids') or []
+    locations = split_csv(query_params.get('location'))
+    verified_only = 'verified' in split_csv(query_params.get('filter_by'))
+    nearby_ids = query_params.get('nearby_supplier_ids')
+    
+    if nearby_ids is not None and not (supplier_ids or locations or verified_only):
+        return list(nearby_ids)
+    if not (supplier_ids or locations or verified_only):
+        return None
+    
+    supplier_match = {}
+    if supplier_ids:
+        supplier_match['id'] = {"$in": list(supplier_ids)}
+    if nearby_ids is not None:
+        supplier_match.setdefault('id', {})['$in'] = [
+            supplier_id for supplier_id in nearby_ids if not supplier_ids or supplier_id in supplier_ids
+        ]
+    if locations:
+        supplier_match['location'] = {
+            "$in": [re.compile(f"^{re.escape(location)}$", re.IGNORECASE) for location in locations]
+        }
+    if verified_only:
+        supplier_match['verified'] = True
+    
+    suppliers = await catalog_suppliers.find(supplier_match, {"_id": 0, "id": 1}).to_list(None)
+    return [supplier["id"] for supplier in suppliers]
+
+async def build_material_filters(query_params):
+    """Compile material query parameters into a single index-friendly $match document"""
+    match_conditions = {}
+    if not query_params:
+        return match_conditions
+    
+    categories = [category for category in split_csv(query_params.get('category')) if category != 'all']
+    if len(categories) == 1:
+        match_conditions['category'] = categories[0]
+    elif categories:
+        match_conditions['category'] = {"$in": categories}
+    
+    supplier_ids = await resolve_supplier_ids(query_params)
+    if supplier_ids is not None:
+        match_conditions['supplier_id'] = {"$in": supplier_ids}
+    
+    price_range = {}
+    if query_params.get('min_price') is not None:
+        price_range['$gte'] = query_params['min_price']
+    if query_params.get('max_price') is not None:
+        price_range['$lte'] = query_params['max_price']
+    if price_range:
+        match_conditions['price'] = price_range
+    
+    flags = split_csv(query_params.get('filter_by'))
+    if 'instock' in flags:
+        match_conditions['inStock'] = True
+    if 'group' in flags:
+        match_conditions['hasGroupDeal'] = True
+    
+    if query_params.get('search'):
+        search_term = query_params['search']
+        match_conditions['$or'] = [
+            {"name": {"$regex": search_term, "$options": "i"}},
+            {"description": {"$regex": search_term, "$options": "i"}}
+        ]
+    
+    return match_conditions
+
 async def get_materials_with_suppliers(query_params=None):
     """Get materials with their supplier information"""
     pipeline = []
     
     # Match stage for filtering
-    match_conditions = {}
-    
-    if query_params:
-        if query_params.get('category') and query_params['category'] != 'all':
-            match_conditions['category'] = query_params['category']
-        
-        if query_params.get('filter_by'):
-            if query_params['filter_by'] == 'instock':
-                match_conditions['inStock'] = True
-            elif query_params['filter_by'] == 'group':
-                pipeline.append({
-                    "$addFields": {
-                        "hasGroupDeal": {"$lt": ["$groupPrice", "$price"]}
-                    }
-                })
-                match_conditions['hasGroupDeal'] = True
-        
-        if query_params.get('search'):
-            search_term = query_params['search']
-            match_conditions['$or'] = [
-                {"name": {"$regex": search_term, "$options": "i"}},
-                {"description": {"$regex": search_term, "$options": "i"}}
-            ]
-    
+    match_conditions = await build_material_filters(query_params)
     if match_conditions:
         pipeline.append({"$match": match_conditions})
     
-    # Lookup suppliers
-    pipeline.extend([
-        {
-            "$lookup": {
-                "from": "suppliers",
-                "localField": "supplier_id",
-                "foreignField": "id",
-                "as": "supplier"
-            }
-        },
-        {
-            "$unwind": "$supplier"
-        }
-    ])
-    
-    # Additional filtering based on supplier verification
-    if query_params and query_params.get('filter_by') == 'verified':
-        pipeline.append({"$match": {"supplier.verified": True}})
-    
     # Sorting
     sort_field = "name"
     if query_params and query_params.get('sort_by'):
@@ -187,15 +312,62 @@ async def get_materials_with_suppliers(query_params=None):
             sort_field = "price"
         elif query_params['sort_by'] == 'supplier':
             sort_field = "supplier.name"
+        elif query_params['sort_by'] == 'popular':
+            sort_field = "order_count"
+        elif query_params['sort_by'] == 'trending':
+            sort_field = "trending_score"
+        elif query_params['sort_by'] == 'distance' and query_params.get('nearby_supplier_ids') is not None:
+            sort_field = "distance_rank"
     
-    pipeline.append({"$sort": {sort_field: 1}})
+    # Field selection: only the selected fields (and the join key) go through the join and back to us
+    fields = query_params.get('fields') if query_params else None
+    supplier_fields = None
+    project_stages = []
+    if fields is not None:
+        supplier_fields = subfields(fields, "supplier", MATERIAL_SELECTABLE_FIELDS)
+        if sort_field == "supplier.name":
+            supplier_fields.add("name")
+        project_stages.append({"$project": to_projection(
+            {field: None for field in fields if field != "supplier"}, MATERIAL_SELECTABLE_FIELDS,
+            required=["supplier_id"] if supplier_fields else []
+        )})
+    join_stages = supplier_lookup_stages(supplier_fields)
     
     # Limit and offset
+    page_stages = []
     if query_params:
         if query_params.get('offset'):
-            pipeline.append({"$skip": query_params['offset']})
+            page_stages.append({"$skip": query_params['offset']})
         if query_params.get('limit'):
-            pipeline.append({"$limit": query_params['limit']})
+            page_stages.append({"$limit": query_params['limit']})
+    
+    if sort_field == "supplier.name":
+        # Sorting on a joined field needs the supplier first
+        pipeline.extend(project_stages)
+        pipeline.extend(join_stages)
+        pipeline.append({"$sort": {sort_field: 1}})
+        pipeline.extend(page_stages)
+    elif sort_field == "distance_rank":
+        # Nearby supplier IDs arrive ordered by distance; rank materials by their supplier's position
+        pipeline.append({"$addFields": {
+            "distance_rank": {"$indexOfArray": [list(query_params['nearby_supplier_ids']), "$supplier_id"]}
+        }})
+        pipeline.append({"$sort": {"distance_rank": 1, "name": 1}})
+        pipeline.extend(page_stages)
+        pipeline.extend(project_stages or [{"$project": {"distance_rank": 0}}])
+        pipeline.extend(join_stages)
+    elif sort_field in ("order_count", "trending_score"):
+        # Most ordered first; materials never ordered follow by name
+        pipeline.append({"$sort": {sort_field: -1, "name": 1}})
+        pipeline.extend(page_stages)
+        pipeline.extend(project_stages)
+        pipeline.extend(join_stages)
+    else:
+        # Sort and page on indexed material fields, then join only the returned page
+        pipeline.append({"$sort": {sort_field: 1}})
+        pipeline.extend(page_stages)
+        pipeline.extend(project_stages)
+        pipeline.extend(join_stages)
     
-    materials = await materials_collection.aggregate(pipeline).to_list(1000)
-    return materials
\ No newline at end of file
+    materials = await catalog_materials.aggregate(pipeline).to_list(1000)
+    return materials
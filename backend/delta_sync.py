@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional
+
+from pymongo import UpdateOne
+
+from database import (
+    categories_collection, db, get_materials_by_ids, materials_collection, suppliers_collection,
+    supplier_lookup_stages
+)
+
+logger = logging.getLogger(__name__)
+
+SYNC_KINDS = ("materials", "suppliers", "categories")
+CATALOG_VERSION_ID = "catalog"
+# A publish still unfinished after this long is assumed to have crashed
+PENDING_TIMEOUT = timedelta(seconds=60)
+
+# One document per changed catalog entity holding the version of its latest change
+catalog_changes = db.catalog_changes
+catalog_versions = db.catalog_versions
+
+
+class ChangeLog:
+    """
+    Compacted change log behind GET /api/sync. The catalog version maintained by
+    coherence.CatalogCoherence is the sequence: each publish upserts (kind, key)
+    with its version, so only the latest change per entity is kept. Deletions are
+    tombstones, removed after `tombstone_ttl`; a client older than the newest
+    removed tombstone must take a full snapshot.
+    """
+
+    def __init__(self, tombstone_ttl: timedelta = timedelta(days=7), max_delta: int = 1000,
+                 compact_interval: float = 3600.0):
+        self.tombstone_ttl = tombstone_ttl
+        self.max_delta = max_delta
+        self.compact_interval = compact_interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def ensure_indexes(self):
+        await catalog_changes.create_index([("kind", 1), ("key", 1)], unique=True)
+        await catalog_changes.create_index("version")
+
+    async def record(self, version: int, changes: Optional[Dict[str, Iterable]], deleted: bool = False) -> None:
+        """
+        Point every changed entity at `version`; changes maps a sync kind to its IDs.
+        None means anything may have changed, so every older client re-snapshots.
+        """
+        if changes is None:
+            await catalog_versions.update_one(
+                {"_id": CATALOG_VERSION_ID}, {"$max": {"compacted_through": version}}, upsert=True
+            )
+            return
+        now = datetime.utcnow()
+        operations = [
+            UpdateOne(
+                {"kind": kind, "key": key},
+                {"$set": {"version": version, "deleted": deleted, "changed_at": now}},
+                upsert=True
+            )
+            for kind, keys in changes.items()
+            for key in set(keys)
+        ]
+        if operations:
+            await catalog_changes.bulk_write(operations, ordered=False)
+
+    async def safe_version(self) -> Dict:
+        """
+        The newest version a client may resume from, plus the compaction horizon.
+        Versions still being published (bumped but not yet logged) hold it back,
+        so a client never skips a change that is recorded after it synced.
+        """
+        doc = await catalog_versions.find_one({"_id": CATALOG_VERSION_ID}) or {}
+        version = doc.get("version", 0)
+        cutoff = datetime.utcnow() - PENDING_TIMEOUT
+        pending = [entry["version"] for entry in doc.get("pending", []) if entry["at"] > cutoff]
+        return {
+            "version": min(pending) - 1 if pending else version,
+            "compacted_through": doc.get("compacted_through", 0)
+        }
+
+    async def changes_since(self, since: int) -> Optional[List[Dict]]:
+        """Changes after `since`, or None when there are too many to beat a snapshot"""
+        cursor = catalog_changes.find(
+            {"version": {"$gt": since}}, {"_id": 0, "kind": 1, "key": 1, "deleted": 1}
+        ).limit(self.max_delta + 1)
+        changes = await cursor.to_list(None)
+        return None if len(changes) > self.max_delta else changes
+
+    async def compact(self) -> int:
+        """Drop tombstones older than the TTL and advance the compaction horizon"""
+        cutoff = datetime.utcnow() - self.tombstone_ttl
+        expired = await catalog_changes.find(
+            {"deleted": True, "changed_at": {"$lt": cutoff}}, {"version": 1}
+        ).sort("version", -1).limit(1).to_list(1)
+        if not expired:
+            return 0
+        # Record the horizon before deleting so no client can resume across a gap
+        await catalog_versions.update_one(
+            {"_id": CATALOG_VERSION_ID}, {"$max": {"compacted_through": expired[0]["version"]}}, upsert=True
+        )
+        result = await catalog_changes.delete_many({"deleted": True, "version": {"$lte": expired[0]["version"]}})
+        return result.deleted_count
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                removed = await self.compact()
+                if removed:
+                    logger.info(f"Compacted {removed} catalog tombstones")
+            except Exception as e:
+                logger.error(f"Error compacting catalog change log: {e}")
+            await asyncio.sleep(self.compact_interval)
+
+
+async def load_snapshot(format_material: Callable[[Dict], Dict], projections: Dict[str, Dict]) -> Dict:
+    materials = await materials_collection.aggregate(
+        [{"$sort": {"id": 1}}] + supplier_lookup_stages()
+    ).to_list(None)
+    return {
+        "materials": {"upserted": [format_material(material) for material in materials], "deleted": []},
+        "suppliers": {
+            "upserted": await suppliers_collection.find({}, projections["suppliers"]).sort("id", 1).to_list(None),
+            "deleted": []
+        },
+        "categories": {
+            "upserted": await categories_collection.find({}, projections["categories"]).to_list(None),
+            "deleted": []
+        }
+    }
+
+
+async def load_delta(changes: List[Dict], format_material: Callable[[Dict], Dict], projections: Dict[str, Dict]) -> Dict:
+    keys = {kind: {"upserted": [], "deleted": []} for kind in SYNC_KINDS}
+    for change in changes:
+        keys[change["kind"]]["deleted" if change["deleted"] else "upserted"].append(change["key"])
+
+    upserted = {kind: [] for kind in SYNC_KINDS}
+    if keys["materials"]["upserted"]:
+        upserted["materials"] = await get_materials_by_ids(keys["materials"]["upserted"])
+    for kind, collection in (("suppliers", suppliers_collection), ("categories", categories_collection)):
+        if keys[kind]["upserted"]:
+            upserted[kind] = await collection.find(
+                {"id": {"$in": keys[kind]["upserted"]}}, projections[kind]
+            ).to_list(None)
+
+    delta = {}
+    for kind in SYNC_KINDS:
+        # An entity logged as changed but no longer found has been deleted since
+        found = {entity["id"] for entity in upserted[kind]}
+        delta[kind] = {
+            "upserted": [format_material(m) for m in upserted[kind]] if kind == "materials" else upserted[kind],
+            "deleted": keys[kind]["deleted"] + [key for key in keys[kind]["upserted"] if key not in found]
+        }
+    return delta
+
+
+change_log = ChangeLog(
+    tombstone_ttl=timedelta(hours=float(os.environ.get('SYNC_TOMBSTONE_TTL_HOURS', 168))),
+    max_delta=int(os.environ.get('SYNC_MAX_DELTA', 1000)),
+    compact_interval=float(os.environ.get('SYNC_COMPACT_INTERVAL', 3600))
+)
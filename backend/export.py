@@ -0,0 +1,112 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, List, Optional
+
+from database import materials_collection, orders_collection, suppliers_collection
+
+EXPORT_BATCH_SIZE = 1000
+# Rows encoded per chunk handed to the response stream
+ROWS_PER_CHUNK = 500
+
+ORDER_LINE_FIELDS = [
+    "order_id", "created_at", "session_id", "status", "material_id", "material_name",
+    "supplier_name", "quantity", "unit", "price", "is_group", "total"
+]
+MATERIAL_FIELDS = [
+    "id", "name", "category", "price", "groupPrice", "minGroupQuantity", "unit",
+    "inStock", "supplier_id", "supplier_name", "supplier_location"
+]
+MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+async def encode_rows(rows: AsyncIterator[Dict], fields: List[str], export_format: str) -> AsyncIterator[str]:
+    """Encode rows incrementally, yielding one chunk per ROWS_PER_CHUNK rows"""
+    buffer = io.StringIO()
+    writer = None
+    if export_format == "csv":
+        writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+
+    pending = 0
+    async for row in rows:
+        if writer:
+            writer.writerow({key: json_default(value) if isinstance(value, datetime) else value
+                             for key, value in row.items()})
+        else:
+            buffer.write(json.dumps(row, default=json_default))
+            buffer.write("\n")
+        pending += 1
+        if pending >= ROWS_PER_CHUNK:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+async def supplier_names(supplier_ids: Iterable[int]) -> List[str]:
+    suppliers = await suppliers_collection.find(
+        {"id": {"$in": list(supplier_ids)}}, {"_id": 0, "name": 1}
+    ).to_list(None)
+    return [supplier["name"] for supplier in suppliers]
+
+
+async def iter_order_lines(start: Optional[datetime] = None, end: Optional[datetime] = None,
+                           supplier_ids: Optional[List[int]] = None) -> AsyncIterator[Dict]:
+    """Stream one row per order line, filtered by creation date and supplier"""
+    query = {}
+    if start or end:
+        query["created_at"] = {}
+        if start:
+            query["created_at"]["$gte"] = start
+        if end:
+            query["created_at"]["$lt"] = end
+
+    names = None
+    if supplier_ids:
+        # Order lines carry the supplier name, so resolve the requested IDs first
+        names = set(await supplier_names(supplier_ids))
+        query["items.supplier_name"] = {"$in": list(names)}
+
+    cursor = orders_collection.find(
+        query, {"session_id": 1, "status": 1, "created_at": 1, "items": 1}
+    ).sort("created_at", 1).batch_size(EXPORT_BATCH_SIZE)
+
+    async for order in cursor:
+        for item in order.get("items", []):
+            if names is not None and item.get("supplier_name") not in names:
+                continue
+            yield {
+                "order_id": str(order["_id"]),
+                "created_at": order.get("created_at"),
+                "session_id": order.get("session_id"),
+                "status": order.get("status"),
+                **{field: item.get(field) for field in ORDER_LINE_FIELDS[4:]}
+            }
+
+
+async def iter_materials(supplier_ids: Optional[List[int]] = None) -> AsyncIterator[Dict]:
+    """Stream catalog rows joined with their supplier from an in-memory supplier map"""
+    suppliers = {
+        supplier["id"]: supplier
+        for supplier in await suppliers_collection.find({}, {"_id": 0}).to_list(None)
+    }
+    query = {"supplier_id": {"$in": supplier_ids}} if supplier_ids else {}
+    cursor = materials_collection.find(query, {"_id": 0}).sort("id", 1).batch_size(EXPORT_BATCH_SIZE)
+
+    async for material in cursor:
+        supplier = suppliers.get(material.get("supplier_id"), {})
+        row = {field: material.get(field) for field in MATERIAL_FIELDS}
+        row["supplier_name"] = supplier.get("name")
+        row["supplier_location"] = supplier.get("location")
+        yield row
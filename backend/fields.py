@@ -0,0 +1,86 @@
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Response fields a client may select per endpoint. Nested fields are selected with
+# dots ("supplier.name"); naming the parent alone selects all of them.
+MATERIAL_SELECTABLE_FIELDS: Dict[str, Tuple[str, ...]] = {
+    "id": (), "name": (), "category": (), "price": (), "unit": (), "image": (), "inStock": (),
+    "description": (), "groupPrice": (), "minGroupQuantity": (),
+    "supplier": ("id", "name", "verified", "location"),
+}
+ORDER_SELECTABLE_FIELDS: Dict[str, Tuple[str, ...]] = {
+    "id": (), "session_id": (), "total_amount": (), "status": (), "created_at": (), "updated_at": (),
+    "items": ("material_id", "material_name", "quantity", "price", "unit", "is_group", "supplier_name", "total"),
+    "status_history": ("status", "at", "note"),
+}
+CART_SELECTABLE_FIELDS: Dict[str, Tuple[str, ...]] = {
+    "session_id": (), "total": (), "count": (),
+    "items": ("id", "material_id", "material_name", "quantity", "price", "unit", "is_group", "supplier_name", "image"),
+}
+
+# Field name -> None for the whole field, or the selected nested fields
+Selection = Dict[str, Optional[Set[str]]]
+
+
+def parse_fields(raw: Optional[str], allowed: Dict[str, Tuple[str, ...]]) -> Optional[Selection]:
+    """Parse a comma separated fields= value; None selects everything. Raises ValueError on unknown fields."""
+    if not raw or not raw.strip():
+        return None
+    selection: Selection = {}
+    for name in filter(None, (part.strip() for part in raw.split(","))):
+        parent, _, child = name.partition(".")
+        if parent not in allowed or (child and child not in allowed[parent]):
+            raise ValueError(f"Unknown field: {name}")
+        if not child or not allowed[parent]:
+            selection[parent] = None
+        elif parent not in selection:
+            selection[parent] = {child}
+        elif selection[parent] is not None:
+            selection[parent].add(child)
+    return selection
+
+
+def subfields(selection: Selection, field: str, allowed: Dict[str, Tuple[str, ...]]) -> Set[str]:
+    """Nested fields selected under `field` (all of them when the parent was named)"""
+    if field not in selection:
+        return set()
+    return set(allowed[field]) if selection[field] is None else selection[field]
+
+
+def to_projection(selection: Selection, allowed: Dict[str, Tuple[str, ...]],
+                  required: Iterable[str] = (), renames: Optional[Dict[str, str]] = None) -> Dict[str, int]:
+    """
+    Compile a selection into a Mongo projection. `required` adds paths the query
+    itself needs (sort keys, join keys); `renames` maps response to stored names.
+    """
+    renames = renames or {}
+    projection = {"_id": 0}
+    for field in selection:
+        stored = renames.get(field, field)
+        if selection[field] is None:
+            projection[stored] = 1
+        else:
+            projection.update({f"{stored}.{child}": 1 for child in selection[field]})
+    projection.update({path: 1 for path in required})
+    return projection
+
+
+def select(document: Dict, selection: Optional[Selection]) -> Dict:
+    """Trim a response document (and its nested objects or lists) to the selection"""
+    if selection is None:
+        return document
+    shaped = {}
+    for field, children in selection.items():
+        if field not in document:
+            continue
+        value = document[field]
+        if children is not None:
+            if isinstance(value, list):
+                value = [{key: entry[key] for key in children if key in entry} for entry in value]
+            elif isinstance(value, dict):
+                value = {key: value[key] for key in children if key in value}
+        shaped[field] = value
+    return shaped
+
+
+def select_many(documents: List[Dict], selection: Optional[Selection]) -> List[Dict]:
+    return documents if selection is None else [select(document, selection) for document in documents]
@@ -0,0 +1,151 @@
+import math
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from database import suppliers_collection
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Coordinates for supplier locations stored before suppliers carried GeoJSON points
+CITY_COORDINATES = {
+    "mumbai": (19.0760, 72.8777),
+    "delhi": (28.6139, 77.2090),
+    "chennai": (13.0827, 80.2707),
+    "bangalore": (12.9716, 77.5946),
+    "bengaluru": (12.9716, 77.5946),
+    "pune": (18.5204, 73.8567),
+    "hyderabad": (17.3850, 78.4867),
+    "kolkata": (22.5726, 88.3639),
+    "ahmedabad": (23.0225, 72.5714),
+}
+
+NearbySupplier = Tuple[int, float]  # (supplier id, distance in km)
+
+
+def geo_point(lat: float, lng: float) -> dict:
+    """GeoJSON point; note GeoJSON orders coordinates as [longitude, latitude]"""
+    return {"type": "Point", "coordinates": [lng, lat]}
+
+
+def parse_near(near: str) -> Tuple[float, float]:
+    """Parse "lat,lng" into floats, raising ValueError when malformed or out of range"""
+    parts = near.split(",")
+    if len(parts) != 2:
+        raise ValueError("near must be formatted as lat,lng")
+    lat, lng = float(parts[0]), float(parts[1])
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValueError("near is out of range")
+    return lat, lng
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lng2 - lng1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+async def ensure_geo_indexes():
+    await suppliers_collection.create_index([("geo", "2dsphere")])
+
+
+async def backfill_supplier_coordinates() -> int:
+    """Give suppliers without coordinates the point of their (known) city"""
+    updated = 0
+    async for supplier in suppliers_collection.find({"geo": {"$exists": False}}, {"id": 1, "location": 1}):
+        coordinates = CITY_COORDINATES.get(str(supplier.get("location", "")).strip().lower())
+        if coordinates:
+            await suppliers_collection.update_one({"_id": supplier["_id"]}, {"$set": {"geo": geo_point(*coordinates)}})
+            updated += 1
+    return updated
+
+
+async def geo_near_suppliers(lat: float, lng: float, radius_km: Optional[float] = None) -> List[NearbySupplier]:
+    """Suppliers ordered by distance using $geoNear on the 2dsphere index"""
+    geo_near = {
+        "near": geo_point(lat, lng),
+        "distanceField": "distance",
+        "spherical": True,
+        "key": "geo"
+    }
+    if radius_km is not None:
+        geo_near["maxDistance"] = radius_km * 1000
+    pipeline = [{"$geoNear": geo_near}, {"$project": {"_id": 0, "id": 1, "distance": 1}}]
+    suppliers = await suppliers_collection.aggregate(pipeline).to_list(None)
+    return [(supplier["id"], supplier["distance"] / 1000) for supplier in suppliers]
+
+
+class SupplierGrid:
+    """
+    In-memory spatial grid over supplier coordinates for the cached catalog path.
+    Cells are `cell_degrees` wide; a query visits only the populated cells and
+    skips, without measuring their suppliers, those too many rings away from the
+    origin to hold a point within the radius.
+    """
+
+    def __init__(self, cell_degrees: float = 0.5):
+        self.cell_degrees = cell_degrees
+        self.columns = round(360 / cell_degrees)
+        self.cells: Dict[Tuple[int, int], List[Tuple[int, float, float]]] = defaultdict(list)
+        self.size = 0
+        self.loaded = False
+
+    def _cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return int(math.floor(lat / self.cell_degrees)), int(math.floor(lng / self.cell_degrees))
+
+    def _ring(self, origin: Tuple[int, int], cell: Tuple[int, int]) -> int:
+        """Chebyshev distance in cells; columns wrap around the antimeridian"""
+        col_gap = abs(cell[1] - origin[1]) % self.columns
+        return max(abs(cell[0] - origin[0]), min(col_gap, self.columns - col_gap))
+
+    async def load(self) -> int:
+        cells = defaultdict(list)
+        size = 0
+        async for supplier in suppliers_collection.find({"geo": {"$exists": True}}, {"_id": 0, "id": 1, "geo": 1}):
+            lng, lat = supplier["geo"]["coordinates"]
+            cells[self._cell(lat, lng)].append((supplier["id"], lat, lng))
+            size += 1
+        self.cells, self.size, self.loaded = cells, size, True
+        return size
+
+    def invalidate(self, material_ids=None) -> None:
+        """Coherence listener: supplier changes arrive as full invalidations"""
+        if material_ids is None:
+            self.loaded = False
+
+    def nearby(self, lat: float, lng: float, radius_km: Optional[float] = None) -> List[NearbySupplier]:
+        if not self.cells:
+            return []
+        origin = self._cell(lat, lng)
+        max_ring = None
+        if radius_km is not None:
+            # One degree of latitude is ~111 km; longitude cells shrink towards the poles
+            km_per_cell = 111.32 * self.cell_degrees * max(
+                math.cos(math.radians(min(abs(lat) + self.cell_degrees, 89.9))), 0.01
+            )
+            max_ring = int(radius_km / km_per_cell) + 1
+
+        # Cost follows the number of populated cells, never the distance to the farthest one
+        found = []
+        for cell, suppliers in self.cells.items():
+            if max_ring is not None and self._ring(origin, cell) > max_ring:
+                continue
+            for supplier_id, s_lat, s_lng in suppliers:
+                distance = haversine_km(lat, lng, s_lat, s_lng)
+                if radius_km is None or distance <= radius_km:
+                    found.append((supplier_id, distance))
+        return sorted(found, key=lambda item: item[1])
+
+
+supplier_grid = SupplierGrid()
+
+
+async def nearby_suppliers(lat: float, lng: float, radius_km: Optional[float] = None) -> List[NearbySupplier]:
+    """Serve from the in-memory grid when loaded, otherwise from $geoNear"""
+    if not supplier_grid.loaded:
+        try:
+            await supplier_grid.load()
+        except Exception:
+            return await geo_near_suppliers(lat, lng, radius_km)
+    return supplier_grid.nearby(lat, lng, radius_km)
@@ -0,0 +1,218 @@
+import asyncio
+import logging
+import os
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+from pymongo import ReturnDocument, UpdateOne
+
+from database import db, materials_collection
+
+logger = logging.getLogger(__name__)
+
+LOW_STOCK_THRESHOLD = int(os.environ.get('LOW_STOCK_THRESHOLD', 10))
+
+supplier_alerts_collection = db.supplier_alerts
+
+
+class InsufficientStock(Exception):
+    def __init__(self, shortages: List[Dict]):
+        super().__init__(", ".join(
+            f"{shortage['material_name']}: {shortage['available']} available" for shortage in shortages
+        ))
+        self.shortages = shortages
+
+
+def quantities_by_material(items: Iterable[Dict]) -> Counter:
+    """Total quantity per material; the same material may appear as group and individual lines"""
+    totals: Counter = Counter()
+    for item in items:
+        totals[item["material_id"]] += item["quantity"]
+    return totals
+
+
+async def reserve_stock(items: Iterable[Dict]) -> List[Dict]:
+    """
+    Take stock for every line of a checkout. Each material is decremented with one
+    conditional $inc that only matches while enough is available, so concurrent
+    checkouts of the same SKU cannot oversell; if any material falls short, the
+    reservations already made are released and InsufficientStock is raised.
+    Materials without available_qty are not stock-tracked and always succeed.
+    Returns the reserved materials with their remaining quantities.
+    """
+    totals = quantities_by_material(items)
+
+    async def reserve(material_id: int, quantity: int) -> Optional[Dict]:
+        return await materials_collection.find_one_and_update(
+            {"id": material_id, "available_qty": {"$gte": quantity}},
+            {"$inc": {"available_qty": -quantity}},
+            projection={"_id": 0, "id": 1, "name": 1, "supplier_id": 1, "available_qty": 1, "low_stock_threshold": 1},
+            return_document=ReturnDocument.AFTER
+        )
+
+    tracked = {
+        material["id"]: material
+        for material in await materials_collection.find(
+            {"id": {"$in": list(totals)}, "available_qty": {"$exists": True}},
+            {"_id": 0, "id": 1, "name": 1}
+        ).to_list(None)
+    }
+    material_ids = list(tracked)
+    results = await asyncio.gather(*(reserve(material_id, totals[material_id]) for material_id in material_ids))
+
+    reserved = [material for material in results if material is not None]
+    failed = [material_id for material_id, material in zip(material_ids, results) if material is None]
+    if failed:
+        await release_stock({material["id"]: totals[material["id"]] for material in reserved})
+        available = {
+            material["id"]: material.get("available_qty", 0)
+            for material in await materials_collection.find(
+                {"id": {"$in": failed}}, {"_id": 0, "id": 1, "available_qty": 1}
+            ).to_list(None)
+        }
+        raise InsufficientStock([
+            {
+                "material_id": material_id,
+                "material_name": tracked[material_id]["name"],
+                "requested": totals[material_id],
+                "available": available.get(material_id, 0)
+            }
+            for material_id in failed
+        ])
+
+    low_stock_watcher.observe(reserved)
+    return reserved
+
+
+async def release_stock(quantities: Dict[int, int]) -> None:
+    """Give reserved quantities back (failed checkout or cancelled order) in one bulk write"""
+    operations = [
+        UpdateOne({"id": material_id, "available_qty": {"$exists": True}}, {"$inc": {"available_qty": quantity}})
+        for material_id, quantity in quantities.items()
+        if quantity > 0
+    ]
+    if operations:
+        await materials_collection.bulk_write(operations, ordered=False)
+        low_stock_watcher.restocked(quantities)
+
+
+async def release_orders(orders: Iterable[Dict]) -> None:
+    """Release the stock held by cancelled orders that reserved it at checkout"""
+    totals: Counter = Counter()
+    for order in orders:
+        if order.get("stock_reserved"):
+            totals.update(quantities_by_material(order.get("items", [])))
+    await release_stock(dict(totals))
+
+
+class LowStockWatcher:
+    """
+    Collects low-stock observations from checkouts in memory and handles them in
+    batches: one alert document per supplier per pass, and one update_many that
+    marks sold-out materials out of stock (or back in stock once replenished).
+    """
+
+    def __init__(self, flush_interval: float = 30.0, threshold: int = LOW_STOCK_THRESHOLD):
+        self.flush_interval = flush_interval
+        self.threshold = threshold
+        self.low: Dict[int, Dict] = {}
+        self.replenished: set = set()
+        # Materials already alerted, so a flood of checkouts sends one alert; cleared on restock
+        self.alerted: set = set()
+        self.alerts_sent = 0
+        self.on_change: Optional[Callable[[List[int]], Awaitable[None]]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def observe(self, materials: Iterable[Dict]) -> None:
+        # Already alerted materials are still queued once they sell out, for the inStock flip
+        for material in materials:
+            threshold = material.get("low_stock_threshold", self.threshold)
+            if material["available_qty"] <= 0 or (
+                material["available_qty"] <= threshold and material["id"] not in self.alerted
+            ):
+                self.low[material["id"]] = material
+
+    def restocked(self, material_ids: Iterable[int]) -> None:
+        for material_id in material_ids:
+            self.alerted.discard(material_id)
+            self.replenished.add(material_id)
+
+    async def flush(self) -> Dict:
+        low, self.low = self.low, {}
+        replenished, self.replenished = self.replenished, set()
+
+        by_supplier = defaultdict(list)
+        for material in low.values():
+            if material["id"] in self.alerted:
+                continue
+            by_supplier[material["supplier_id"]].append({
+                "material_id": material["id"],
+                "material_name": material["name"],
+                "available_qty": material["available_qty"]
+            })
+        now = datetime.utcnow()
+        if by_supplier:
+            await supplier_alerts_collection.insert_many([
+                {"supplier_id": supplier_id, "type": "low_stock", "materials": materials, "created_at": now}
+                for supplier_id, materials in by_supplier.items()
+            ])
+            self.alerted.update(low)
+            self.alerts_sent += len(by_supplier)
+
+        # Conditions are re-checked in the database, so stale observations cannot flip a restocked SKU
+        changed = []
+        sold_out = [material_id for material_id, material in low.items() if material["available_qty"] <= 0]
+        if sold_out:
+            changed += await self._flip(sold_out, in_stock=False)
+        if replenished:
+            changed += await self._flip(list(replenished), in_stock=True)
+        if changed and self.on_change:
+            await self.on_change(changed)
+        return {"alerts": len(by_supplier), "stock_changed": len(changed)}
+
+    async def _flip(self, material_ids: List[int], in_stock: bool) -> List[int]:
+        query = {
+            "id": {"$in": material_ids},
+            "inStock": not in_stock,
+            "available_qty": {"$gt": 0} if in_stock else {"$lte": 0}
+        }
+        flipped = [
+            material["id"] for material in await materials_collection.find(query, {"_id": 0, "id": 1}).to_list(None)
+        ]
+        if flipped:
+            await materials_collection.update_many(
+                {**query, "id": {"$in": flipped}}, {"$set": {"inStock": in_stock, "updated_at": datetime.utcnow()}}
+            )
+        return flipped
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error handling low-stock alerts: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "pending_low": len(self.low),
+            "pending_replenished": len(self.replenished),
+            "alerts_sent": self.alerts_sent
+        }
+
+
+low_stock_watcher = LowStockWatcher(flush_interval=float(os.environ.get('LOW_STOCK_FLUSH_INTERVAL', 30)))
@@ -0,0 +1,84 @@
+"""
+One-shot maintenance jobs.
+
+    python manage.py seed
+    python manage.py backfill-rollups [--rebuild] [--batch-size 500]
+    python manage.py check-routing
+
+check-routing reports which member serves catalog reads. Against a local
+three-node replica set, e.g.
+
+    mongod --replSet rs0 --port 27017 --dbpath /tmp/rs0-0   (and 27018, 27019)
+    mongosh --eval 'rs.initiate({_id: "rs0", members: [
+        {_id: 0, host: "localhost:27017"}, {_id: 1, host: "localhost:27018"},
+        {_id: 2, host: "localhost:27019"}]})'
+
+run it with MONGO_URL="mongodb://localhost:27017,localhost:27018,localhost:27019/?replicaSet=rs0"
+and CATALOG_READ_PREFERENCE=secondaryPreferred CATALOG_MAX_STALENESS_SECONDS=90.
+"""
+import argparse
+import asyncio
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+
+async def seed(args):
+    from database import ensure_indexes, seed_database
+    await ensure_indexes()
+    return await seed_database()
+
+
+async def backfill_rollups(args):
+    from analytics import ensure_rollup_indexes, backfill_rollups
+    await ensure_rollup_indexes()
+    return await backfill_rollups(rebuild=args.rebuild, batch_size=args.batch_size)
+
+
+async def check_routing(args):
+    from database import client, catalog_materials, materials_collection
+    from read_routing import routing_stats
+    hello = await client.admin.command("hello")
+    if "setName" not in hello:
+        return "Standalone server: every read goes to the same node"
+    served_by = {}
+    for label, collection in (("catalog", catalog_materials), ("primary", materials_collection)):
+        cursor = collection.find({}, {"_id": 1}).limit(1)
+        await cursor.to_list(1)
+        served_by[label] = cursor.address
+    return {
+        "replica_set": hello["setName"],
+        "primary": hello.get("primary"),
+        "hosts": hello.get("hosts"),
+        "catalog_reads_served_by": served_by["catalog"],
+        "primary_reads_served_by": served_by["primary"],
+        "routing": routing_stats()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Street Food Raw Materials maintenance jobs")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    seeder = commands.add_parser("seed", help="Create indexes and seed an empty database")
+    seeder.set_defaults(handler=seed)
+
+    rollups = commands.add_parser("backfill-rollups", help="Build sales rollups from existing orders")
+    rollups.add_argument(
+        "--rebuild", action="store_true", help="Drop and recompute all rollups; run with order writes stopped"
+    )
+    rollups.add_argument("--batch-size", type=int, default=500)
+    rollups.set_defaults(handler=backfill_rollups)
+
+    routing = commands.add_parser("check-routing", help="Show which replica set member serves catalog reads")
+    routing.set_defaults(handler=check_routing)
+
+    args = parser.parse_args()
+    print(asyncio.run(args.handler(args)))
+
+
+if __name__ == "__main__":
+    main()
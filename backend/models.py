@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 from typing import List, Optional
 from datetime import datetime
 import uuid
@@ -9,6 +9,7 @@ class Supplier(BaseModel):
     name: str
     verified: bool = False
     location: str
+    distance_km: Optional[float] = None  # only set on near= queries
 
 class Category(BaseModel):
     id: str
@@ -28,12 +29,34 @@ class RawMaterial(BaseModel):
     groupPrice: float
     minGroupQuantity: int
 
+# Partial shapes returned when a client selects fields (fields=)
+class PartialSupplier(BaseModel):
+    id: Optional[int] = None
+    name: Optional[str] = None
+    verified: Optional[bool] = None
+    location: Optional[str] = None
+    distance_km: Optional[float] = None
+
+class PartialRawMaterial(BaseModel):
+    id: Optional[int] = None
+    name: Optional[str] = None
+    category: Optional[str] = None
+    price: Optional[float] = None
+    unit: Optional[str] = None
+    supplier: Optional[PartialSupplier] = None
+    image: Optional[str] = None
+    inStock: Optional[bool] = None
+    description: Optional[str] = None
+    groupPrice: Optional[float] = None
+    minGroupQuantity: Optional[int] = None
+
 # Database Models (for MongoDB operations)
 class SupplierDB(BaseModel):
     id: int
     name: str
     verified: bool = False
     location: str
+    geo: Optional[dict] = None  # GeoJSON Point, coordinates as [lng, lat]
 
 class CategoryDB(BaseModel):
     id: str
@@ -52,6 +75,10 @@ class RawMaterialDB(BaseModel):
     description: str
     groupPrice: float
     minGroupQuantity: int
+    available_qty: Optional[int] = None  # units left to sell; absent means not stock-tracked
+    order_count: int = 0  # orders containing the material
+    trending_score: float = 0.0  # decayed order count, see analytics.trending_weight
+    hasGroupDeal: bool = False  # precomputed groupPrice < price
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 # Cart Models
@@ -83,12 +110,19 @@ class OrderItem(BaseModel):
     supplier_name: str
     total: float
 
+class StatusChange(BaseModel):
+    status: str
+    at: datetime
+    note: Optional[str] = None
+
 class Order(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     session_id: str
     items: List[OrderItem]
     total_amount: float
-    status: str = "pending"  # pending, confirmed, shipped, delivered
+    status: str = "pending"  # pending, confirmed, shipped, delivered, cancelled
+    status_history: List[StatusChange] = []
+    stock_reserved: bool = False  # stock was taken at checkout and is returned on cancellation
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 # Request/Response Models
@@ -102,11 +136,43 @@ class UpdateCartItemRequest(BaseModel):
 
 class MaterialsQuery(BaseModel):
     search: Optional[str] = None
-    category: Optional[str] = None
-    sort_by: Optional[str] = "name"  # name, price, supplier
-    filter_by: Optional[str] = "all"  # all, verified, instock, group
+    category: Optional[str] = None  # one or more comma separated category IDs
+    supplier: Optional[str] = None  # one or more comma separated supplier IDs
+    location: Optional[str] = None  # one or more comma separated supplier locations
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    sort_by: Optional[str] = "popular"  # popular, trending, name, price, supplier, distance
+    near: Optional[str] = None  # lat,lng
+    radius_km: Optional[float] = None
+    filter_by: Optional[str] = "all"  # all, or any combination of verified, instock, group
     limit: Optional[int] = 50
     offset: Optional[int] = 0
+    fields: Optional[str] = None  # comma separated response fields, see fields.MATERIAL_SELECTABLE_FIELDS
+
+class PriceListEntry(BaseModel):
+    material_id: int
+    price: Optional[float] = Field(None, gt=0)
+    groupPrice: Optional[float] = Field(None, gt=0)
+    inStock: Optional[bool] = None
+    available_qty: Optional[int] = Field(None, ge=0)
+
+    @model_validator(mode="after")
+    def check_has_changes(self):
+        if self.price is None and self.groupPrice is None and self.inStock is None and self.available_qty is None:
+            raise ValueError("at least one of price, groupPrice, inStock or available_qty is required")
+        return self
 
 class CheckoutRequest(BaseModel):
-    session_id: str
\ No newline at end of file
+    session_id: str
+
+class ReorderRequest(BaseModel):
+    session_id: Optional[str] = None  # defaults to the session that placed the order
+
+class OrderStatusRequest(BaseModel):
+    status: str
+    note: Optional[str] = None
+
+class BulkOrderStatusRequest(BaseModel):
+    order_ids: List[str] = Field(..., min_length=1, max_length=5000)
+    status: str
+    note: Optional[str] = None
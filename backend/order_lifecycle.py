@@ -0,0 +1,125 @@
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+from database import orders_collection
+from inventory import release_orders
+
+ORDER_STATUSES = ("pending", "confirmed", "shipped", "delivered", "cancelled")
+
+# Allowed moves; delivered and cancelled are terminal
+TRANSITIONS = {
+    "pending": ("confirmed", "cancelled"),
+    "confirmed": ("shipped", "cancelled"),
+    "shipped": ("delivered",),
+    "delivered": (),
+    "cancelled": (),
+}
+
+
+class InvalidTransition(ValueError):
+    def __init__(self, current: str, target: str):
+        super().__init__(f"Cannot move an order from {current} to {target}")
+        self.current = current
+        self.target = target
+
+
+def allowed_sources(target: str) -> List[str]:
+    """Statuses an order may be in to move to `target`"""
+    if target not in TRANSITIONS:
+        raise ValueError(f"Unknown order status: {target}")
+    return [status for status, targets in TRANSITIONS.items() if target in targets]
+
+
+def history_entry(status: str, at: datetime, note: Optional[str] = None) -> Dict:
+    entry = {"status": status, "at": at}
+    if note:
+        entry["note"] = note
+    return entry
+
+
+async def ensure_order_lifecycle_indexes():
+    # Work queues: oldest orders in a given status first
+    await orders_collection.create_index([("status", 1), ("created_at", 1)])
+
+
+def transition_update(target: str, note: Optional[str], at: datetime, batch_id: Optional[str] = None) -> Dict:
+    fields = {"status": target, "updated_at": at}
+    if batch_id:
+        fields["last_transition_batch"] = batch_id
+    return {"$set": fields, "$push": {"status_history": history_entry(target, at, note)}}
+
+
+async def transition_order(order_id: ObjectId, target: str, note: Optional[str] = None) -> Optional[Dict]:
+    """
+    Move one order to `target`. The current status is checked in the update filter,
+    so concurrent transitions cannot both succeed. Returns None when the order does
+    not exist and raises InvalidTransition when it is in a status that cannot move.
+    """
+    sources = allowed_sources(target)
+    order = await orders_collection.find_one_and_update(
+        {"_id": order_id, "status": {"$in": sources}},
+        transition_update(target, note, datetime.utcnow()),
+        return_document=ReturnDocument.AFTER
+    )
+    if order is None:
+        current = await orders_collection.find_one({"_id": order_id}, {"status": 1})
+        if current is None:
+            return None
+        raise InvalidTransition(current.get("status"), target)
+    if target == "cancelled":
+        # Only the request that won the status change gets here, so stock is released once
+        await release_orders([order])
+    return order
+
+
+async def transition_orders(order_ids: List[ObjectId], target: str, note: Optional[str] = None) -> Dict:
+    """
+    Move many orders to `target` with one conditional update_many. Each batch tags
+    the orders it moved, so a single follow-up read splits the request into
+    transitioned, rejected (with their current status) and missing orders.
+    Stock held by the cancelled orders is released in one bulk write.
+    """
+    sources = allowed_sources(target)
+    order_ids = list(dict.fromkeys(order_ids))
+    batch_id = uuid.uuid4().hex
+    result = await orders_collection.update_many(
+        {"_id": {"$in": order_ids}, "status": {"$in": sources}},
+        transition_update(target, note, datetime.utcnow(), batch_id)
+    )
+
+    projection = {"status": 1, "last_transition_batch": 1}
+    if target == "cancelled":
+        projection.update({"items.material_id": 1, "items.quantity": 1, "stock_reserved": 1})
+    transitioned, rejected, cancelled = [], [], []
+    found = set()
+    cursor = orders_collection.find({"_id": {"$in": order_ids}}, projection)
+    async for order in cursor:
+        found.add(order["_id"])
+        if order.get("last_transition_batch") == batch_id:
+            transitioned.append(str(order["_id"]))
+            cancelled.append(order)
+        else:
+            rejected.append({"order_id": str(order["_id"]), "status": order.get("status")})
+    if target == "cancelled":
+        await release_orders(cancelled)
+
+    return {
+        "status": target,
+        "matched": result.matched_count,
+        "transitioned": transitioned,
+        "rejected": rejected,
+        "missing": [str(order_id) for order_id in order_ids if order_id not in found]
+    }
+
+
+async def get_orders_by_status(status: str, after: Optional[datetime] = None, limit: int = 100) -> List[Dict]:
+    """Oldest-first work queue for one status, served by the (status, created_at) index"""
+    query = {"status": status}
+    if after:
+        query["created_at"] = {"$gt": after}
+    cursor = orders_collection.find(query, {"rollup_applied": 0, "rollup_claim": 0, "last_transition_batch": 0}).sort("created_at", 1)
+    return await cursor.to_list(limit)
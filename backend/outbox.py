@@ -0,0 +1,298 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import urllib.request
+import uuid
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Deque, Dict, Iterable, List, Optional
+
+from pymongo import ReturnDocument, UpdateOne
+
+logger = logging.getLogger(__name__)
+
+# A sink delivers one event and raises to have it retried
+Sink = Callable[[Dict], Awaitable[None]]
+
+
+class StubSink:
+    """Keeps delivered events in memory; for tests and local development"""
+
+    def __init__(self, maxlen: int = 1000, failure_rate: float = 0.0):
+        self.received: Deque[Dict] = deque(maxlen=maxlen)
+        self.failure_rate = failure_rate
+
+    async def __call__(self, event: Dict) -> None:
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise RuntimeError("stub sink failure")
+        self.received.append(event)
+
+
+class WebhookSink:
+    """POSTs the event as JSON; any non-2xx response is retried"""
+
+    def __init__(self, url: str, timeout: float = 5.0):
+        self.url = url
+        self.timeout = timeout
+
+    async def __call__(self, event: Dict) -> None:
+        await asyncio.to_thread(self._post, json.dumps(event).encode())
+
+    def _post(self, body: bytes) -> None:
+        request = urllib.request.Request(self.url, data=body, headers={"Content-Type": "application/json"})
+        # urlopen raises HTTPError for non-2xx responses
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+
+
+class Outbox:
+    """
+    Transactional outbox for order events. Handlers enqueue events in the same
+    transaction as the write they describe (when MongoDB runs as a replica set),
+    so an event exists exactly when its order does. Checkout pays one insert no
+    matter how many sinks are registered.
+
+    A dispatcher on every worker claims due events one find_one_and_update at a
+    time: the claim pushes `available_at` forward by the lease, so a worker that
+    dies mid-delivery only delays the event. Deliveries run with bounded
+    concurrency; each event remembers which sinks still need it, and failed ones
+    are retried with exponential backoff until `max_attempts`, then marked failed.
+    Delivery is at least once; sinks get the event id to drop duplicates.
+    """
+
+    def __init__(self, client, database, batch_size: int = 50, concurrency: int = 10,
+                 lease_seconds: float = 30.0, poll_interval: float = 1.0, max_attempts: int = 8,
+                 retry_base: float = 2.0, sink_timeout: float = 10.0):
+        self.client = client
+        self.events = database.outbox
+        self.batch_size = batch_size
+        self.lease = timedelta(seconds=lease_seconds)
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.sink_timeout = sink_timeout
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.sinks: Dict[str, Sink] = {}
+        self.event_types: Dict[str, Optional[set]] = {}
+        self.delivered = 0
+        self.retried = 0
+        self.failed = 0
+        # Seconds from enqueue to delivery of recently delivered events
+        self.lags: Deque[float] = deque(maxlen=1000)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._wakeup = asyncio.Event()
+        self._transactions: Optional[bool] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, name: str, sink: Sink, event_types: Optional[Iterable[str]] = None) -> None:
+        """Add a delivery endpoint for all events, or only for `event_types`"""
+        self.sinks[name] = sink
+        self.event_types[name] = set(event_types) if event_types is not None else None
+
+    def sinks_for(self, event_type: str) -> List[str]:
+        return [name for name, types in self.event_types.items() if types is None or event_type in types]
+
+    async def ensure_indexes(self):
+        await self.events.create_index([("status", 1), ("available_at", 1)])
+
+    async def transactions_supported(self) -> bool:
+        """Multi-document transactions need a replica set or sharded cluster"""
+        if self._transactions is None:
+            try:
+                hello = await self.client.admin.command("hello")
+                self._transactions = "setName" in hello or hello.get("msg") == "isdbgrid"
+            except Exception:
+                self._transactions = False
+            if not self._transactions:
+                logger.warning("MongoDB is standalone; outbox events are written after their orders, not atomically")
+        return self._transactions
+
+    @asynccontextmanager
+    async def transaction(self, session=None):
+        """
+        Yields the session to pass as session= to the business write and to enqueue().
+        Reuses a caller's session (e.g. a causal one) or starts its own; on a
+        standalone server the writes simply run one after the other.
+        """
+        if not await self.transactions_supported():
+            yield session
+            return
+        if session is None:
+            async with await self.client.start_session() as own:
+                async with own.start_transaction():
+                    yield own
+        else:
+            async with session.start_transaction():
+                yield session
+
+    async def enqueue(self, event_type: str, payload: Dict, session=None) -> Optional[str]:
+        """Stage an event for every sink that wants it; nothing is written when none does"""
+        sinks = self.sinks_for(event_type)
+        if not sinks:
+            return None
+        now = datetime.utcnow()
+        event = {
+            "_id": uuid.uuid4().hex,
+            "type": event_type,
+            "payload": payload,
+            "status": "pending",
+            "pending_sinks": sinks,
+            "attempts": 0,
+            "created_at": now,
+            "available_at": now
+        }
+        await self.events.insert_one(event, session=session)
+        return event["_id"]
+
+    def notify(self) -> None:
+        """Wake this worker's dispatcher after a commit instead of waiting for the next poll"""
+        self._wakeup.set()
+
+    async def claim(self) -> Optional[Dict]:
+        now = datetime.utcnow()
+        return await self.events.find_one_and_update(
+            {"status": "pending", "available_at": {"$lte": now}},
+            {"$set": {"available_at": now + self.lease, "lease_owner": self.worker_id}},
+            sort=[("available_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def claim_batch(self) -> List[Dict]:
+        claimed = []
+        for _ in range(self.batch_size):
+            event = await self.claim()
+            if event is None:
+                break
+            claimed.append(event)
+        return claimed
+
+    async def _deliver(self, name: str, event: Dict) -> Optional[str]:
+        """Returns None on success, else the error message"""
+        sink = self.sinks.get(name)
+        if sink is None:
+            return f"no sink named {name}"
+        message = {
+            "id": event["_id"],
+            "type": event["type"],
+            "payload": event["payload"],
+            "created_at": event["created_at"].isoformat()
+        }
+        async with self._semaphore:
+            try:
+                await asyncio.wait_for(sink(message), self.sink_timeout)
+                return None
+            except Exception as e:
+                return f"{name}: {e!r}"
+
+    async def dispatch(self, events: List[Dict]) -> None:
+        results = await asyncio.gather(*(
+            asyncio.gather(*(self._deliver(name, event) for name in event["pending_sinks"]))
+            for event in events
+        ))
+
+        now = datetime.utcnow()
+        operations = []
+        for event, errors in zip(events, results):
+            remaining = [name for name, error in zip(event["pending_sinks"], errors) if error]
+            # Only the lease holder may settle the event
+            owned = {"_id": event["_id"], "lease_owner": self.worker_id}
+            if not remaining:
+                operations.append(UpdateOne(owned, {"$set": {
+                    "status": "delivered", "pending_sinks": [], "delivered_at": now
+                }}))
+                self.delivered += 1
+                self.lags.append((now - event["created_at"]).total_seconds())
+                continue
+            attempts = event["attempts"] + 1
+            last_error = "; ".join(error for error in errors if error)
+            if attempts >= self.max_attempts:
+                operations.append(UpdateOne(owned, {"$set": {
+                    "status": "failed", "pending_sinks": remaining, "attempts": attempts, "last_error": last_error
+                }}))
+                self.failed += 1
+                logger.error(f"Outbox event {event['_id']} failed after {attempts} attempts: {last_error}")
+                continue
+            delay = self.retry_base ** attempts * random.uniform(0.5, 1.0)
+            operations.append(UpdateOne(owned, {"$set": {
+                "pending_sinks": remaining,
+                "attempts": attempts,
+                "last_error": last_error,
+                "available_at": now + timedelta(seconds=delay)
+            }}))
+            self.retried += 1
+        if operations:
+            await self.events.bulk_write(operations, ordered=False)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                events = await self.claim_batch()
+                if events:
+                    await self.dispatch(events)
+                    continue
+            except Exception as e:
+                logger.error(f"Error dispatching outbox events: {e}")
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def lag(self) -> Dict:
+        """Backlog size and the age of the oldest undelivered event"""
+        pending = await self.events.count_documents({"status": "pending"})
+        oldest = await self.events.find(
+            {"status": "pending"}, {"created_at": 1}
+        ).sort("created_at", 1).limit(1).to_list(1)
+        return {
+            "pending": pending,
+            "failed_events": await self.events.count_documents({"status": "failed"}),
+            "oldest_pending_seconds": (datetime.utcnow() - oldest[0]["created_at"]).total_seconds() if oldest else 0
+        }
+
+    def stats(self) -> dict:
+        lags = sorted(self.lags)
+        return {
+            "sinks": list(self.sinks),
+            "delivered": self.delivered,
+            "retried": self.retried,
+            "failed": self.failed,
+            "delivery_lag_p50": lags[len(lags) // 2] if lags else None,
+            "delivery_lag_p95": lags[int(len(lags) * 0.95)] if lags else None
+        }
+
+
+def create_outbox(client, database) -> Outbox:
+    """
+    Sinks come from the environment: OUTBOX_WEBHOOK_URLS (comma separated) and
+    OUTBOX_STUB_SINK=true for the in-memory stub behind GET /api/outbox/stub.
+    """
+    outbox = Outbox(
+        client, database,
+        batch_size=int(os.environ.get('OUTBOX_BATCH_SIZE', 50)),
+        concurrency=int(os.environ.get('OUTBOX_CONCURRENCY', 10)),
+        lease_seconds=float(os.environ.get('OUTBOX_LEASE_SECONDS', 30)),
+        poll_interval=float(os.environ.get('OUTBOX_POLL_INTERVAL', 1.0)),
+        max_attempts=int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 8))
+    )
+    for index, url in enumerate(filter(None, os.environ.get('OUTBOX_WEBHOOK_URLS', '').split(','))):
+        outbox.register(f"webhook{index}", WebhookSink(url.strip()))
+    if os.environ.get('OUTBOX_STUB_SINK', 'false').lower() == 'true':
+        outbox.register("stub", StubSink(failure_rate=float(os.environ.get('OUTBOX_STUB_FAILURE_RATE', 0))))
+    return outbox
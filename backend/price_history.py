@@ -0,0 +1,128 @@
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from pymongo import UpdateOne
+
+from cache import LRUCache
+from database import db
+
+# One document per material per bucket holding every price point recorded in it
+price_history_collection = db.price_history
+
+BUCKET_HOURS = int(os.environ.get('PRICE_HISTORY_BUCKET_HOURS', 24))
+LATEST_POINTS = int(os.environ.get('PRICE_HISTORY_LATEST_POINTS', 50))
+INTERVALS = {
+    "hour": timedelta(hours=1),
+    "6h": timedelta(hours=6),
+    "day": timedelta(days=1),
+    "week": timedelta(weeks=1),
+}
+EPOCH = datetime(1970, 1, 1)
+
+# Latest-N points per material, refreshed from the database after invalidation
+latest_points_cache = LRUCache(maxsize=int(os.environ.get('PRICE_HISTORY_CACHE_SIZE', 1024)))
+
+
+async def ensure_price_history_indexes():
+    await price_history_collection.create_index([("material_id", 1), ("bucket_start", 1)], unique=True)
+
+
+def bucket_start(timestamp: datetime) -> datetime:
+    bucket = timedelta(hours=BUCKET_HOURS)
+    return EPOCH + ((timestamp - EPOCH) // bucket) * bucket
+
+
+async def record_price_points(points: List[Dict], baselines: Optional[Dict[int, Dict]] = None) -> None:
+    """
+    Append price points ({material_id, t, price, groupPrice}) to their buckets with
+    one unordered bulk write, keeping per-bucket min/max/sum of price up to date.
+    `baselines` maps material ids to the point they are changing from; it is only
+    recorded for materials with no history yet, so the first change has a before.
+    """
+    if not points:
+        return
+    if baselines:
+        recorded = set(await price_history_collection.distinct(
+            "material_id", {"material_id": {"$in": list(baselines)}}
+        ))
+        points = [point for material_id, point in baselines.items() if material_id not in recorded] + points
+    operations = [
+        UpdateOne(
+            {"material_id": point["material_id"], "bucket_start": bucket_start(point["t"])},
+            {
+                "$push": {"samples": {"t": point["t"], "price": point["price"], "groupPrice": point["groupPrice"]}},
+                "$min": {"min_price": point["price"], "first_t": point["t"]},
+                "$max": {"max_price": point["price"], "last_t": point["t"]},
+                "$inc": {"count": 1, "sum_price": point["price"]}
+            },
+            upsert=True
+        )
+        for point in points
+    ]
+    await price_history_collection.bulk_write(operations, ordered=False)
+    for point in points:
+        latest_points_cache.invalidate(point["material_id"])
+
+
+async def get_downsampled_history(material_id: int, start: Optional[datetime], end: Optional[datetime],
+                                  interval: str = "day", field: str = "price") -> List[Dict]:
+    """
+    Min/max/avg/last of the recorded `field` points per interval, computed in one
+    aggregation: matching buckets are unwound and grouped on the point time
+    truncated to the interval.
+    """
+    end = end or datetime.utcnow()
+    start = start or end - timedelta(days=30)
+    interval_ms = int(INTERVALS[interval].total_seconds() * 1000)
+
+    pipeline = [
+        # Whole buckets overlapping the range, found through the (material_id, bucket_start) index
+        {"$match": {
+            "material_id": material_id,
+            "bucket_start": {"$gte": bucket_start(start), "$lte": end}
+        }},
+        {"$unwind": "$samples"},
+        {"$match": {"samples.t": {"$gte": start, "$lte": end}}},
+        {"$sort": {"samples.t": 1}},
+        {"$group": {
+            "_id": {"$subtract": [
+                "$samples.t",
+                {"$mod": [{"$subtract": ["$samples.t", EPOCH]}, interval_ms]}
+            ]},
+            "min": {"$min": f"$samples.{field}"},
+            "max": {"$max": f"$samples.{field}"},
+            "avg": {"$avg": f"$samples.{field}"},
+            "last": {"$last": f"$samples.{field}"},
+            "points": {"$sum": 1}
+        }},
+        {"$sort": {"_id": 1}},
+        {"$project": {"_id": 0, "t": "$_id", "min": 1, "max": 1, "avg": 1, "last": 1, "points": 1}}
+    ]
+    return await price_history_collection.aggregate(pipeline).to_list(None)
+
+
+async def get_latest_points(material_id: int, limit: int = LATEST_POINTS) -> List[Dict]:
+    """Most recent price points (newest first), served from memory after the first read"""
+    points = latest_points_cache.get(material_id)
+    if points is None:
+        points = []
+        cursor = price_history_collection.find(
+            {"material_id": material_id}, {"_id": 0, "samples": 1}
+        ).sort("bucket_start", -1)
+        async for bucket in cursor:
+            points.extend(reversed(bucket["samples"]))
+            if len(points) >= LATEST_POINTS:
+                break
+        points = points[:LATEST_POINTS]
+        latest_points_cache.set(material_id, points)
+    return points[:limit]
+
+
+def invalidate_price_history_cache(material_ids=None) -> None:
+    """Catalog coherence listener so other workers drop stale latest-point lists"""
+    if material_ids is None:
+        latest_points_cache.clear()
+        return
+    for material_id in material_ids:
+        latest_points_cache.invalidate(material_id)
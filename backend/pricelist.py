@@ -0,0 +1,184 @@
+import json
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Dict, List, Tuple
+
+from pydantic import ValidationError
+from pymongo import UpdateOne
+
+from database import materials_collection, has_group_deal
+from inventory import low_stock_watcher
+from models import PriceListEntry
+from price_history import record_price_points
+
+PRICELIST_CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+PRICED_FIELDS = ("price", "groupPrice", "inStock", "available_qty")
+
+RawEntry = Tuple[int, object]
+
+
+async def iter_json_entries(body: bytes) -> AsyncIterator[RawEntry]:
+    """Entries from a JSON array (or {"items": [...]}) body"""
+    payload = json.loads(body)
+    if isinstance(payload, dict):
+        payload = payload.get("items", [])
+    if not isinstance(payload, list):
+        raise ValueError("Expected a JSON array of price list entries")
+    for index, entry in enumerate(payload, start=1):
+        yield index, entry
+
+
+async def iter_ndjson_entries(chunks: AsyncIterator[bytes]) -> AsyncIterator[RawEntry]:
+    """Entries from an NDJSON request stream, parsed line by line as bytes arrive"""
+    buffer = b""
+    line_number = 0
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                yield line_number, _parse_line(line)
+    if buffer.strip():
+        yield line_number + 1, _parse_line(buffer)
+
+
+def _parse_line(line: bytes):
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return e
+
+
+class PriceListResult:
+    def __init__(self):
+        self.received = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.errors: List[Dict] = []
+        self.error_count = 0
+        self.changed_ids: List[int] = []
+
+    def error(self, line: int, message: str) -> None:
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "error": message})
+
+    def summary(self) -> Dict:
+        return {
+            "received": self.received,
+            "updated": self.updated,
+            "unchanged": self.unchanged,
+            "rejected": self.error_count,
+            "errors": self.errors
+        }
+
+
+async def apply_pricelist(supplier_id: int, entries: AsyncIterator[RawEntry],
+                          chunk_size: int = PRICELIST_CHUNK_SIZE) -> PriceListResult:
+    """
+    Validate a supplier price list in chunks and write only the rows whose
+    price, groupPrice or inStock actually changed, one unordered bulk write per chunk.
+    """
+    result = PriceListResult()
+    chunk: List[Tuple[int, PriceListEntry]] = []
+
+    async for line, raw in entries:
+        result.received += 1
+        if isinstance(raw, Exception):
+            result.error(line, f"Invalid JSON: {raw}")
+            continue
+        try:
+            chunk.append((line, PriceListEntry.model_validate(raw)))
+        except ValidationError as e:
+            result.error(line, "; ".join(
+                f"{'.'.join(map(str, err['loc']))}: {err['msg']}" if err['loc'] else err['msg']
+                for err in e.errors()
+            ))
+            continue
+        if len(chunk) >= chunk_size:
+            await _apply_chunk(supplier_id, chunk, result)
+            chunk = []
+
+    if chunk:
+        await _apply_chunk(supplier_id, chunk, result)
+    return result
+
+
+async def _apply_chunk(supplier_id: int, chunk: List[Tuple[int, PriceListEntry]], result: PriceListResult) -> None:
+    material_ids = [entry.material_id for _, entry in chunk]
+    current = {
+        material["id"]: material
+        for material in await materials_collection.find(
+            {"id": {"$in": material_ids}, "supplier_id": supplier_id},
+            {"_id": 0, "id": 1, "price": 1, "groupPrice": 1, "inStock": 1, "available_qty": 1}
+        ).to_list(len(material_ids))
+    }
+
+    # Changes merged per material so duplicate rows cannot race inside an unordered bulk write
+    pending: Dict[int, Dict] = {}
+    previous: Dict[int, Dict] = {}
+    for line, entry in chunk:
+        material = current.get(entry.material_id)
+        if material is None:
+            result.error(line, f"Material {entry.material_id} not found for supplier {supplier_id}")
+            continue
+
+        changes = {
+            field: value
+            for field, value in entry.model_dump(exclude_none=True, include=set(PRICED_FIELDS)).items()
+            if material.get(field) != value
+        }
+        # A stock count sets availability unless the entry says otherwise
+        if "available_qty" in changes and entry.inStock is None and material.get("inStock") != (entry.available_qty > 0):
+            changes["inStock"] = entry.available_qty > 0
+        if not changes:
+            if entry.material_id not in pending:
+                result.unchanged += 1
+            continue
+
+        previous.setdefault(entry.material_id, dict(material))
+        material.update(changes)
+        pending.setdefault(entry.material_id, {}).update(changes)
+
+    now = datetime.utcnow()
+    operations = []
+    for material_id, changes in pending.items():
+        material = current[material_id]
+        changes["hasGroupDeal"] = has_group_deal(material["price"], material["groupPrice"])
+        changes["updated_at"] = now
+        operations.append(UpdateOne({"id": material_id, "supplier_id": supplier_id}, {"$set": changes}))
+        result.changed_ids.append(material_id)
+    result.updated += len(operations)
+
+    if operations:
+        await materials_collection.bulk_write(operations, ordered=False)
+        repriced = [
+            material_id for material_id, changes in pending.items() if "price" in changes or "groupPrice" in changes
+        ]
+        # The old prices held until just before this change
+        before = now - timedelta(milliseconds=1)
+        await record_price_points(
+            [
+                {
+                    "material_id": material_id,
+                    "t": now,
+                    "price": current[material_id]["price"],
+                    "groupPrice": current[material_id]["groupPrice"]
+                }
+                for material_id in repriced
+            ],
+            baselines={
+                material_id: {
+                    "material_id": material_id,
+                    "t": before,
+                    "price": previous[material_id]["price"],
+                    "groupPrice": previous[material_id]["groupPrice"]
+                }
+                for material_id in repriced
+            }
+        )
+        # Restocked materials may alert again when they next run low
+        low_stock_watcher.restocked(
+            material_id for material_id, changes in pending.items() if changes.get("available_qty", 0) > 0
+        )
@@ -0,0 +1,212 @@
+import hmac
+import importlib
+import itertools
+import logging
+import os
+import random
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from bson import ObjectId
+from pymongo.errors import CollectionInvalid
+
+logger = logging.getLogger(__name__)
+
+# Admin endpoints serving stored profiles are never profiled themselves
+PROFILES_PATH = "/api/admin/profiles"
+
+_pyinstrument = None
+
+
+def load_profiler():
+    """Import pyinstrument on first use; profiling is disabled when it is missing"""
+    global _pyinstrument
+    if _pyinstrument is None:
+        try:
+            _pyinstrument = importlib.import_module("pyinstrument")
+        except ImportError:
+            logger.warning("pyinstrument is not installed; request profiling is disabled")
+            _pyinstrument = False
+    return _pyinstrument or None
+
+
+def folded_stacks(root) -> List[str]:
+    """
+    Render a pyinstrument frame tree as collapsed stacks ("a;b;c <microseconds>"),
+    the input format of flamegraph.pl and speedscope. Time spent awaiting (e.g. on
+    Motor) shows up as [await] frames under the awaiting coroutine.
+    """
+    lines = []
+
+    def walk(frame, path):
+        name = frame.function or "<unknown>"
+        if frame.file_path_short:
+            name = f"{name} ({frame.file_path_short}:{frame.line_no})"
+        stack = path + [name.replace(";", ",")]
+        self_time = frame.time - sum(child.time for child in frame.children)
+        if self_time > 0:
+            lines.append(f"{';'.join(stack)} {int(self_time * 1_000_000)}")
+        for child in frame.children:
+            walk(child, stack)
+
+    if root is not None:
+        walk(root, [])
+    return lines
+
+
+class ProfileStore:
+    """
+    Ring buffer holding the last N captured request profiles in this process.
+    Only usable with a single worker: every worker numbers its profiles from 1.
+    """
+
+    def __init__(self, capacity: int = 50):
+        self._profiles = deque(maxlen=capacity)
+        self._ids = itertools.count(1)
+
+    async def ensure_collection(self) -> None:
+        pass
+
+    def new_id(self) -> str:
+        return str(next(self._ids))
+
+    async def save(self, record: Dict) -> None:
+        self._profiles.append(record)
+
+    async def get(self, profile_id: str) -> Optional[Dict]:
+        for record in self._profiles:
+            if record["id"] == profile_id:
+                return record
+        return None
+
+    async def summaries(self) -> List[Dict]:
+        return [
+            {key: value for key, value in record.items() if key != "folded"}
+            for record in reversed(self._profiles)
+        ]
+
+
+class MongoProfileStore:
+    """
+    The last N profiles in a capped collection shared by every worker, so a profile
+    id from any worker can be fetched through whichever worker serves the admin
+    request. Ids are ObjectIds, unique across workers.
+    """
+
+    def __init__(self, collection, capacity: int = 50, size_bytes: int = 64 * 1024 * 1024):
+        self.collection = collection
+        self.capacity = capacity
+        self.size_bytes = size_bytes
+        self.ready = False
+
+    async def ensure_collection(self) -> None:
+        try:
+            await self.collection.database.create_collection(
+                self.collection.name, capped=True, size=self.size_bytes, max=self.capacity
+            )
+        except CollectionInvalid:
+            pass
+        self.ready = True
+
+    def new_id(self) -> str:
+        return str(ObjectId())
+
+    async def save(self, record: Dict) -> None:
+        # Writing before the capped collection exists would create an uncapped one
+        if not self.ready:
+            raise RuntimeError("profile collection is not set up")
+        await self.collection.insert_one({"_id": ObjectId(record["id"]), **record})
+
+    async def get(self, profile_id: str) -> Optional[Dict]:
+        if not ObjectId.is_valid(profile_id):
+            return None
+        return await self.collection.find_one({"_id": ObjectId(profile_id)}, {"_id": 0})
+
+    async def summaries(self) -> List[Dict]:
+        # Capped collections keep insertion order, so $natural descending is newest first
+        cursor = self.collection.find({}, {"_id": 0, "folded": 0}).sort("$natural", -1)
+        return await cursor.to_list(self.capacity)
+
+
+def token_matches(supplied: Optional[str], expected: Optional[str]) -> bool:
+    return bool(expected) and bool(supplied) and hmac.compare_digest(supplied, expected)
+
+
+class ProfilingMiddleware:
+    """
+    Profiles a request when it carries `X-Profile: <PROFILING_TOKEN>` or, globally,
+    for a random PROFILING_SAMPLE_RATE fraction of requests. The profile id is
+    returned in the X-Profile-Id response header.
+    """
+
+    def __init__(self, app, store, token: Optional[str] = None,
+                 sample_rate: float = 0.0, interval: float = 0.001):
+        self.app = app
+        self.store = store
+        self.token = token
+        self.sample_rate = sample_rate
+        self.interval = interval
+
+    def _should_profile(self, scope) -> bool:
+        if scope["path"].startswith(PROFILES_PATH):
+            return False
+        if self.token:
+            supplied = dict(scope.get("headers") or []).get(b"x-profile")
+            if supplied and token_matches(supplied.decode("latin-1"), self.token):
+                return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        pyinstrument = load_profiler()
+        if pyinstrument is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = self.store.new_id()
+        record = {
+            "id": profile_id,
+            "method": scope["method"],
+            "path": scope["path"],
+            "query": scope.get("query_string", b"").decode("latin-1"),
+            "started_at": datetime.utcnow().isoformat(),
+            "status": None
+        }
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                record["status"] = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-profile-id", str(profile_id).encode())]
+            await send(message)
+
+        profiler = pyinstrument.Profiler(interval=self.interval, async_mode="enabled")
+        began = time.perf_counter()
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profiler.stop()
+            record["duration_ms"] = round((time.perf_counter() - began) * 1000, 3)
+            record["folded"] = folded_stacks(profiler.last_session.root_frame())
+            try:
+                await self.store.save(record)
+            except Exception as e:
+                logger.warning(f"Could not store profile {profile_id}: {e}")
+
+
+def create_profile_store(database):
+    """PROFILE_STORE=memory keeps profiles in the (single) worker; the default shares them through MongoDB"""
+    capacity = int(os.environ.get('PROFILING_BUFFER_SIZE', 50))
+    if os.environ.get('PROFILE_STORE', 'mongo').lower() == 'memory':
+        return ProfileStore(capacity)
+    return MongoProfileStore(database.request_profiles, capacity)
+
+
+profiling_token = os.environ.get('PROFILING_TOKEN') or None
+profiling_sample_rate = float(os.environ.get('PROFILING_SAMPLE_RATE', 0.0))
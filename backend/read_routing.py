@@ -0,0 +1,192 @@
+import base64
+import logging
+import os
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Mapping, Optional
+
+import bson
+from bson import Timestamp
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
+
+logger = logging.getLogger(__name__)
+
+READ_PREFERENCES = {
+    "primary": Primary,
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+# Smallest maxStalenessSeconds the server accepts
+MIN_MAX_STALENESS = 90
+
+
+def read_preference(mode: str, max_staleness: int = -1):
+    """Build a pymongo read preference; max_staleness of -1 means unbounded"""
+    if mode not in READ_PREFERENCES:
+        raise ValueError(f"Unknown read preference: {mode}")
+    if mode == "primary":
+        return Primary()
+    if 0 <= max_staleness < MIN_MAX_STALENESS:
+        logger.warning(f"max staleness {max_staleness}s raised to the {MIN_MAX_STALENESS}s minimum")
+        max_staleness = MIN_MAX_STALENESS
+    return READ_PREFERENCES[mode](max_staleness=max_staleness)
+
+
+# Catalog reads (/materials, /categories, /suppliers) may be served by secondaries
+catalog_read_preference = read_preference(
+    os.environ.get('CATALOG_READ_PREFERENCE', 'primary'),
+    int(os.environ.get('CATALOG_MAX_STALENESS_SECONDS', -1))
+)
+# Cart and order reads; only leave the primary when the request carries a causal token
+session_read_preference = read_preference(os.environ.get('SESSION_READ_PREFERENCE', 'primary'))
+
+
+CAUSAL_TOKEN_HEADER = "X-Causal-Token"
+
+
+class CausalTimes:
+    """
+    A client's causal token: the cluster and operation time of its latest cart or
+    order write. Encoded as "<seconds>.<increment>.<bson>" so clients can keep the
+    newest of several tokens without decoding them.
+    """
+
+    def __init__(self, cluster_time: Optional[Mapping] = None, operation_time: Optional[Timestamp] = None):
+        self.cluster_time = cluster_time
+        self.operation_time = operation_time
+        self.advanced = False
+
+    @classmethod
+    def decode(cls, token: Optional[str]) -> "CausalTimes":
+        """Parse a token sent back by a client; a missing or malformed one holds no times"""
+        if token:
+            try:
+                document = bson.decode(base64.urlsafe_b64decode(token.rsplit(".", 1)[-1]))
+                cluster_time, operation_time = document["clusterTime"], document["operationTime"]
+                if isinstance(cluster_time.get("clusterTime"), Timestamp) and isinstance(operation_time, Timestamp):
+                    return cls(cluster_time, operation_time)
+            except Exception:
+                logger.debug("Ignoring malformed causal token")
+        return cls()
+
+    def encode(self) -> str:
+        body = base64.urlsafe_b64encode(bson.encode({
+            "clusterTime": self.cluster_time, "operationTime": self.operation_time
+        })).decode()
+        return f"{self.operation_time.time}.{self.operation_time.inc}.{body}"
+
+    def advance(self, cluster_time: Optional[Mapping], operation_time: Optional[Timestamp]) -> None:
+        if operation_time is not None and (self.operation_time is None or operation_time > self.operation_time):
+            self.operation_time = operation_time
+            self.advanced = True
+        if cluster_time is not None and (
+            self.cluster_time is None or cluster_time["clusterTime"] > self.cluster_time["clusterTime"]
+        ):
+            self.cluster_time = cluster_time
+
+
+# Times of the request being handled, set by CausalTokenMiddleware
+_request_times: ContextVar[Optional[CausalTimes]] = ContextVar("causal_times", default=None)
+
+
+class CausalSessions:
+    """
+    Read-your-own-writes for cart and order endpoints. The client carries its causal
+    token: every response to a request that wrote returns the new token in the
+    X-Causal-Token header, and the client sends it back on its next cart and order
+    requests, where it is replayed into a causally consistent client session so a
+    secondary read waits until it has applied the client's earlier writes, whichever
+    worker made them. Requests without a token read from the primary. With the
+    default primary read preference no client sessions are started at all.
+    """
+
+    def __init__(self, client, read_pref=session_read_preference):
+        self.client = client
+        self.read_pref = read_pref
+        self.routed = 0
+        self.pinned = 0
+
+    @property
+    def enabled(self) -> bool:
+        return not isinstance(self.read_pref, Primary)
+
+    @asynccontextmanager
+    async def start(self):
+        """Yields the client session to pass as session=, or None when reads stay on the primary"""
+        if not self.enabled:
+            yield None
+            return
+        times = _request_times.get()
+        async with await self.client.start_session(causal_consistency=True) as session:
+            if times is not None and times.operation_time is not None:
+                session.advance_cluster_time(times.cluster_time)
+                session.advance_operation_time(times.operation_time)
+            yield session
+            if times is not None:
+                times.advance(session.cluster_time, session.operation_time)
+
+    def reader(self, collection):
+        """`collection` routed for this request's reads"""
+        if not self.enabled:
+            return collection
+        times = _request_times.get()
+        if times is None or times.operation_time is None:
+            self.pinned += 1
+            return collection
+        self.routed += 1
+        return collection.with_options(read_preference=self.read_pref)
+
+    def stats(self) -> dict:
+        return {
+            "read_preference": self.read_pref.mongos_mode,
+            "routed_reads": self.routed,
+            "primary_reads": self.pinned
+        }
+
+
+class CausalTokenMiddleware:
+    """
+    Reads the client's X-Causal-Token for the duration of a request and returns
+    the advanced token when the request wrote through a causal session.
+    """
+
+    def __init__(self, app, sessions: CausalSessions):
+        self.app = app
+        self.sessions = sessions
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.sessions.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        supplied = dict(scope.get("headers") or []).get(CAUSAL_TOKEN_HEADER.lower().encode())
+        times = CausalTimes.decode(supplied.decode("latin-1") if supplied else None)
+
+        async def send_with_token(message):
+            if message["type"] == "http.response.start" and times.advanced:
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [
+                    (CAUSAL_TOKEN_HEADER.lower().encode(), times.encode().encode())
+                ]
+            await send(message)
+
+        reset = _request_times.set(times)
+        try:
+            await self.app(scope, receive, send_with_token)
+        finally:
+            _request_times.reset(reset)
+
+
+def routing_stats(causal_sessions: Optional[CausalSessions] = None) -> dict:
+    stats = {
+        "catalog": {
+            "read_preference": catalog_read_preference.mongos_mode,
+            "max_staleness_seconds": catalog_read_preference.max_staleness
+        }
+    }
+    if causal_sessions is not None:
+        stats["sessions"] = causal_sessions.stats()
+    return stats
@@ -0,0 +1,205 @@
+import asyncio
+import heapq
+import importlib
+import logging
+import os
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from itertools import permutations
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from bson import ObjectId
+
+from database import orders_collection
+
+logger = logging.getLogger(__name__)
+
+ORDER_BATCH_SIZE = 2000
+
+
+def load_numpy():
+    """NumPy is optional: without it pair counting falls back to pure Python"""
+    try:
+        return importlib.import_module("numpy")
+    except ImportError:
+        return None
+
+
+def count_pairs(baskets: Sequence[Sequence[int]], np=None) -> Counter:
+    """
+    Count ordered co-purchase pairs (a, b), a != b, over a batch of baskets.
+
+    With NumPy, baskets are grouped by size so each group is a dense 2-D array;
+    every column permutation yields a vector of pairs, which are encoded as single
+    int64 keys and counted with np.unique.
+    """
+    counts: Counter = Counter()
+    if np is None:
+        for basket in baskets:
+            counts.update(permutations(basket, 2))
+        return counts
+
+    by_size: Dict[int, List[Sequence[int]]] = defaultdict(list)
+    for basket in baskets:
+        if len(basket) > 1:
+            by_size[len(basket)].append(basket)
+    if not by_size:
+        return counts
+
+    ids = np.unique(np.fromiter((m for basket in baskets for m in basket), dtype=np.int64))
+    width = np.int64(len(ids))
+    keys = []
+    for size, group in by_size.items():
+        # Dense material indices, one row per basket
+        matrix = np.searchsorted(ids, np.asarray(group, dtype=np.int64))
+        left, right = np.nonzero(~np.eye(size, dtype=bool))
+        keys.append((matrix[:, left] * width + matrix[:, right]).ravel())
+
+    unique, totals = np.unique(np.concatenate(keys), return_counts=True)
+    lefts = ids[unique // width].tolist()
+    rights = ids[unique % width].tolist()
+    for material_id, other_id, total in zip(lefts, rights, totals.tolist()):
+        counts[(material_id, other_id)] += total
+    return counts
+
+
+class CoPurchaseIndex:
+    """
+    "Frequently bought together" neighbours. Keeps sparse co-occurrence counts
+    plus a precomputed top-k list per material, so lookups are O(k).
+    """
+
+    def __init__(self, top_k: int = 20):
+        self.top_k = top_k
+        self.counts: Dict[int, Counter] = defaultdict(Counter)
+        self.neighbors: Dict[int, Tuple[Tuple[int, int], ...]] = {}
+        self.orders_seen = 0
+
+    def add_pairs(self, pairs: Counter) -> None:
+        touched = set()
+        for (material_id, other_id), total in pairs.items():
+            self.counts[material_id][other_id] += total
+            touched.add(material_id)
+        for material_id in touched:
+            self.neighbors[material_id] = tuple(
+                heapq.nlargest(self.top_k, self.counts[material_id].items(), key=lambda item: item[1])
+            )
+
+    def related(self, material_id: int, limit: int) -> List[Tuple[int, int]]:
+        return list(self.neighbors.get(material_id, ())[:limit])
+
+    def suggest(self, basket: Iterable[int], limit: int) -> List[Tuple[int, int]]:
+        """Merge the neighbour lists of every item in a basket, excluding the basket itself"""
+        basket = set(basket)
+        scores: Counter = Counter()
+        for material_id in basket:
+            for other_id, total in self.neighbors.get(material_id, ()):
+                if other_id not in basket:
+                    scores[other_id] += total
+        return scores.most_common(limit)
+
+
+class RecommendationEngine:
+    """
+    Builds the co-purchase index from recent orders in streamed batches, then
+    folds in orders newer than its watermark every `refresh_interval` seconds.
+    Every worker maintains its own copy; a full rebuild ages out old orders.
+    """
+
+    def __init__(self, window_days: int = 90, top_k: int = 20,
+                 refresh_interval: float = 30.0, rebuild_interval: float = 86400.0):
+        self.window_days = window_days
+        self.top_k = top_k
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self.index = CoPurchaseIndex(top_k)
+        self.watermark: Optional[ObjectId] = None
+        self.built_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        # NumPy is imported on the first build, not at server import time
+        self._np = False
+
+    @property
+    def ready(self) -> bool:
+        return self.built_at is not None
+
+    async def _fold_orders(self, index: CoPurchaseIndex, query: dict) -> Optional[ObjectId]:
+        if self._np is False:
+            self._np = load_numpy()
+        last_id = None
+        cursor = orders_collection.find(query, {"items.material_id": 1}).sort("_id", 1).batch_size(ORDER_BATCH_SIZE)
+        baskets = []
+        async for order in cursor:
+            last_id = order["_id"]
+            baskets.append(sorted({item["material_id"] for item in order.get("items", [])}))
+            if len(baskets) >= ORDER_BATCH_SIZE:
+                index.add_pairs(count_pairs(baskets, self._np))
+                index.orders_seen += len(baskets)
+                baskets = []
+        if baskets:
+            index.add_pairs(count_pairs(baskets, self._np))
+            index.orders_seen += len(baskets)
+        return last_id
+
+    async def rebuild(self) -> int:
+        """Full rebuild from the order window; swaps the index in atomically"""
+        index = CoPurchaseIndex(self.top_k)
+        since = ObjectId.from_datetime(datetime.utcnow() - timedelta(days=self.window_days))
+        last_id = await self._fold_orders(index, {"_id": {"$gte": since}})
+        self.index = index
+        self.watermark = last_id or self.watermark or since
+        self.built_at = time.monotonic()
+        return index.orders_seen
+
+    async def refresh(self) -> int:
+        """
+        Incrementally fold orders placed since the last build or refresh. ObjectIds
+        from different workers are only roughly ordered, so an order can slip under
+        the watermark; the periodic rebuild picks those up.
+        """
+        before = self.index.orders_seen
+        last_id = await self._fold_orders(self.index, {"_id": {"$gt": self.watermark}})
+        if last_id:
+            self.watermark = last_id
+        return self.index.orders_seen - before
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if not self.ready or time.monotonic() - self.built_at > self.rebuild_interval:
+                    orders = await self.rebuild()
+                    logger.info(f"Co-purchase index rebuilt from {orders} orders")
+                else:
+                    await self.refresh()
+            except Exception as e:
+                logger.error(f"Error updating co-purchase index: {e}")
+            await asyncio.sleep(self.refresh_interval)
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "orders_seen": self.index.orders_seen,
+            "materials": len(self.index.neighbors),
+            "vectorized": bool(self._np)
+        }
+
+
+recommendation_engine = RecommendationEngine(
+    window_days=int(os.environ.get('RECOMMENDATION_WINDOW_DAYS', 90)),
+    top_k=int(os.environ.get('RECOMMENDATION_TOP_K', 20)),
+    refresh_interval=float(os.environ.get('RECOMMENDATION_REFRESH_SECONDS', 30)),
+    rebuild_interval=float(os.environ.get('RECOMMENDATION_REBUILD_SECONDS', 86400))
+)
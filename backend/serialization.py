@@ -0,0 +1,39 @@
+import os
+from functools import lru_cache
+from typing import Any, Dict, List, Type
+
+from fastapi.responses import Response
+from pydantic import BaseModel, TypeAdapter
+from pydantic_core import to_json
+
+# Data built by our own handlers from our own DB is serialized without re-validation
+TRUSTED_RESPONSES = os.environ.get('TRUSTED_RESPONSES', 'true').lower() != 'false'
+
+
+@lru_cache(maxsize=None)
+def list_adapter(model: Type[BaseModel]) -> TypeAdapter:
+    """Build (once per model) the TypeAdapter used to validate and dump lists"""
+    return TypeAdapter(List[model])
+
+
+@lru_cache(maxsize=None)
+def model_projection(model: Type[BaseModel]) -> Dict[str, int]:
+    """Mongo projection returning exactly the model's fields, so trusted output has no extras"""
+    return {"_id": 0, **{field: 1 for field in model.model_fields}}
+
+
+def model_response(model: Type[BaseModel], data: Any, many: bool = True, trusted: bool = TRUSTED_RESPONSES) -> Response:
+    """
+    Serialize `data` straight to JSON bytes. Endpoints keep declaring the model as
+    response_model for an accurate OpenAPI schema; returning a Response skips
+    FastAPI's per-request validation. Untrusted data goes through the cached
+    TypeAdapter instead.
+    """
+    if trusted:
+        body = to_json(data)
+    elif many:
+        adapter = list_adapter(model)
+        body = adapter.dump_json(adapter.validate_python(data))
+    else:
+        body = model.model_validate(data).model_dump_json().encode()
+    return Response(content=body, media_type="application/json")
@@ -0,0 +1,56 @@
+"""
+Launch the API in multi-process mode.
+
+Runs one uvicorn worker per available CPU core (or WEB_CONCURRENCY / --workers).
+Workers share no memory; catalog caches are kept coherent through the version
+stamps published by coherence.CatalogCoherence.
+
+    python serve.py --host 0.0.0.0 --port 8001
+"""
+import argparse
+import os
+from pathlib import Path
+
+import uvicorn
+
+ROOT_DIR = Path(__file__).parent
+
+
+def available_cores() -> int:
+    """Cores this process may run on, honouring CPU affinity / container limits"""
+    if hasattr(os, "sched_getaffinity"):
+        return max(1, len(os.sched_getaffinity(0)))
+    return os.cpu_count() or 1
+
+
+def default_workers() -> int:
+    return int(os.environ.get("WEB_CONCURRENCY", available_cores()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Street Food Raw Materials API")
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8001)))
+    parser.add_argument("--workers", type=int, default=default_workers(), help="Worker processes (default: one per core)")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    if os.environ.get("CART_STORE", "mongo").lower() == "memory" and args.workers > 1:
+        print("warning: CART_STORE=memory keeps carts in each worker's memory; "
+              "route each session to one worker (sticky sessions) or run --workers 1")
+    if os.environ.get("PROFILE_STORE", "mongo").lower() == "memory" and args.workers > 1:
+        print("warning: PROFILE_STORE=memory keeps profiles in each worker's memory; "
+              "fetching an X-Profile-Id only works with --workers 1")
+
+    uvicorn.run(
+        "server:app",
+        host=args.host,
+        port=args.port,
+        workers=max(1, args.workers),
+        app_dir=str(ROOT_DIR),
+        log_level=args.log_level,
+    )
+
+
+if __name__ == "__main__":
+    main()
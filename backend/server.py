@@ -1,9 +1,10 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Query
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Request, Header
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import asyncio
 import logging
 from pathlib import Path
 from typing import List, Optional, Any, Dict, Union
@@ -13,10 +14,18 @@ from bson import ObjectId
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Configure logging before any module logs during import or startup
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
 # Import models
 from models import (
-    RawMaterial, Supplier, Category, Cart, CartItem, Order,
-    AddToCartRequest, UpdateCartItemRequest, MaterialsQuery, CheckoutRequest
+    RawMaterial, PartialRawMaterial, Supplier, Category, Cart, CartItem, Order,
+    AddToCartRequest, UpdateCartItemRequest, MaterialsQuery, CheckoutRequest, ReorderRequest,
+    OrderStatusRequest, BulkOrderStatusRequest
 )
 
 # MongoDB connection
@@ -32,7 +41,72 @@ carts_collection = db.carts
 orders_collection = db.orders
 
 # Import database functions
-from database import seed_database, get_all_suppliers, get_all_categories, get_materials_with_suppliers
+from database import (
+    seed_database, ensure_indexes, backfill_group_deal_flags, get_all_suppliers, get_all_categories,
+    get_materials_with_suppliers, get_materials_by_ids, get_materials_for_cache
+)
+from cache import material_cache, invalidate_catalog_caches
+from coherence import create_catalog_coherence
+from singleflight import freeze, materials_flight, categories_flight, suppliers_flight
+from analytics import (
+    DIMENSIONS, ensure_rollup_indexes, schedule_order_rollup, drain_pending_rollups,
+    get_daily_sales, get_top_sellers
+)
+from export import (
+    MEDIA_TYPES, ORDER_LINE_FIELDS, MATERIAL_FIELDS, encode_rows, iter_order_lines, iter_materials
+)
+from pricelist import apply_pricelist, iter_json_entries, iter_ndjson_entries
+from startup import StartupState, prewarm_pool, ping
+from profiling import (
+    ProfilingMiddleware, create_profile_store, profiling_token, profiling_sample_rate, token_matches
+)
+from serialization import TRUSTED_RESPONSES, model_response, model_projection
+from recommendations import recommendation_engine
+from price_history import (
+    INTERVALS, ensure_price_history_indexes, get_downsampled_history, get_latest_points,
+    invalidate_price_history_cache
+)
+from admission import (
+    AdmissionControlMiddleware, admission_controller, admission_enabled, admission_trusted_proxies
+)
+from suggest import suggest_service
+from read_routing import CAUSAL_TOKEN_HEADER, CausalSessions, CausalTokenMiddleware, routing_stats
+from cart_store import create_cart_store
+from delta_sync import change_log, load_delta, load_snapshot
+from order_lifecycle import (
+    ORDER_STATUSES, InvalidTransition, ensure_order_lifecycle_indexes, history_entry,
+    transition_order, transition_orders, get_orders_by_status
+)
+from inventory import InsufficientStock, low_stock_watcher, release_stock, quantities_by_material, reserve_stock
+from outbox import StubSink, create_outbox
+from fields import (
+    CART_SELECTABLE_FIELDS, MATERIAL_SELECTABLE_FIELDS, ORDER_SELECTABLE_FIELDS, parse_fields, select, select_many,
+    to_projection
+)
+from geo import ensure_geo_indexes, backfill_supplier_coordinates, nearby_suppliers, parse_near, supplier_grid
+
+startup_state = StartupState()
+READY_PING_TIMEOUT = float(os.environ.get('READY_PING_TIMEOUT', 2.0))
+
+# Cross-worker catalog cache invalidation
+catalog_coherence = create_catalog_coherence(db, change_log)
+# Read-your-writes for cart and order reads: clients echo back the X-Causal-Token of their last write
+causal_sessions = CausalSessions(client)
+# Write-through by default; CART_STORE=memory keeps hot carts in memory and writes behind
+cart_store = create_cart_store(carts_collection, causal_sessions)
+# Order events for downstream integrations, written with the order and delivered in the background
+outbox = create_outbox(client, db)
+# Request profiles, shared by every worker so an X-Profile-Id can be fetched from any of them
+profile_store = create_profile_store(db)
+catalog_coherence.subscribe(invalidate_catalog_caches)
+catalog_coherence.subscribe(invalidate_price_history_cache)
+catalog_coherence.subscribe(supplier_grid.invalidate)
+catalog_coherence.subscribe(suggest_service.invalidate)
+
+async def publish_stock_changes(material_ids: List[int]):
+    await catalog_coherence.publish(material_ids, reason="stock")
+
+low_stock_watcher.on_change = publish_stock_changes
 
 def convert_objectids_to_strings(data: Union[Dict, List, Any]) -> Union[Dict, List, Any]:
     """
@@ -49,111 +123,457 @@ def convert_objectids_to_strings(data: Union[Dict, List, Any]) -> Union[Dict, Li
     else:
         return data
 
+def format_material(material: Dict) -> Dict:
+    """
+    Shape a material joined with its supplier into the response expected by the frontend
+    """
+    return {
+        "id": material["id"],
+        "name": material["name"],
+        "category": material["category"],
+        "price": material["price"],
+        "unit": material["unit"],
+        "supplier": {
+            "id": material["supplier"]["id"],
+            "name": material["supplier"]["name"],
+            "verified": material["supplier"]["verified"],
+            "location": material["supplier"]["location"]
+        },
+        "image": material["image"],
+        "inStock": material["inStock"],
+        "description": material["description"],
+        "groupPrice": material["groupPrice"],
+        "minGroupQuantity": material["minGroupQuantity"]
+    }
+
+async def load_materials_by_ids(material_ids: List[int]) -> List[Dict]:
+    """
+    Resolve materials by ID through the per-id cache, fetching all misses in one query
+    """
+    found, missing = material_cache.get_many(material_ids)
+    if missing:
+        for material in await get_materials_by_ids(missing):
+            formatted = format_material(material)
+            material_cache.set(formatted["id"], formatted)
+            found[formatted["id"]] = formatted
+    # Preserve the requested order and drop unknown IDs
+    return [found[material_id] for material_id in material_ids if material_id in found]
+
+async def find_nearby_suppliers(near: str, radius_km: Optional[float]) -> List:
+    """(supplier id, km) pairs nearest first, or a 400 for a malformed near"""
+    try:
+        lat, lng = parse_near(near)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="near must be lat,lng within valid ranges")
+    return await nearby_suppliers(lat, lng, radius_km)
+
+def with_supplier_distance(material: Dict, distance: Optional[float]) -> Dict:
+    """A copy of a (shared) formatted material with its supplier's distance from the caller"""
+    if distance is None or "supplier" not in material:
+        return material
+    return {**material, "supplier": {**material["supplier"], "distance_km": round(distance, 2)}}
+
+def parse_fields_param(raw: Optional[str], allowed: Dict) -> Optional[Dict]:
+    """Validate a fields= query parameter against the endpoint's whitelist"""
+    try:
+        return parse_fields(raw, allowed)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"{e}. Allowed fields: {', '.join(allowed)}")
+
+def parse_id_list(raw: str, label: str = "material") -> List[int]:
+    """
+    Parse a comma separated list of integer IDs, dropping duplicates
+    """
+    ids = []
+    for part in raw.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if not part.lstrip("-").isdigit():
+            raise HTTPException(status_code=400, detail=f"Invalid {label} id: {part}")
+        material_id = int(part)
+        if material_id not in ids:
+            ids.append(material_id)
+    return ids
+
 # Create the main app
 app = FastAPI()
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
-# Seed database on startup
+# Warm up in the background so new workers accept traffic immediately.
+# Seeding is a one-shot job (python manage.py seed) unless SEED_ON_STARTUP is set.
+async def warm_up():
+    # Keep retrying until the database answers; the pod stays not-ready meanwhile
+    delay = 0.5
+    while not await startup_state.step("database", ping_or_raise()):
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 10)
+    await startup_state.step("connection_pool", prewarm_pool(db, int(os.environ.get('MONGO_WARM_CONNECTIONS', 10))))
+    await startup_state.step("indexes", create_all_indexes())
+    # Diagnostics only; readiness does not wait for it
+    await startup_state.step("profile_store", profile_store.ensure_collection())
+    if os.environ.get('SEED_ON_STARTUP', 'false').lower() == 'true':
+        await startup_state.step("seed", seed_database())
+    # Caches must not be served without cross-worker invalidation, so keep trying
+    delay = 0.5
+    while not await startup_state.step("catalog_coherence", catalog_coherence.start()):
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 10)
+    change_log.start()
+    low_stock_watcher.start()
+    outbox.start()
+    await startup_state.step("catalog_cache", prime_catalog_cache())
+    await startup_state.step("search_suggestions", suggest_service.rebuild())
+    # Built in its own background loop; suggestions are empty until the first build
+    recommendation_engine.start()
+
+async def ping_or_raise():
+    if not await ping(db, READY_PING_TIMEOUT):
+        raise RuntimeError("database did not answer ping")
+
+async def create_all_indexes():
+    await ensure_indexes()
+    await ensure_rollup_indexes()
+    await ensure_price_history_indexes()
+    await ensure_geo_indexes()
+    await ensure_order_lifecycle_indexes()
+    await change_log.ensure_indexes()
+    await outbox.ensure_indexes()
+    located = await backfill_supplier_coordinates()
+    return f"{await backfill_group_deal_flags()} materials backfilled with hasGroupDeal, {located} suppliers located"
+
+async def prime_catalog_cache():
+    """Load the supplier grid and the per-id material cache before the first request"""
+    await supplier_grid.load()
+    # From the primary: a lagging secondary could cache prices no later invalidation will replace
+    materials = await get_materials_for_cache(material_cache.maxsize)
+    for material in materials:
+        material_cache.set(material["id"], format_material(material))
+    return f"{len(materials)} materials cached"
+
 @app.on_event("startup")
 async def startup_event():
-    try:
-        result = await seed_database()
-        print(f"Database initialization: {result}")
-    except Exception as e:
-        print(f"Error seeding database: {e}")
+    cart_store.start()
+    startup_state.run_in_background(warm_up())
+
+# Probes
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and serving requests"""
+    return {"status": "ok", "uptime": startup_state.report()["uptime"]}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: database reachable, indexes present, cache invalidation running and catalog cache primed"""
+    checks = {
+        "database": await ping(db, READY_PING_TIMEOUT),
+        "indexes": startup_state.done("indexes"),
+        "catalog_coherence": startup_state.done("catalog_coherence") and catalog_coherence.running,
+        "catalog_cache": startup_state.done("catalog_cache")
+    }
+    ready = all(checks.values())
+    return JSONResponse(
+        {"status": "ready" if ready else "not_ready", "checks": checks, **startup_state.report()},
+        status_code=200 if ready else 503
+    )
 
 # Root endpoint
 @api_router.get("/")
 async def root():
     return {"message": "Street Food Raw Materials API"}
 
+# Operational metrics
+@api_router.get("/metrics")
+async def get_metrics():
+    return {
+        "material_cache": material_cache.stats(),
+        "catalog_coherence": catalog_coherence.stats(),
+        "singleflight": {
+            flight.name: flight.stats()
+            for flight in (materials_flight, categories_flight, suppliers_flight)
+        },
+        "admission": admission_controller.stats(),
+        "recommendations": recommendation_engine.stats(),
+        "search_suggestions": suggest_service.stats(),
+        "read_routing": routing_stats(causal_sessions),
+        "cart_store": cart_store.stats(),
+        "low_stock": low_stock_watcher.stats(),
+        "outbox": {**outbox.stats(), **await outbox.lag()}
+    }
+
+@api_router.get("/outbox/stub")
+async def get_outbox_stub_events(limit: int = Query(50, ge=1, le=1000)):
+    """Events delivered to the local stub sink (OUTBOX_STUB_SINK=true) by this worker"""
+    stub = outbox.sinks.get("stub")
+    if not isinstance(stub, StubSink):
+        raise HTTPException(status_code=404, detail="Stub sink is not enabled")
+    return list(stub.received)[-limit:]
+
+# Delta sync for offline-capable clients
+@api_router.get("/sync")
+async def sync_catalog(
+    since: int = Query(0, ge=0, description="Catalog version the client last synced to; 0 for a full snapshot")
+):
+    """Materials, suppliers and categories changed since a catalog version, or a full snapshot"""
+    try:
+        state = await change_log.safe_version()
+        changes = None
+        # Clients from before the last compaction (or from another database) start over
+        if state["compacted_through"] <= since <= state["version"] and since > 0:
+            changes = await change_log.changes_since(since)
+        
+        projections = {"suppliers": model_projection(Supplier), "categories": model_projection(Category)}
+        if changes is None:
+            return {"version": state["version"], "mode": "snapshot",
+                    **await load_snapshot(format_material, projections)}
+        return {"version": state["version"], "mode": "delta",
+                **await load_delta(changes, format_material, projections)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error syncing catalog: {str(e)}")
+
+# Search endpoints
+@api_router.get("/search/suggest")
+async def search_suggest(
+    q: str = Query("", max_length=100, description="Prefix typed so far"),
+    limit: int = Query(5, ge=1, le=20, description="Completions per type")
+):
+    """Material, category and supplier name completions, served from memory only"""
+    return {"query": q, **suggest_service.suggest(q, limit)}
+
 # Materials endpoints
-@api_router.get("/materials", response_model=List[dict])
+@api_router.get("/materials", response_model=Union[List[RawMaterial], List[PartialRawMaterial]])
 async def get_materials(
     search: Optional[str] = Query(None, description="Search term for materials or suppliers"),
-    category: Optional[str] = Query("all", description="Filter by category"),
-    sort_by: Optional[str] = Query("name", description="Sort by: name, price, supplier"),
-    filter_by: Optional[str] = Query("all", description="Filter by: all, verified, instock, group"),
+    category: Optional[str] = Query("all", description="Filter by one or more comma separated categories"),
+    supplier: Optional[str] = Query(None, description="Filter by one or more comma separated supplier IDs"),
+    location: Optional[str] = Query(None, description="Filter by one or more comma separated supplier locations"),
+    min_price: Optional[float] = Query(None, ge=0, description="Minimum unit price"),
+    max_price: Optional[float] = Query(None, ge=0, description="Maximum unit price"),
+    sort_by: Optional[str] = Query(None, description="Sort by: popular (default), trending, name, price, supplier, distance (default when near is set)"),
+    filter_by: Optional[str] = Query("all", description="Filter by: all, or comma separated verified, instock, group"),
     limit: Optional[int] = Query(50, description="Limit number of results"),
-    offset: Optional[int] = Query(0, description="Offset for pagination")
+    offset: Optional[int] = Query(0, description="Offset for pagination"),
+    ids: Optional[str] = Query(None, description="Comma separated material IDs to fetch in one batch"),
+    near: Optional[str] = Query(None, description="Only materials from suppliers near lat,lng"),
+    radius_km: Optional[float] = Query(None, gt=0, description="Search radius around near, in km"),
+    fields: Optional[str] = Query(None, description="Comma separated fields to return, e.g. id,name,price,inStock,supplier.name")
 ):
     try:
+        selection = parse_fields_param(fields, MATERIAL_SELECTABLE_FIELDS)
+        # Selected fields are PartialRawMaterials; validating them would fill the rest with nulls
+        model, trusted = (RawMaterial, TRUSTED_RESPONSES) if selection is None else (PartialRawMaterial, True)
+        if ids is not None:
+            materials = await load_materials_by_ids(parse_id_list(ids))
+            return model_response(model, select_many(materials, selection), trusted=trusted)
+        
+        if min_price is not None and max_price is not None and min_price > max_price:
+            raise HTTPException(status_code=400, detail="min_price cannot be greater than max_price")
+        
+        distances = None
+        if near:
+            distances = dict(await find_nearby_suppliers(near, radius_km))
+        elif sort_by == "distance":
+            raise HTTPException(status_code=400, detail="sort_by=distance requires near")
+        
         query_params = {
             "search": search,
             "category": category,
-            "sort_by": sort_by,
+            "supplier_ids": parse_id_list(supplier, label="supplier") if supplier else [],
+            "location": location,
+            "min_price": min_price,
+            "max_price": max_price,
+            "sort_by": sort_by or ("distance" if near else "popular"),
             "filter_by": filter_by,
             "limit": limit,
-            "offset": offset
+            "offset": offset,
+            # Ordered nearest first; also the sort order for sort_by=distance
+            "nearby_supplier_ids": list(distances) if distances is not None else None,
+            "fields": selection
         }
         
-        materials = await get_materials_with_suppliers(query_params)
+        async def load_materials():
+            materials = await get_materials_with_suppliers(query_params)
+            # Format the response to match frontend expectations
+            if selection is None:
+                formatted = [format_material(material) for material in materials]
+            else:
+                # Stored names match the response, so projected documents only need trimming
+                formatted = select_many(materials, selection)
+            return formatted, [material.get("supplier_id") for material in materials]
         
-        # Format the response to match frontend expectations
-        formatted_materials = []
-        for material in materials:
-            formatted_material = {
-                "id": material["id"],
-                "name": material["name"],
-                "category": material["category"],
-                "price": material["price"],
-                "unit": material["unit"],
-                "supplier": {
-                    "id": material["supplier"]["id"],
-                    "name": material["supplier"]["name"],
-                    "verified": material["supplier"]["verified"],
-                    "location": material["supplier"]["location"]
-                },
-                "image": material["image"],
-                "inStock": material["inStock"],
-                "description": material["description"],
-                "groupPrice": material["groupPrice"],
-                "minGroupQuantity": material["minGroupQuantity"]
-            }
-            formatted_materials.append(formatted_material)
+        # Identical concurrent queries share a single aggregation
+        formatted_materials, supplier_ids = await materials_flight.do(freeze(query_params), load_materials)
         
-        return formatted_materials
+        # Distances depend on this caller's near, which the shared result does not
+        if distances is not None:
+            formatted_materials = [
+                with_supplier_distance(material, distances.get(supplier_id))
+                for material, supplier_id in zip(formatted_materials, supplier_ids)
+            ]
+        
+        return model_response(model, formatted_materials, trusted=trusted)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching materials: {str(e)}")
 
+@api_router.get("/materials/{material_id}", response_model=RawMaterial)
+async def get_material(material_id: int):
+    try:
+        materials = await load_materials_by_ids([material_id])
+        if not materials:
+            raise HTTPException(status_code=404, detail="Material not found")
+        return model_response(RawMaterial, materials[0], many=False)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching material: {str(e)}")
+
+@api_router.get("/materials/{material_id}/related", response_model=List[RawMaterial])
+async def get_related_materials(material_id: int, limit: int = Query(6, ge=1, le=20)):
+    """Materials frequently bought together with this one, served from memory"""
+    try:
+        neighbors = recommendation_engine.index.related(material_id, limit)
+        return model_response(RawMaterial, await load_materials_by_ids([other_id for other_id, _ in neighbors]))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching related materials: {str(e)}")
+
+@api_router.get("/materials/{material_id}/price-history")
+async def get_price_history(
+    material_id: int,
+    start: Optional[datetime] = Query(None, description="Start of the range, defaults to 30 days before end"),
+    end: Optional[datetime] = Query(None, description="End of the range, defaults to now"),
+    interval: str = Query("day", pattern=f"^({'|'.join(INTERVALS)})$", description="Downsampling interval"),
+    field: str = Query("price", pattern="^(price|groupPrice)$")
+):
+    """Downsampled min/max/avg series of recorded price points"""
+    try:
+        return {
+            "material_id": material_id,
+            "interval": interval,
+            "field": field,
+            "series": await get_downsampled_history(material_id, start, end, interval, field)
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching price history: {str(e)}")
+
+@api_router.get("/materials/{material_id}/price-history/latest")
+async def get_latest_prices(material_id: int, limit: int = Query(20, ge=1, le=50)):
+    """Most recent price points, newest first"""
+    try:
+        return await get_latest_points(material_id, limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching latest prices: {str(e)}")
+
 @api_router.get("/categories", response_model=List[Category])
 async def get_categories():
     try:
-        categories = await get_all_categories()
-        return categories
+        categories = await categories_flight.do(
+            "all", lambda: get_all_categories(model_projection(Category))
+        )
+        return model_response(Category, categories)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching categories: {str(e)}")
 
 @api_router.get("/suppliers", response_model=List[Supplier])
-async def get_suppliers():
+async def get_suppliers(
+    near: Optional[str] = Query(None, description="Order suppliers by distance from lat,lng"),
+    radius_km: Optional[float] = Query(None, gt=0, description="Only suppliers within this many km of near")
+):
     try:
-        suppliers = await get_all_suppliers()
-        return suppliers
+        suppliers = await suppliers_flight.do(
+            "all", lambda: get_all_suppliers(model_projection(Supplier))
+        )
+        if near:
+            by_id = {supplier["id"]: supplier for supplier in suppliers}
+            suppliers = [
+                {**by_id[supplier_id], "distance_km": round(distance, 2)}
+                for supplier_id, distance in await find_nearby_suppliers(near, radius_km)
+                if supplier_id in by_id
+            ]
+        return model_response(Supplier, suppliers)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching suppliers: {str(e)}")
 
-# Cart endpoints
-@api_router.get("/cart/{session_id}")
-async def get_cart(session_id: str):
+@api_router.post("/suppliers/{supplier_id}/pricelist")
+async def upload_pricelist(supplier_id: int, request: Request):
+    """
+    Bulk update price, groupPrice and inStock for a supplier's materials.
+    Accepts a JSON array or an application/x-ndjson stream of entries.
+    """
     try:
-        cart = await carts_collection.find_one({"session_id": session_id})
-        if not cart:
-            return {"session_id": session_id, "items": [], "total": 0, "count": 0}
+        supplier = await suppliers_collection.find_one({"id": supplier_id}, {"_id": 1})
+        if not supplier:
+            raise HTTPException(status_code=404, detail="Supplier not found")
         
-        total = sum(item["price"] * item["quantity"] for item in cart["items"])
-        count = sum(item["quantity"] for item in cart["items"])
+        if "ndjson" in request.headers.get("content-type", ""):
+            entries = iter_ndjson_entries(request.stream())
+        else:
+            entries = iter_json_entries(await request.body())
         
-        return {
-            "session_id": session_id,
-            "items": cart["items"],
-            "total": total,
-            "count": count
-        }
+        result = await apply_pricelist(supplier_id, entries)
+        
+        # One version bump for the whole list invalidates catalog caches in every worker
+        catalog_version = None
+        if result.changed_ids:
+            catalog_version = await catalog_coherence.publish(result.changed_ids, reason=f"pricelist:{supplier_id}")
+        
+        return {**result.summary(), "catalog_version": catalog_version}
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid price list: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error updating price list: {str(e)}")
+
+# Cart endpoints
+def cart_item_id(items: List[Dict]) -> int:
+    return max((item["id"] for item in items), default=0) + 1
+
+def cart_view(session_id: str, cart: Optional[Dict]) -> Dict:
+    """Cart as returned by GET /cart and echoed by every cart mutation"""
+    items = cart.get("items", []) if cart else []
+    return {
+        "session_id": session_id,
+        "items": items,
+        "total": sum(item["price"] * item["quantity"] for item in items),
+        "count": sum(item["quantity"] for item in items)
+    }
+
+@api_router.get("/cart/{session_id}")
+async def get_cart(
+    session_id: str,
+    fields: Optional[str] = Query(None, description="Comma separated fields to return, e.g. count,total")
+):
+    selection = parse_fields_param(fields, CART_SELECTABLE_FIELDS)
+    try:
+        projection = None
+        if selection is not None:
+            # total and count are computed from each line's price and quantity
+            whole_items = "items" in selection and selection["items"] is None
+            projection = to_projection(
+                {"items": selection["items"]} if "items" in selection else {}, CART_SELECTABLE_FIELDS,
+                required=["items.price", "items.quantity"] if {"total", "count"} & set(selection) and not whole_items else []
+            )
+        return select(cart_view(session_id, await cart_store.get(session_id, projection)), selection)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching cart: {str(e)}")
 
+@api_router.get("/cart/{session_id}/suggestions", response_model=List[RawMaterial])
+async def get_cart_suggestions(session_id: str, limit: int = Query(6, ge=1, le=20)):
+    """Materials frequently bought with the current cart contents"""
+    try:
+        cart = await cart_store.get(session_id)
+        basket = [item["material_id"] for item in (cart or {}).get("items", [])]
+        suggestions = recommendation_engine.index.suggest(basket, limit)
+        return model_response(RawMaterial, await load_materials_by_ids([other_id for other_id, _ in suggestions]))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching cart suggestions: {str(e)}")
+
 @api_router.post("/cart/{session_id}/add")
 async def add_to_cart(session_id: str, request: AddToCartRequest):
     try:
@@ -167,182 +587,495 @@ async def add_to_cart(session_id: str, request: AddToCartRequest):
         if not supplier:
             raise HTTPException(status_code=404, detail="Supplier not found")
         
-        # Create cart item
         price = material["groupPrice"] if request.is_group else material["price"]
-        cart_item = {
-            "id": len(await carts_collection.find_one({"session_id": session_id}) or {"items": []}.get("items", [])) + 1,
-            "material_id": material["id"],
-            "material_name": material["name"],
-            "quantity": request.quantity,
-            "price": price,
-            "unit": material["unit"],
-            "is_group": request.is_group,
-            "supplier_name": supplier["name"],
-            "image": material["image"]
-        }
+        now = datetime.utcnow()
         
         # Update or create cart
-        existing_cart = await carts_collection.find_one({"session_id": session_id})
-        
-        if existing_cart:
-            # Check if item already exists with same group status
-            item_exists = False
-            for item in existing_cart["items"]:
-                if item["material_id"] == request.material_id and item["is_group"] == request.is_group:
-                    item["quantity"] += request.quantity
-                    item_exists = True
-                    break
+        async with cart_store.edit(session_id) as edit:
+            cart = edit.cart or {"session_id": session_id, "items": [], "created_at": now}
             
-            if not item_exists:
-                existing_cart["items"].append(cart_item)
+            # Check if item already exists with same group status
+            existing = next(
+                (item for item in cart["items"]
+                 if item["material_id"] == request.material_id and item["is_group"] == request.is_group),
+                None
+            )
+            if existing:
+                existing["quantity"] += request.quantity
+            else:
+                cart["items"].append({
+                    "id": cart_item_id(cart["items"]),
+                    "material_id": material["id"],
+                    "material_name": material["name"],
+                    "quantity": request.quantity,
+                    "price": price,
+                    "unit": material["unit"],
+                    "is_group": request.is_group,
+                    "supplier_name": supplier["name"],
+                    "image": material["image"]
+                })
             
-            existing_cart["updated_at"] = datetime.utcnow()
-            await carts_collection.replace_one({"session_id": session_id}, existing_cart)
-        else:
-            new_cart = {
-                "session_id": session_id,
-                "items": [cart_item],
-                "created_at": datetime.utcnow(),
-                "updated_at": datetime.utcnow()
-            }
-            await carts_collection.insert_one(new_cart)
+            cart["updated_at"] = now
+            edit.save(cart)
         
-        return {"message": "Item added to cart successfully"}
+        # The updated cart lets clients skip a follow-up GET
+        return {"message": "Item added to cart successfully", "cart": cart_view(session_id, cart)}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error adding to cart: {str(e)}")
 
 @api_router.put("/cart/{session_id}/item/{item_id}")
 async def update_cart_item(session_id: str, item_id: int, request: UpdateCartItemRequest):
     try:
-        cart = await carts_collection.find_one({"session_id": session_id})
-        if not cart:
-            raise HTTPException(status_code=404, detail="Cart not found")
-        
-        # Update item quantity
-        item_found = False
-        for item in cart["items"]:
-            if item["id"] == item_id:
-                if request.quantity <= 0:
-                    cart["items"].remove(item)
-                else:
-                    item["quantity"] = request.quantity
-                item_found = True
-                break
-        
-        if not item_found:
-            raise HTTPException(status_code=404, detail="Item not found in cart")
-        
-        cart["updated_at"] = datetime.utcnow()
-        await carts_collection.replace_one({"session_id": session_id}, cart)
+        async with cart_store.edit(session_id) as edit:
+            cart = edit.cart
+            if not cart:
+                raise HTTPException(status_code=404, detail="Cart not found")
+            
+            # Update item quantity
+            item = next((item for item in cart["items"] if item["id"] == item_id), None)
+            if item is None:
+                raise HTTPException(status_code=404, detail="Item not found in cart")
+            if request.quantity <= 0:
+                cart["items"].remove(item)
+            else:
+                item["quantity"] = request.quantity
+            
+            cart["updated_at"] = datetime.utcnow()
+            edit.save(cart)
         
-        return {"message": "Cart item updated successfully"}
+        return {"message": "Cart item updated successfully", "cart": cart_view(session_id, cart)}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error updating cart item: {str(e)}")
 
 @api_router.delete("/cart/{session_id}/item/{item_id}")
 async def remove_from_cart(session_id: str, item_id: int):
     try:
-        cart = await carts_collection.find_one({"session_id": session_id})
-        if not cart:
-            raise HTTPException(status_code=404, detail="Cart not found")
-        
-        # Remove item
-        cart["items"] = [item for item in cart["items"] if item["id"] != item_id]
-        cart["updated_at"] = datetime.utcnow()
-        
-        await carts_collection.replace_one({"session_id": session_id}, cart)
+        async with cart_store.edit(session_id) as edit:
+            cart = edit.cart
+            if not cart:
+                raise HTTPException(status_code=404, detail="Cart not found")
+            
+            # Remove item
+            cart["items"] = [item for item in cart["items"] if item["id"] != item_id]
+            cart["updated_at"] = datetime.utcnow()
+            edit.save(cart)
         
-        return {"message": "Item removed from cart successfully"}
+        return {"message": "Item removed from cart successfully", "cart": cart_view(session_id, cart)}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error removing from cart: {str(e)}")
 
 @api_router.delete("/cart/{session_id}")
 async def clear_cart(session_id: str):
     try:
-        await carts_collection.delete_one({"session_id": session_id})
-        return {"message": "Cart cleared successfully"}
+        await cart_store.delete(session_id)
+        return {"message": "Cart cleared successfully", "cart": cart_view(session_id, None)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error clearing cart: {str(e)}")
 
 # Order endpoints
+def order_event(order: Dict) -> Dict:
+    """Payload of order events sent to downstream integrations"""
+    return {
+        "order_id": str(order["_id"]),
+        "session_id": order["session_id"],
+        "status": order["status"],
+        "total_amount": order["total_amount"],
+        "items": [
+            {key: item[key] for key in ("material_id", "material_name", "quantity", "price", "supplier_name")}
+            for item in order["items"]
+        ],
+        "created_at": order["created_at"].isoformat()
+    }
+
+async def order_exists(order_id: ObjectId) -> bool:
+    """Whether an order was persisted, read from the primary; unknown counts as persisted"""
+    try:
+        return await orders_collection.find_one({"_id": order_id}, {"_id": 1}) is not None
+    except Exception as e:
+        # Keeping stock reserved for a missing order is safer than releasing it twice
+        logger.error(f"Could not check whether order {order_id} was persisted: {e}")
+        return True
+
 @api_router.post("/orders")
 async def create_order(request: CheckoutRequest):
     try:
-        # Get cart
-        cart = await carts_collection.find_one({"session_id": request.session_id})
-        if not cart or not cart["items"]:
-            raise HTTPException(status_code=400, detail="Cart is empty")
-        
-        # Create order items
-        order_items = []
-        total_amount = 0
-        
-        for cart_item in cart["items"]:
-            item_total = cart_item["price"] * cart_item["quantity"]
-            order_item = {
-                "material_id": cart_item["material_id"],
-                "material_name": cart_item["material_name"],
-                "quantity": cart_item["quantity"],
-                "price": cart_item["price"],
-                "unit": cart_item["unit"],
-                "is_group": cart_item["is_group"],
-                "supplier_name": cart_item["supplier_name"],
-                "total": item_total
+        # The cart stays locked until it has been turned into an order and cleared
+        async with cart_store.edit(request.session_id) as edit:
+            cart = edit.cart
+            if not cart or not cart["items"]:
+                raise HTTPException(status_code=400, detail="Cart is empty")
+            
+            # Create order items
+            order_items = []
+            total_amount = 0
+            
+            for cart_item in cart["items"]:
+                item_total = cart_item["price"] * cart_item["quantity"]
+                order_item = {
+                    "material_id": cart_item["material_id"],
+                    "material_name": cart_item["material_name"],
+                    "quantity": cart_item["quantity"],
+                    "price": cart_item["price"],
+                    "unit": cart_item["unit"],
+                    "is_group": cart_item["is_group"],
+                    "supplier_name": cart_item["supplier_name"],
+                    "total": item_total
+                }
+                order_items.append(order_item)
+                total_amount += item_total
+            
+            # Take stock before the order exists; concurrent checkouts cannot oversell
+            await reserve_stock(order_items)
+            
+            # Create order
+            created_at = datetime.utcnow()
+            order = {
+                "session_id": request.session_id,
+                "items": order_items,
+                "total_amount": total_amount,
+                "status": "confirmed",
+                "status_history": [history_entry("confirmed", created_at)],
+                "stock_reserved": True,
+                "created_at": created_at
             }
-            order_items.append(order_item)
-            total_amount += item_total
-        
-        # Create order
-        order = {
-            "session_id": request.session_id,
-            "items": order_items,
-            "total_amount": total_amount,
-            "status": "confirmed",
-            "created_at": datetime.utcnow()
-        }
-        
-        result = await orders_collection.insert_one(order)
-        order["id"] = str(result.inserted_id)
+            
+            # Chosen up front so a failed write can be checked for before stock is given back
+            order["_id"] = ObjectId()
+            transactional = await outbox.transactions_supported()
+            try:
+                async with causal_sessions.start() as session:
+                    async with outbox.transaction(session) as txn:
+                        await orders_collection.insert_one(order, session=txn)
+                        try:
+                            await outbox.enqueue("order.created", order_event(order), session=txn)
+                        except Exception as e:
+                            if transactional:
+                                raise
+                            # Without a transaction the order is already committed; do not fail its checkout
+                            logger.error(f"Order {order['_id']} was placed but its order.created event was not queued: {e}")
+            except Exception:
+                # A commit can fail after the order was written; only an order that does not exist gives stock back
+                if not await order_exists(order["_id"]):
+                    await release_stock(quantities_by_material(order_items))
+                    raise
+                logger.warning(f"Order {order['_id']} was committed despite an error while placing it")
+            order["id"] = str(order["_id"])
+            outbox.notify()
+            
+            # Fold the order into the sales rollups without delaying checkout
+            schedule_order_rollup(order)
+            
+            # Clear cart after successful order
+            edit.delete()
         
-        # Clear cart after successful order
-        await carts_collection.delete_one({"session_id": request.session_id})
+        # A write-behind cart store makes the cleared cart durable before answering. The order
+        # is placed either way; a failed flush leaves the cart dirty for the background loop.
+        try:
+            await cart_store.flush([request.session_id])
+        except Exception as e:
+            logger.error(f"Order {order['id']} placed but its cleared cart was not flushed: {e}")
         
         return {
             "message": "Order placed successfully",
             "order_id": order["id"],
             "total_amount": total_amount
         }
+    except HTTPException:
+        raise
+    except InsufficientStock as e:
+        raise HTTPException(status_code=409, detail={"message": f"Insufficient stock: {e}", "shortages": e.shortages})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating order: {str(e)}")
 
+@api_router.get("/orders")
+async def get_order_queue(
+    status: str = Query(..., pattern=f"^({'|'.join(ORDER_STATUSES)})$", description="Order status to list"),
+    after: Optional[datetime] = Query(None, description="Only orders created after this time, for paging"),
+    limit: int = Query(100, ge=1, le=1000)
+):
+    """Oldest-first queue of orders in one status, e.g. confirmed orders awaiting dispatch"""
+    try:
+        return convert_objectids_to_strings(await get_orders_by_status(status, after, limit))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching orders: {str(e)}")
+
+@api_router.post("/orders/status")
+async def update_orders_status(request: BulkOrderStatusRequest):
+    """Move a batch of orders to a new status in one conditional update"""
+    try:
+        invalid = [order_id for order_id in request.order_ids if not ObjectId.is_valid(order_id)]
+        if invalid:
+            raise HTTPException(status_code=400, detail=f"Invalid order id: {invalid[0]}")
+        return await transition_orders([ObjectId(order_id) for order_id in request.order_ids], request.status, request.note)
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error updating orders: {str(e)}")
+
+@api_router.patch("/orders/{order_id}/status")
+async def update_order_status(order_id: str, request: OrderStatusRequest):
+    try:
+        if not ObjectId.is_valid(order_id):
+            raise HTTPException(status_code=404, detail="Order not found")
+        order = await transition_order(ObjectId(order_id), request.status, request.note)
+        if order is None:
+            raise HTTPException(status_code=404, detail="Order not found")
+        order.pop("rollup_applied", None)
+        order.pop("rollup_claim", None)
+        return convert_objectids_to_strings(order)
+    except HTTPException:
+        raise
+    except InvalidTransition as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error updating order: {str(e)}")
+
 @api_router.get("/orders/{session_id}")
-async def get_orders(session_id: str):
+async def get_orders(
+    session_id: str,
+    fields: Optional[str] = Query(None, description="Comma separated fields to return, e.g. id,status,total_amount")
+):
+    selection = parse_fields_param(fields, ORDER_SELECTABLE_FIELDS)
     try:
-        orders = await orders_collection.find({"session_id": session_id}).to_list(100)
+        projection = None
+        if selection is not None:
+            projection = to_projection(selection, ORDER_SELECTABLE_FIELDS, renames={"id": "_id"})
+        async with causal_sessions.start() as session:
+            orders = await causal_sessions.reader(orders_collection).find(
+                {"session_id": session_id}, projection, session=session
+            ).to_list(100)
         # Convert all ObjectIds to strings for JSON serialization
         serialized_orders = convert_objectids_to_strings(orders)
         return serialized_orders
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching orders: {str(e)}")
 
+@api_router.post("/orders/{order_id}/reorder")
+async def reorder(order_id: str, request: Optional[ReorderRequest] = None):
+    try:
+        if not ObjectId.is_valid(order_id):
+            raise HTTPException(status_code=404, detail="Order not found")
+        order = await orders_collection.find_one({"_id": ObjectId(order_id)}, {"session_id": 1, "items": 1})
+        if not order:
+            raise HTTPException(status_code=404, detail="Order not found")
+        session_id = (request.session_id if request and request.session_id else None) or order["session_id"]
+        
+        # Current prices and availability for every ordered material in one $in query
+        materials = {
+            material["id"]: material
+            for material in await get_materials_by_ids({item["material_id"] for item in order["items"]})
+        }
+        
+        # Merge into the cart with a single write
+        now = datetime.utcnow()
+        async with cart_store.edit(session_id) as edit:
+            cart = edit.cart or {"session_id": session_id, "items": [], "created_at": now}
+            items = cart["items"]
+            next_item_id = cart_item_id(items)
+            
+            added = []
+            unavailable = []
+            for order_item in order["items"]:
+                material = materials.get(order_item["material_id"])
+                if not material or not material["inStock"]:
+                    unavailable.append({
+                        "material_id": order_item["material_id"],
+                        "material_name": order_item["material_name"],
+                        "reason": "not_found" if not material else "out_of_stock"
+                    })
+                    continue
+            
+                price = material["groupPrice"] if order_item["is_group"] else material["price"]
+                existing = next(
+                    (item for item in items
+                     if item["material_id"] == material["id"] and item["is_group"] == order_item["is_group"]),
+                    None
+                )
+                if existing:
+                    existing["quantity"] += order_item["quantity"]
+                    existing["price"] = price
+                else:
+                    items.append({
+                        "id": next_item_id,
+                        "material_id": material["id"],
+                        "material_name": material["name"],
+                        "quantity": order_item["quantity"],
+                        "price": price,
+                        "unit": material["unit"],
+                        "is_group": order_item["is_group"],
+                        "supplier_name": material["supplier"]["name"],
+                        "image": material["image"]
+                    })
+                    next_item_id += 1
+                added.append({
+                    "material_id": material["id"],
+                    "quantity": order_item["quantity"],
+                    "price": price,
+                    "previous_price": order_item["price"]
+                })
+            
+            cart["updated_at"] = now
+            edit.save(cart)
+        
+        return {
+            "message": "Order items added to cart" if added else "No items from this order are available",
+            "session_id": session_id,
+            "added": added,
+            "unavailable": unavailable,
+            "total": sum(item["price"] * item["quantity"] for item in items),
+            "count": sum(item["quantity"] for item in items)
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error reordering: {str(e)}")
+
+# Analytics endpoints (read only the pre-aggregated sales rollups)
+def parse_rollup_key(dimension: str, key: Optional[str] = None):
+    if dimension not in DIMENSIONS:
+        raise HTTPException(status_code=404, detail=f"Unknown analytics dimension: {dimension}")
+    if key is None or dimension == "category":
+        return key
+    try:
+        return int(key)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {dimension} id: {key}")
+
+@api_router.get("/analytics/{dimension}")
+async def get_analytics_top(
+    dimension: str,
+    start: Optional[str] = Query(None, description="First day (YYYY-MM-DD), defaults to 30 days ago"),
+    end: Optional[str] = Query(None, description="Last day (YYYY-MM-DD), defaults to today"),
+    sort_by: str = Query("revenue", pattern="^(revenue|quantity|orders)$"),
+    limit: int = Query(10, ge=1, le=100)
+):
+    try:
+        parse_rollup_key(dimension)
+        return await get_top_sellers(dimension, start, end, sort_by, limit)
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid date range: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching analytics: {str(e)}")
+
+@api_router.get("/analytics/{dimension}/{key}")
+async def get_analytics_daily(
+    dimension: str,
+    key: str,
+    start: Optional[str] = Query(None, description="First day (YYYY-MM-DD), defaults to 30 days ago"),
+    end: Optional[str] = Query(None, description="Last day (YYYY-MM-DD), defaults to today")
+):
+    try:
+        rollup_key = parse_rollup_key(dimension, key)
+        return {
+            "dimension": dimension,
+            "key": rollup_key,
+            "daily": await get_daily_sales(dimension, rollup_key, start, end)
+        }
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid date range: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching analytics: {str(e)}")
+
+# Export endpoints (streamed, constant memory regardless of result size)
+def export_response(rows, fields: List[str], export_format: str, name: str) -> StreamingResponse:
+    filename = f"{name}_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.{export_format}"
+    return StreamingResponse(
+        encode_rows(rows, fields, export_format),
+        media_type=MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@api_router.get("/export/orders")
+async def export_orders(
+    format: str = Query("csv", pattern="^(csv|ndjson)$", description="csv or ndjson"),
+    start: Optional[datetime] = Query(None, description="Orders created at or after this date/time"),
+    end: Optional[datetime] = Query(None, description="Orders created before this date/time"),
+    supplier: Optional[str] = Query(None, description="Only lines from these comma separated supplier IDs")
+):
+    supplier_ids = parse_id_list(supplier, label="supplier") if supplier else None
+    return export_response(iter_order_lines(start, end, supplier_ids), ORDER_LINE_FIELDS, format, "orders")
+
+@api_router.get("/export/materials")
+async def export_materials(
+    format: str = Query("csv", pattern="^(csv|ndjson)$", description="csv or ndjson"),
+    supplier: Optional[str] = Query(None, description="Only materials from these comma separated supplier IDs")
+):
+    supplier_ids = parse_id_list(supplier, label="supplier") if supplier else None
+    return export_response(iter_materials(supplier_ids), MATERIAL_FIELDS, format, "materials")
+
+# Profiling endpoints (require the X-Profile token)
+def require_profiling_token(x_profile: Optional[str] = Header(None)):
+    if not token_matches(x_profile, profiling_token):
+        raise HTTPException(status_code=403, detail="Profiling token required")
+
+@api_router.get("/admin/profiles")
+async def list_profiles(x_profile: Optional[str] = Header(None)):
+    require_profiling_token(x_profile)
+    return await profile_store.summaries()
+
+@api_router.get("/admin/profiles/{profile_id}")
+async def get_profile(
+    profile_id: str,
+    format: str = Query("folded", pattern="^(folded|json)$", description="folded (flamegraph.pl / speedscope) or json"),
+    x_profile: Optional[str] = Header(None)
+):
+    require_profiling_token(x_profile)
+    record = await profile_store.get(profile_id)
+    if not record or "folded" not in record:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "folded":
+        return PlainTextResponse("\n".join(record["folded"]) + "\n")
+    return record
+
 # Include the router in the main app
 app.include_router(api_router)
 
+# Profiling wraps only the application so it measures handler time, not queueing
+app.add_middleware(
+    ProfilingMiddleware, store=profile_store, token=profiling_token, sample_rate=profiling_sample_rate
+)
+
+# Causal tokens in and out of cart and order requests (only with a non-primary SESSION_READ_PREFERENCE)
+app.add_middleware(CausalTokenMiddleware, sessions=causal_sessions)
+
+# Load shedding sits inside CORS so rejections still carry CORS headers
+app.add_middleware(
+    AdmissionControlMiddleware, controller=admission_controller, enabled=admission_enabled,
+    trusted_proxies=admission_trusted_proxies
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[CAUSAL_TOKEN_HEADER],
 )
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
-
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await startup_state.cancel()
+    await recommendation_engine.stop()
+    await catalog_coherence.stop()
+    await change_log.stop()
+    await low_stock_watcher.stop()
+    await outbox.stop()
+    await drain_pending_rollups()
+    # Write any carts still pending in the write-behind store
+    await cart_store.close()
     client.close()
\ No newline at end of file
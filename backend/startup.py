@@ -0,0 +1,76 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class StartupState:
+    """
+    Tracks background warm-up so the worker can accept traffic immediately while
+    /readyz reports whether the database, indexes and catalog caches are ready.
+    """
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.steps: Dict[str, str] = {}
+        self.errors: Dict[str, str] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def run_in_background(self, warm_up: Awaitable) -> None:
+        self._task = asyncio.ensure_future(warm_up)
+
+    async def cancel(self) -> None:
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def step(self, name: str, coro: Awaitable) -> bool:
+        """Run one warm-up step, recording its outcome instead of raising"""
+        self.steps[name] = "running"
+        began = time.monotonic()
+        try:
+            result = await coro
+        except Exception as e:
+            self.steps[name] = "failed"
+            self.errors[name] = str(e)
+            logger.error(f"Startup step {name} failed: {e}")
+            return False
+        self.steps[name] = "done"
+        self.errors.pop(name, None)
+        logger.info(f"Startup step {name} finished in {time.monotonic() - began:.3f}s: {result if result is not None else 'ok'}")
+        return True
+
+    def done(self, name: str) -> bool:
+        return self.steps.get(name) == "done"
+
+    @property
+    def warming(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def report(self) -> dict:
+        return {
+            "uptime": round(time.monotonic() - self.started_at, 3),
+            "warming": self.warming,
+            "steps": dict(self.steps),
+            "errors": dict(self.errors)
+        }
+
+
+async def prewarm_pool(database, connections: int) -> int:
+    """Open `connections` pooled sockets up front by issuing concurrent pings"""
+    await asyncio.gather(*[database.command("ping") for _ in range(max(1, connections))])
+    return connections
+
+
+async def ping(database, timeout: float) -> bool:
+    """True when the database answers a ping within `timeout` seconds"""
+    try:
+        await asyncio.wait_for(database.command("ping"), timeout)
+        return True
+    except Exception:
+        return False
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import re
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+
+from database import categories_collection, materials_collection, suppliers_collection
+
+logger = logging.getLogger(__name__)
+
+SUGGEST_TYPES = ("materials", "categories", "suppliers")
+# Bounds the scan for one- or two-letter prefixes on a large catalog
+MAX_SCAN = 2000
+
+_WORD = re.compile(r"\w+")
+
+
+def normalize(text: str) -> str:
+    return " ".join(_WORD.findall(text.lower()))
+
+
+class PrefixIndex:
+    """
+    Immutable prefix index over catalog names. Each word of a name is a key in one
+    sorted array, so "oil" completes both "Oil" and "Mustard Oil"; a lookup is a
+    bisect to the first key >= prefix followed by a scan while keys still match.
+    """
+
+    def __init__(self, entries: List[Dict]):
+        self.entries = entries
+        keys: List[Tuple[str, int, int]] = []
+        for position, entry in enumerate(entries):
+            words = normalize(entry["name"]).split()
+            for offset in range(len(words)):
+                # Key on the remaining words so multi-word prefixes ("green va") also match
+                keys.append((" ".join(words[offset:]), offset, position))
+        keys.sort()
+        self.keys = keys
+        self._words = [key for key, _, _ in keys]
+
+    def search(self, prefix: str, limit: int) -> Dict[str, List[Dict]]:
+        prefix = normalize(prefix)
+        results = {kind: [] for kind in SUGGEST_TYPES}
+        if not prefix:
+            return results
+
+        # (matches at the start of the name first, then shorter names, then alphabetical)
+        matches: Dict[int, Tuple[int, int, str]] = {}
+        index = bisect_left(self._words, prefix)
+        end = min(len(self._words), index + MAX_SCAN)
+        while index < end and self._words[index].startswith(prefix):
+            _, offset, position = self.keys[index]
+            name = self.entries[position]["name"]
+            rank = (0 if offset == 0 else 1, len(name), name)
+            if position not in matches or rank < matches[position]:
+                matches[position] = rank
+            index += 1
+
+        for position in sorted(matches, key=matches.get):
+            entry = self.entries[position]
+            bucket = results[entry["type"]]
+            if len(bucket) < limit:
+                bucket.append({key: value for key, value in entry.items() if key != "type"})
+        return results
+
+
+class SuggestService:
+    """
+    Serves completions from an in-memory PrefixIndex built from the catalog
+    snapshot. Catalog changes only mark the index stale and schedule one rebuild;
+    requests keep reading the previous index, so they never wait on Mongo.
+    """
+
+    def __init__(self):
+        self.index = PrefixIndex([])
+        self.built_at: Optional[float] = None
+        self._rebuild: Optional[asyncio.Task] = None
+        self._stale = False
+
+    @property
+    def ready(self) -> bool:
+        return self.built_at is not None
+
+    async def rebuild(self) -> int:
+        entries = []
+        async for material in materials_collection.find({}, {"_id": 0, "id": 1, "name": 1, "category": 1}):
+            entries.append({"type": "materials", "id": material["id"], "name": material["name"],
+                            "category": material.get("category")})
+        async for category in categories_collection.find({}, {"_id": 0, "id": 1, "name": 1, "icon": 1}):
+            entries.append({"type": "categories", "id": category["id"], "name": category["name"],
+                            "icon": category.get("icon")})
+        async for supplier in suppliers_collection.find({}, {"_id": 0, "id": 1, "name": 1, "location": 1}):
+            entries.append({"type": "suppliers", "id": supplier["id"], "name": supplier["name"],
+                            "location": supplier.get("location")})
+        self.index = PrefixIndex(entries)
+        self.built_at = time.monotonic()
+        return len(entries)
+
+    def invalidate(self, material_ids=None) -> None:
+        """Catalog coherence listener; coalesces bursts of changes into one rebuild"""
+        self._stale = True
+        if self._rebuild is None or self._rebuild.done():
+            self._rebuild = asyncio.create_task(self._rebuild_while_stale())
+
+    async def _rebuild_while_stale(self) -> None:
+        while self._stale:
+            self._stale = False
+            try:
+                await self.rebuild()
+            except Exception as e:
+                logger.error(f"Error rebuilding search suggestions: {e}")
+                return
+
+    def suggest(self, prefix: str, limit: int) -> Dict[str, List[Dict]]:
+        return self.index.search(prefix, limit)
+
+    def stats(self) -> dict:
+        return {"ready": self.ready, "entries": len(self.index.entries), "keys": len(self.index.keys)}
+
+
+suggest_service = SuggestService()
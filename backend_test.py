@@ -8,6 +8,7 @@ import requests
 import json
 import sys
 import os
+import time
 from datetime import datetime
 
 # Get backend URL from frontend .env file
@@ -83,6 +84,8 @@ def make_request(method, endpoint, data=None, params=None):
             response = requests.post(url, json=data, timeout=10)
         elif method == "PUT":
             response = requests.put(url, json=data, timeout=10)
+        elif method == "PATCH":
+            response = requests.patch(url, json=data, timeout=10)
         elif method == "DELETE":
             response = requests.delete(url, timeout=10)
         
@@ -104,6 +107,32 @@ def test_root_endpoint():
         return "message" in data and "Street Food Raw Materials API" in data["message"]
     return False
 
+def test_readiness_probe():
+    """Test GET /readyz and /healthz - Probes report each warm-up check"""
+    try:
+        ready = requests.get(f"{BASE_URL}/readyz", timeout=10)
+        live = requests.get(f"{BASE_URL}/healthz", timeout=10)
+    except requests.exceptions.RequestException as e:
+        print(f"  ❌ Request failed: {e}")
+        return False
+    
+    print(f"  📡 GET /readyz -> {ready.status_code}")
+    checks = ready.json().get("checks", {})
+    return (live.status_code == 200 and ready.status_code == 200 and
+            set(checks) == {"database", "indexes", "catalog_coherence", "catalog_cache"} and all(checks.values()))
+
+def test_metrics_endpoint():
+    """Test GET /api/metrics - Cache and request coalescing metrics"""
+    response = make_request("GET", "/metrics")
+    if not response:
+        return False
+    
+    if response.status_code == 200:
+        data = response.json()
+        flights = data.get("singleflight", {})
+        return all(name in flights for name in ["materials", "categories", "suppliers"])
+    return False
+
 def test_materials_basic():
     """Test GET /api/materials - Basic materials fetch"""
     response = make_request("GET", "/materials")
@@ -216,6 +245,54 @@ def test_materials_group_filter():
             return True
     return False
 
+def test_materials_price_range_and_multi_category():
+    """Test GET /api/materials with price range, multiple categories and combined flags"""
+    params = {"category": "spices,oil", "min_price": 100, "max_price": 300, "filter_by": "instock,group"}
+    response = make_request("GET", "/materials", params=params)
+    if not response:
+        return False
+    
+    if response.status_code == 200:
+        data = response.json()
+        if isinstance(data, list):
+            for item in data:
+                if (item["category"] not in ["spices", "oil"] or
+                        not 100 <= item["price"] <= 300 or
+                        not item["inStock"] or
+                        item["groupPrice"] >= item["price"]):
+                    return False
+            return True
+    return False
+
+def test_material_detail():
+    """Test GET /api/materials/{material_id} - Single material lookup"""
+    response = make_request("GET", "/materials/1")
+    if not response:
+        return False
+    
+    if response.status_code == 200:
+        data = response.json()
+        required_fields = ["id", "name", "category", "price", "unit", "supplier", "image", "inStock"]
+        return data["id"] == 1 and all(field in data for field in required_fields)
+    return False
+
+def test_material_detail_not_found():
+    """Test GET /api/materials/{material_id} with unknown ID"""
+    response = make_request("GET", "/materials/999")
+    return response is not None and response.status_code == 404
+
+def test_materials_batch_ids():
+    """Test GET /api/materials?ids= - Batch material lookup"""
+    response = make_request("GET", "/materials", params={"ids": "3,1,999"})
+    if not response:
+        return False
+    
+    if response.status_code == 200:
+        data = response.json()
+        # Unknown IDs are dropped and the requested order is kept
+        return isinstance(data, list) and [item["id"] for item in data] == [3, 1]
+    return False
+
 def test_categories_endpoint():
     """Test GET /api/categories"""
     response = make_request("GET", "/categories")
@@ -246,6 +323,86 @@ def test_suppliers_endpoint():
             return all(field in supplier for field in required_fields)
     return False
 
+def test_catalog_projection():
+    """Test catalog responses carry exactly the model fields, and fields= is documented as partial"""
+    categories = make_request("GET", "/categories")
+    suppliers = make_request("GET", "/suppliers")
+    if not categories or not suppliers or categories.status_code != 200 or suppliers.status_code != 200:
+        return False
+    if any(set(category) != {"id", "name", "icon"} for category in categories.json()):
+        return False
+    if any(not set(supplier) <= {"id", "name", "verified", "location", "distance_km"} for supplier in suppliers.json()):
+        return False
+    
+    selected = make_request("GET", "/materials", params={"ids": "1,2", "fields": "id,supplier.name"})
+    if not selected or selected.status_code != 200:
+        return False
+    if any(set(material) != {"id", "supplier"} or set(material["supplier"]) != {"name"} for material in selected.json()):
+        return False
+    
+    try:
+        schema = requests.get(f"{BASE_URL}/openapi.json", timeout=10).json()
+    except requests.exceptions.RequestException as e:
+        print(f"  ❌ Request failed: {e}")
+        return False
+    response_schema = schema["paths"]["/api/materials"]["get"]["responses"]["200"]["content"]["application/json"]["schema"]
+    partial = schema["components"]["schemas"].get("PartialRawMaterial", {})
+    return "PartialRawMaterial" in json.dumps(response_schema) and not partial.get("required")
+
+def test_supplier_pricelist_update():
+    """Test POST /api/suppliers/{supplier_id}/pricelist - Bulk price and stock update"""
+    material = make_request("GET", "/materials/1")
+    if not material or material.status_code != 200:
+        return False
+    current = material.json()
+    
+    # Re-sending the current values must not write anything
+    entries = [
+        {"material_id": 1, "price": current["price"], "inStock": current["inStock"]},
+        {"material_id": 2, "price": 10}  # belongs to another supplier
+    ]
+    response = make_request("POST", f"/suppliers/{current['supplier']['id']}/pricelist", data=entries)
+    if not response or response.status_code != 200:
+        return False
+    
+    data = response.json()
+    return (data["received"] == 2 and data["updated"] == 0 and
+            data["unchanged"] == 1 and data["rejected"] == 1)
+
+def test_price_history():
+    """Test GET /api/materials/{id}/price-history - Price list changes are recorded and queryable"""
+    material = make_request("GET", "/materials/3")
+    if not material or material.status_code != 200:
+        return False
+    current = material.json()
+    pricelist = f"/suppliers/{current['supplier']['id']}/pricelist"
+    before = make_request("GET", "/materials/3/price-history/latest", params={"limit": 50})
+    if not before or before.status_code != 200:
+        return False
+    
+    # Raise the price, then put it back
+    raised = round(current["price"] + 5, 2)
+    for price in (raised, current["price"]):
+        response = make_request("POST", pricelist, data=[{"material_id": 3, "price": price}])
+        if not response or response.status_code != 200 or response.json()["updated"] != 1:
+            return False
+    
+    latest = make_request("GET", "/materials/3/price-history/latest", params={"limit": 50})
+    if not latest or latest.status_code != 200:
+        return False
+    added = [point["price"] for point in latest.json()[:len(latest.json()) - len(before.json())]]
+    # Newest first; the first recorded change also records the price it changed from
+    expected = [current["price"], raised] + ([current["price"]] if not before.json() else [])
+    if added != expected:
+        print(f"  ❌ Recorded {added}, expected {expected}")
+        return False
+    
+    history = make_request("GET", "/materials/3/price-history", params={"interval": "hour"})
+    if not history or history.status_code != 200:
+        return False
+    series = history.json()["series"]
+    return bool(series) and series[-1]["last"] == current["price"] and series[-1]["max"] >= raised
+
 def test_cart_get_new_session():
     """Test GET /api/cart/{session_id} for new session"""
     response = make_request("GET", f"/cart/{SESSION_ID}")
@@ -279,7 +436,9 @@ def test_cart_add_item():
     
     if response.status_code == 200:
         data = response.json()
-        return "message" in data and "added to cart" in data["message"].lower()
+        # The updated cart comes back with the mutation
+        return ("message" in data and "added to cart" in data["message"].lower() and
+                data["cart"]["count"] == 2 and data["cart"]["items"][0]["material_id"] == 1)
     return False
 
 def test_cart_add_group_item():
@@ -413,6 +572,238 @@ def test_order_history():
             return True  # Empty order history is also valid
     return False
 
+def test_analytics_rollups():
+    """Test GET /api/analytics/{dimension}[/{key}] - Sales rollups after checkout"""
+    response = make_request("GET", "/analytics/material/1")
+    if not response or response.status_code != 200:
+        return False
+    
+    data = response.json()
+    if not (data["dimension"] == "material" and data["key"] == 1 and isinstance(data["daily"], list)):
+        return False
+    
+    response = make_request("GET", "/analytics/supplier", params={"sort_by": "quantity", "limit": 5})
+    return response is not None and response.status_code == 200 and isinstance(response.json(), list)
+
+def test_export_orders_ndjson():
+    """Test GET /api/export/orders - Streamed NDJSON export of order lines"""
+    response = make_request("GET", "/export/orders", params={"format": "ndjson"})
+    if not response or response.status_code != 200:
+        return False
+    
+    lines = [line for line in response.text.splitlines() if line]
+    return all("order_id" in json.loads(line) and "material_id" in json.loads(line) for line in lines)
+
+def test_export_materials_csv():
+    """Test GET /api/export/materials - Streamed CSV export of the catalog"""
+    response = make_request("GET", "/export/materials", params={"supplier": "1"})
+    if not response or response.status_code != 200:
+        return False
+    
+    rows = response.text.splitlines()
+    return rows[0].startswith("id,name,category,price") and all(row.split(",")[8] == "1" for row in rows[1:])
+
+def test_related_materials():
+    """Test GET /api/materials/{material_id}/related - Frequently bought together"""
+    response = make_request("GET", "/materials/1/related", params={"limit": 3})
+    if not response or response.status_code != 200:
+        return False
+    
+    data = response.json()
+    # The index may still be empty right after startup
+    return isinstance(data, list) and len(data) <= 3 and all(item["id"] != 1 for item in data)
+
+def test_catalog_sync():
+    """Test GET /api/sync - Full snapshot, then an empty delta from the returned version"""
+    snapshot = make_request("GET", "/sync")
+    if not snapshot or snapshot.status_code != 200:
+        return False
+    data = snapshot.json()
+    if data["mode"] != "snapshot" or not data["materials"]["upserted"]:
+        return False
+    if data["version"] == 0:
+        # Nothing published yet, so there is no version to resume from
+        return True
+    
+    delta = make_request("GET", "/sync", params={"since": data["version"]})
+    if not delta or delta.status_code != 200:
+        return False
+    return delta.json()["mode"] == "delta" and delta.json()["version"] >= data["version"]
+
+def test_search_suggest():
+    """Test GET /api/search/suggest - Search-as-you-type completions"""
+    response = make_request("GET", "/search/suggest", params={"q": "tom", "limit": 3})
+    if not response or response.status_code != 200:
+        return False
+    
+    data = response.json()
+    return (all(key in data for key in ("materials", "categories", "suppliers")) and
+            any(material["name"] == "Fresh Tomatoes" for material in data["materials"]) and
+            all(len(data[key]) <= 3 for key in ("materials", "categories", "suppliers")))
+
+def test_nearby_suppliers():
+    """Test GET /api/suppliers?near= and /api/materials?near= - Nearest supplier queries"""
+    # Central Pune: the Pune supplier first, Mumbai within 200 km, nothing else
+    suppliers = make_request("GET", "/suppliers", params={"near": "18.52,73.85", "radius_km": 200})
+    if not suppliers or suppliers.status_code != 200:
+        return False
+    locations = [supplier["location"] for supplier in suppliers.json()]
+    distances = [supplier["distance_km"] for supplier in suppliers.json()]
+    if locations != ["Pune", "Mumbai"] or distances != sorted(distances):
+        return False
+    
+    materials = make_request("GET", "/materials", params={"near": "18.52,73.85", "radius_km": 200})
+    if not materials or materials.status_code != 200:
+        return False
+    material_distances = [material["supplier"]["distance_km"] for material in materials.json()]
+    return (all(material["supplier"]["location"] in ("Pune", "Mumbai") for material in materials.json()) and
+            material_distances == sorted(material_distances))
+
+def test_order_status_transitions():
+    """Test order lifecycle: bulk ship, single deliver, and rejected transitions"""
+    orders = make_request("GET", f"/orders/{SESSION_ID}")
+    if not orders or orders.status_code != 200 or not orders.json():
+        return False
+    order_ids = [order["id"] for order in orders.json() if order["status"] == "confirmed"]
+    if not order_ids:
+        return False
+    
+    shipped = make_request("POST", "/orders/status", data={"order_ids": order_ids, "status": "shipped"})
+    if not shipped or shipped.status_code != 200 or sorted(shipped.json()["transitioned"]) != sorted(order_ids):
+        return False
+    
+    delivered = make_request("PATCH", f"/orders/{order_ids[0]}/status", data={"status": "delivered"})
+    if not delivered or delivered.status_code != 200:
+        return False
+    history = [entry["status"] for entry in delivered.json()["status_history"]]
+    
+    # Delivered is terminal
+    rejected = make_request("PATCH", f"/orders/{order_ids[0]}/status", data={"status": "cancelled"})
+    return history == ["confirmed", "shipped", "delivered"] and rejected is not None and rejected.status_code == 409
+
+def test_stock_reservation():
+    """Test checkout reserves stock, rejects overselling and releases on cancellation"""
+    session_id = f"{SESSION_ID}-stock"
+    
+    def available():
+        # An order larger than any stock is refused with the quantity left
+        make_request("POST", f"/cart/{session_id}/add", data={"material_id": 1, "quantity": 10**9})
+        response = make_request("POST", "/orders", data={"session_id": session_id})
+        make_request("DELETE", f"/cart/{session_id}")
+        if not response or response.status_code != 409:
+            return None
+        return response.json()["detail"]["shortages"][0]["available"]
+    
+    before = available()
+    if not before:
+        return False
+    make_request("POST", f"/cart/{session_id}/add", data={"material_id": 1, "quantity": 1})
+    order = make_request("POST", "/orders", data={"session_id": session_id})
+    if not order or order.status_code != 200 or available() != before - 1:
+        return False
+    cancelled = make_request("PATCH", f"/orders/{order.json()['order_id']}/status", data={"status": "cancelled"})
+    return cancelled is not None and cancelled.status_code == 200 and available() == before
+
+def test_order_outbox():
+    """Test order events are queued and delivered by the outbox dispatcher"""
+    metrics = make_request("GET", "/metrics")
+    if not metrics or metrics.status_code != 200:
+        return False
+    outbox = metrics.json()["outbox"]
+    if not {"sinks", "delivered", "pending", "oldest_pending_seconds"} <= set(outbox):
+        return False
+    if "stub" not in outbox["sinks"]:
+        # Delivery can only be observed with OUTBOX_STUB_SINK=true
+        return True
+    
+    orders = make_request("GET", f"/orders/{SESSION_ID}")
+    if not orders or orders.status_code != 200 or not orders.json():
+        return False
+    order_ids = {order["id"] for order in orders.json()}
+    for _ in range(20):
+        events = make_request("GET", "/outbox/stub", params={"limit": 1000})
+        if events and events.status_code == 200 and any(
+            event["type"] == "order.created" and event["payload"]["order_id"] in order_ids for event in events.json()
+        ):
+            return True
+        time.sleep(0.5)
+    return False
+
+def test_materials_sort_popular():
+    """Test GET /api/materials ranked by order counters and trending scores"""
+    by_name = make_request("GET", "/materials", params={"sort_by": "name"})
+    if not by_name or by_name.status_code != 200:
+        return False
+    expected = sorted(material["id"] for material in by_name.json())
+    for sort_by in ("popular", "trending"):
+        response = make_request("GET", "/materials", params={"sort_by": sort_by})
+        if not response or response.status_code != 200:
+            return False
+        if sorted(material["id"] for material in response.json()) != expected:
+            return False
+    return True
+
+def test_field_selection():
+    """Test fields= trims list responses and rejects unknown fields"""
+    materials = make_request("GET", "/materials", params={"fields": "id,name,price,inStock"})
+    if not materials or materials.status_code != 200 or not materials.json():
+        return False
+    if any(set(material) != {"id", "name", "price", "inStock"} for material in materials.json()):
+        return False
+    
+    cart = make_request("GET", f"/cart/{SESSION_ID}", params={"fields": "count,total"})
+    if not cart or cart.status_code != 200 or set(cart.json()) != {"count", "total"}:
+        return False
+    
+    orders = make_request("GET", f"/orders/{SESSION_ID}", params={"fields": "id,status"})
+    if not orders or orders.status_code != 200 or any(set(order) != {"id", "status"} for order in orders.json()):
+        return False
+    
+    invalid = make_request("GET", "/materials", params={"fields": "id,secret"})
+    return invalid is not None and invalid.status_code == 400
+
+def test_rate_limit_burst():
+    """Test a checkout burst beyond the per-client bucket gets 429 with Retry-After"""
+    session_id = f"{SESSION_ID}-burst"
+    # Empty-cart checkouts are cheap 400s until the checkout bucket (burst 10) runs dry
+    for _ in range(15):
+        response = make_request("POST", "/orders", data={"session_id": session_id})
+        if not response:
+            return False
+        if response.status_code == 429:
+            retry_after = response.headers.get("Retry-After")
+            if not retry_after or int(retry_after) < 1:
+                return False
+            # Let the bucket refill for later checkout tests
+            time.sleep(int(retry_after) * 5)
+            return True
+        if response.status_code != 400:
+            return False
+    return False
+
+def test_profiles_require_token():
+    """Test GET /api/admin/profiles - Stored profiles are only served with the X-Profile token"""
+    listed = make_request("GET", "/admin/profiles")
+    single = make_request("GET", "/admin/profiles/1")
+    return listed is not None and listed.status_code == 403 and single is not None and single.status_code == 403
+
+def test_reorder():
+    """Test POST /api/orders/{order_id}/reorder - Refill the cart from a previous order"""
+    orders = make_request("GET", f"/orders/{SESSION_ID}")
+    if not orders or orders.status_code != 200 or not orders.json():
+        return False
+    order = orders.json()[0]
+    
+    response = make_request("POST", f"/orders/{order['id']}/reorder", data={"session_id": SESSION_ID})
+    if not response or response.status_code != 200:
+        return False
+    
+    data = response.json()
+    reordered = len(data["added"]) + len(data["unavailable"])
+    # Leave the cart empty for the following tests
+    make_request("DELETE", f"/cart/{SESSION_ID}")
+    return data["session_id"] == SESSION_ID and reordered == len(order["items"])
+
 def test_cart_cleared_after_order():
     """Test that cart is cleared after order creation"""
     response = make_request("GET", f"/cart/{SESSION_ID}")
@@ -443,6 +834,8 @@ def main():
     
     # Root endpoint test
     tester.test("Root endpoint health check", test_root_endpoint)
+    tester.test("Readiness and liveness probes", test_readiness_probe)
+    tester.test("Metrics endpoint", test_metrics_endpoint)
     
     # Materials endpoint tests
     tester.test("Materials basic fetch", test_materials_basic)
@@ -452,10 +845,16 @@ def main():
     tester.test("Materials verified suppliers filter", test_materials_verified_filter)
     tester.test("Materials in-stock filter", test_materials_instock_filter)
     tester.test("Materials group deals filter", test_materials_group_filter)
+    tester.test("Materials price range and multi-value filters", test_materials_price_range_and_multi_category)
+    tester.test("Material detail", test_material_detail)
+    tester.test("Material detail not found", test_material_detail_not_found)
+    tester.test("Materials batch lookup by IDs", test_materials_batch_ids)
     
     # Categories and suppliers tests
     tester.test("Categories endpoint", test_categories_endpoint)
     tester.test("Suppliers endpoint", test_suppliers_endpoint)
+    tester.test("Catalog projections and partial material schema", test_catalog_projection)
+    tester.test("Supplier price list bulk update", test_supplier_pricelist_update)
     
     # Cart operations tests
     tester.test("Cart retrieval for new session", test_cart_get_new_session)
@@ -470,6 +869,23 @@ def main():
     tester.test("Order creation/checkout", test_order_creation)
     tester.test("Order history retrieval", test_order_history)
     tester.test("Cart cleared after order", test_cart_cleared_after_order)
+    tester.test("Reorder a previous order", test_reorder)
+    tester.test("Sales analytics rollups", test_analytics_rollups)
+    tester.test("Related materials", test_related_materials)
+    tester.test("Nearby suppliers", test_nearby_suppliers)
+    tester.test("Search suggestions", test_search_suggest)
+    tester.test("Catalog delta sync", test_catalog_sync)
+    tester.test("Price history recording and queries", test_price_history)
+    tester.test("Order status transitions", test_order_status_transitions)
+    tester.test("Stock reservation and release", test_stock_reservation)
+    tester.test("Order events via outbox", test_order_outbox)
+    tester.test("Materials sorted by popularity", test_materials_sort_popular)
+    tester.test("Field selection on list endpoints", test_field_selection)
+    tester.test("Export orders as NDJSON", test_export_orders_ndjson)
+    tester.test("Export materials as CSV", test_export_materials_csv)
+    
+    tester.test("Profiles require the profiling token", test_profiles_require_token)
+    tester.test("Rate limiting of checkout bursts", test_rate_limit_burst)
     
     # Error handling test
     tester.test("Error handling for invalid requests", test_error_handling)
@@ -9,7 +9,7 @@ import { ordersApi } from '../services/api';
 import { useToast } from '../hooks/use-toast';
 
 const Cart = ({ isOpen, onClose }) => {
-  const { cart, updateCartItem, removeFromCart, isLoading } = useCart();
+  const { cart, updateCartItem, removeFromCart, refreshCart, isLoading } = useCart();
   const [isCheckingOut, setIsCheckingOut] = useState(false);
   const { toast } = useToast();
 
@@ -26,6 +26,8 @@ const Cart = ({ isOpen, onClose }) => {
     
     try {
       const orderResult = await ordersApi.createOrder();
+      // The server emptied the cart with the order
+      refreshCart();
       
       setIsCheckingOut(false);
       onClose();
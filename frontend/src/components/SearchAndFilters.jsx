@@ -16,6 +16,8 @@ const SearchAndFilters = ({
   onFilterChange
 }) => {
   const sortOptions = [
+    { value: 'popular', label: 'Most Ordered' },
+    { value: 'trending', label: 'Trending' },
     { value: 'name', label: 'Name' },
     { value: 'price', label: 'Price' },
     { value: 'supplier', label: 'Supplier' }
@@ -2,17 +2,57 @@ import { useState, useEffect, useCallback } from 'react';
 import { cartApi } from '../services/api';
 import { useToast } from './use-toast';
 
+const EMPTY_CART = { items: [], total: 0, count: 0 };
+
+// Every useCart instance (navbar badge, cart drawer) shares one cart snapshot
+let sharedCart = null;
+const listeners = new Set();
+
+// Mutations are numbered as they start. A server cart is only shown if no newer
+// mutation has started since its request went out, so a slow older response cannot
+// overwrite a newer cart or a newer optimistic change. Overlapping mutations may be
+// applied by the server in any order, so none of their responses is trusted: the
+// cart is reloaded once the last of them settles.
+let latestMutation = 0;
+let pendingMutations = 0;
+let overlapped = false;
+
+const publishCart = (cart) => {
+  sharedCart = cart;
+  listeners.forEach((listener) => listener(cart));
+};
+
+// Server truth after a failed mutation: the failed change is dropped, others are kept
+const reloadCart = async () => {
+  const seq = latestMutation;
+  const cart = await cartApi.getCart();
+  if (seq === latestMutation) {
+    publishCart(cart);
+  }
+};
+
+const withItems = (cart, items) => ({
+  ...cart,
+  items,
+  total: items.reduce((sum, item) => sum + item.price * item.quantity, 0),
+  count: items.reduce((sum, item) => sum + item.quantity, 0)
+});
+
 export const useCart = () => {
-  const [cart, setCart] = useState({ items: [], total: 0, count: 0 });
+  const [cart, setCart] = useState(sharedCart || EMPTY_CART);
   const [isLoading, setIsLoading] = useState(false);
   const { toast } = useToast();
 
+  useEffect(() => {
+    listeners.add(setCart);
+    return () => listeners.delete(setCart);
+  }, []);
+
   // Fetch cart data
   const fetchCart = useCallback(async () => {
     try {
       setIsLoading(true);
-      const cartData = await cartApi.getCart();
-      setCart(cartData);
+      await reloadCart();
     } catch (error) {
       console.error('Error fetching cart:', error);
       toast({
@@ -25,13 +65,52 @@ export const useCart = () => {
     }
   }, [toast]);
 
+  // Show `optimistic` right away, then the server cart once no other mutation is
+  // pending. A failure reloads the cart instead of restoring a snapshot, which
+  // would also undo the changes of mutations that overlapped with it.
+  const mutateCart = useCallback(async (optimistic, mutation) => {
+    const seq = ++latestMutation;
+    pendingMutations += 1;
+    overlapped = overlapped || pendingMutations > 1;
+    if (optimistic) {
+      publishCart(optimistic(sharedCart || EMPTY_CART));
+    }
+    let result;
+    let failure;
+    try {
+      result = await mutation();
+    } catch (error) {
+      failure = error;
+    }
+    pendingMutations -= 1;
+    if (pendingMutations === 0) {
+      if (failure || overlapped) {
+        reloadCart().catch((error) => console.error('Error reloading cart:', error));
+      } else if (seq === latestMutation) {
+        publishCart(result.cart);
+      }
+      overlapped = false;
+    }
+    if (failure) {
+      throw failure;
+    }
+    return result;
+  }, []);
+
   // Add item to cart
   const addToCart = useCallback(async (materialId, quantity = 1, isGroup = false) => {
     try {
       setIsLoading(true);
-      await cartApi.addToCart(materialId, quantity, isGroup);
-      await fetchCart(); // Refresh cart data
-      
+      // A new line needs name and price from the server, so only existing lines update ahead of it
+      await mutateCart(
+        (current) => withItems(current, current.items.map((item) => (
+          item.material_id === materialId && item.is_group === isGroup
+            ? { ...item, quantity: item.quantity + quantity }
+            : item
+        ))),
+        () => cartApi.addToCart(materialId, quantity, isGroup)
+      );
+
       toast({
         title: "Added to Cart!",
         description: `Item has been added to your cart.`,
@@ -46,18 +125,24 @@ export const useCart = () => {
     } finally {
       setIsLoading(false);
     }
-  }, [fetchCart, toast]);
+  }, [mutateCart, toast]);
 
   // Update cart item quantity
   const updateCartItem = useCallback(async (itemId, quantity) => {
     try {
-      setIsLoading(true);
       if (quantity <= 0) {
-        await cartApi.removeFromCart(itemId);
+        await mutateCart(
+          (current) => withItems(current, current.items.filter((item) => item.id !== itemId)),
+          () => cartApi.removeFromCart(itemId)
+        );
       } else {
-        await cartApi.updateCartItem(itemId, quantity);
+        await mutateCart(
+          (current) => withItems(current, current.items.map((item) => (
+            item.id === itemId ? { ...item, quantity } : item
+          ))),
+          () => cartApi.updateCartItem(itemId, quantity)
+        );
       }
-      await fetchCart(); // Refresh cart data
     } catch (error) {
       console.error('Error updating cart item:', error);
       toast({
@@ -65,18 +150,17 @@ export const useCart = () => {
         description: "Failed to update cart item.",
         variant: "destructive",
       });
-    } finally {
-      setIsLoading(false);
     }
-  }, [fetchCart, toast]);
+  }, [mutateCart, toast]);
 
   // Remove item from cart
   const removeFromCart = useCallback(async (itemId) => {
     try {
-      setIsLoading(true);
-      await cartApi.removeFromCart(itemId);
-      await fetchCart(); // Refresh cart data
-      
+      await mutateCart(
+        (current) => withItems(current, current.items.filter((item) => item.id !== itemId)),
+        () => cartApi.removeFromCart(itemId)
+      );
+
       toast({
         title: "Item Removed",
         description: "Item has been removed from your cart.",
@@ -88,18 +172,14 @@ export const useCart = () => {
         description: "Failed to remove item from cart.",
         variant: "destructive",
       });
-    } finally {
-      setIsLoading(false);
     }
-  }, [fetchCart, toast]);
+  }, [mutateCart, toast]);
 
   // Clear entire cart
   const clearCart = useCallback(async () => {
     try {
-      setIsLoading(true);
-      await cartApi.clearCart();
-      await fetchCart(); // Refresh cart data
-      
+      await mutateCart((current) => withItems(current, []), () => cartApi.clearCart());
+
       toast({
         title: "Cart Cleared",
         description: "All items have been removed from your cart.",
@@ -111,14 +191,14 @@ export const useCart = () => {
         description: "Failed to clear cart.",
         variant: "destructive",
       });
-    } finally {
-      setIsLoading(false);
     }
-  }, [fetchCart, toast]);
+  }, [mutateCart, toast]);
 
-  // Initialize cart on hook mount
+  // Load the cart once; later instances reuse the shared snapshot
   useEffect(() => {
-    fetchCart();
+    if (!sharedCart) {
+      fetchCart();
+    }
   }, [fetchCart]);
 
   return {
@@ -130,4 +210,4 @@ export const useCart = () => {
     clearCart,
     refreshCart: fetchCart
   };
-};
\ No newline at end of file
+};
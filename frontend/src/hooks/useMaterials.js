@@ -1,39 +1,48 @@
-import { useState, useEffect, useCallback } from 'react';
-import { materialsApi, categoriesApi } from '../services/api';
+import { useState, useEffect, useCallback, useRef } from 'react';
+import { materialsApi, categoriesApi, isAbortError } from '../services/api';
 
 export const useMaterials = () => {
   const [materials, setMaterials] = useState([]);
   const [categories, setCategories] = useState([]);
   const [isLoading, setIsLoading] = useState(false);
   const [error, setError] = useState(null);
+  // Controller of the latest materials request; a newer search cancels it
+  const controllerRef = useRef(null);
 
   // Fetch materials with filtering and sorting
   const fetchMaterials = useCallback(async (params = {}) => {
+    controllerRef.current?.abort();
+    const controller = new AbortController();
+    controllerRef.current = controller;
+
     try {
       setIsLoading(true);
       setError(null);
-      
-      const [materialsData, categoriesData] = await Promise.all([
-        materialsApi.getMaterials(params),
-        categories.length === 0 ? categoriesApi.getCategories() : Promise.resolve(categories)
-      ]);
 
+      const materialsData = await materialsApi.getMaterials(params, { signal: controller.signal });
       setMaterials(materialsData);
-      if (categories.length === 0) {
-        setCategories(categoriesData);
-      }
     } catch (err) {
+      if (isAbortError(err)) {
+        return;
+      }
       console.error('Error fetching materials:', err);
       setError(err.message || 'Failed to fetch materials');
     } finally {
-      setIsLoading(false);
+      if (controllerRef.current === controller) {
+        setIsLoading(false);
+      }
     }
-  }, [categories.length]);
+  }, []);
 
-  // Initialize data on hook mount
+  // Categories are cached by the API layer, so this is one request per session
   useEffect(() => {
-    fetchMaterials();
-  }, [fetchMaterials]);
+    categoriesApi.getCategories()
+      .then(setCategories)
+      .catch((err) => console.error('Error fetching categories:', err));
+  }, []);
+
+  // Cancel the outstanding request on unmount
+  useEffect(() => () => controllerRef.current?.abort(), []);
 
   return {
     materials,
@@ -42,4 +51,4 @@ export const useMaterials = () => {
     error,
     fetchMaterials
   };
-};
\ No newline at end of file
+};
@@ -11,9 +11,16 @@ import { ordersApi } from '../services/api';
 const BrowseMaterials = () => {
   const [searchTerm, setSearchTerm] = useState('');
   const [selectedCategory, setSelectedCategory] = useState('all');
-  const [sortBy, setSortBy] = useState('name');
+  const [sortBy, setSortBy] = useState('popular');
   const [filterBy, setFilterBy] = useState('all');
   const [isCartOpen, setIsCartOpen] = useState(false);
+  // Search waits for a pause in typing; superseded requests are cancelled by useMaterials
+  const [debouncedSearch, setDebouncedSearch] = useState('');
+
+  useEffect(() => {
+    const timer = setTimeout(() => setDebouncedSearch(searchTerm.trim()), 300);
+    return () => clearTimeout(timer);
+  }, [searchTerm]);
 
   // Use custom hooks for data management
   const { materials, categories, isLoading: materialsLoading, fetchMaterials } = useMaterials();
@@ -22,13 +29,13 @@ const BrowseMaterials = () => {
   // Fetch materials when filters change
   useEffect(() => {
     const params = {};
-    if (searchTerm) params.search = searchTerm;
+    if (debouncedSearch) params.search = debouncedSearch;
     if (selectedCategory !== 'all') params.category = selectedCategory;
     if (sortBy) params.sort_by = sortBy;
     if (filterBy !== 'all') params.filter_by = filterBy;
     
     fetchMaterials(params);
-  }, [searchTerm, selectedCategory, sortBy, filterBy, fetchMaterials]);
+  }, [debouncedSearch, selectedCategory, sortBy, filterBy, fetchMaterials]);
 
   const handleAddToCart = async (material, quantity, isGroup) => {
     await addToCart(material.id, quantity, isGroup);
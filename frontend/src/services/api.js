@@ -22,15 +22,158 @@ const getSessionId = () => {
   return sessionId;
 };
 
+// Read-your-writes: the backend returns a causal token after cart and order writes,
+// and we send the newest one back so reads routed to a replica include our writes.
+// Tokens start with "<seconds>.<increment>.", which orders them.
+const CAUSAL_TOKEN_HEADER = 'X-Causal-Token';
+const tokenTime = (token) => token.split('.', 2).map(Number);
+const usesCausalToken = (url = '') => url.startsWith('/cart/') || url.startsWith('/orders');
+
+const rememberCausalToken = (token) => {
+  if (!token) {
+    return;
+  }
+  const current = localStorage.getItem('causalToken');
+  if (current) {
+    const [seconds, increment] = tokenTime(token);
+    const [currentSeconds, currentIncrement] = tokenTime(current);
+    if (seconds < currentSeconds || (seconds === currentSeconds && increment <= currentIncrement)) {
+      return;
+    }
+  }
+  localStorage.setItem('causalToken', token);
+};
+
+// Only cart and order requests carry the header, so catalog GETs stay free of CORS preflights
+apiClient.interceptors.request.use((config) => {
+  const token = localStorage.getItem('causalToken');
+  if (token && usesCausalToken(config.url)) {
+    config.headers[CAUSAL_TOKEN_HEADER] = token;
+  }
+  return config;
+});
+
+apiClient.interceptors.response.use((response) => {
+  rememberCausalToken(response.headers[CAUSAL_TOKEN_HEADER.toLowerCase()]);
+  return response;
+});
+
+// Keyed GET cache: fresh entries are served from memory, stale ones are served
+// while a background request refreshes them, and concurrent identical requests
+// share one round trip. Each caller may pass an AbortSignal; the shared request
+// is only cancelled once every caller waiting on it has given up.
+const queryCache = new Map();
+const inFlight = new Map();
+const MAX_CACHE_ENTRIES = 200;
+
+const CATALOG_CACHE = { ttl: 30 * 1000, staleTtl: 5 * 60 * 1000 };
+const REFERENCE_CACHE = { ttl: 10 * 60 * 1000, staleTtl: 60 * 60 * 1000 };
+
+const cacheKey = (url, params = {}) => {
+  const query = Object.keys(params)
+    .filter((key) => params[key] !== undefined && params[key] !== null && params[key] !== '')
+    .sort()
+    .map((key) => `${key}=${params[key]}`)
+    .join('&');
+  return query ? `${url}?${query}` : url;
+};
+
+const abortError = () => {
+  const error = new Error('Request aborted');
+  error.name = 'AbortError';
+  return error;
+};
+
+const fetchShared = (key, url, params) => {
+  let request = inFlight.get(key);
+  if (!request) {
+    const controller = new AbortController();
+    request = { key, controller, waiters: 0 };
+    request.promise = apiClient
+      .get(url, { params, signal: controller.signal })
+      .then((response) => {
+        // Re-inserting keeps Map order oldest first, so the first key is the one to evict
+        queryCache.delete(key);
+        queryCache.set(key, { data: response.data, fetchedAt: Date.now() });
+        if (queryCache.size > MAX_CACHE_ENTRIES) {
+          queryCache.delete(queryCache.keys().next().value);
+        }
+        return response.data;
+      })
+      .finally(() => {
+        if (inFlight.get(key) === request) {
+          inFlight.delete(key);
+        }
+      });
+    inFlight.set(key, request);
+  }
+  return request;
+};
+
+const waitFor = (request, signal) => {
+  if (signal?.aborted) {
+    return Promise.reject(abortError());
+  }
+  // Callers without a signal keep the request alive for good
+  request.waiters += 1;
+  if (!signal) {
+    return request.promise;
+  }
+  return new Promise((resolve, reject) => {
+    const onAbort = () => {
+      request.waiters -= 1;
+      if (request.waiters === 0) {
+        request.controller.abort();
+        // Later callers must not join the cancelled request
+        if (inFlight.get(request.key) === request) {
+          inFlight.delete(request.key);
+        }
+      }
+      reject(abortError());
+    };
+    signal.addEventListener('abort', onAbort, { once: true });
+    request.promise.then(resolve, reject).finally(() => signal.removeEventListener('abort', onAbort));
+  });
+};
+
+export const isAbortError = (error) => error?.name === 'AbortError' || axios.isCancel(error);
+
+const cachedGet = (url, params = {}, { ttl = 0, staleTtl = 0, signal } = {}) => {
+  const key = cacheKey(url, params);
+  const entry = queryCache.get(key);
+  const age = entry ? Date.now() - entry.fetchedAt : Infinity;
+  if (age < ttl) {
+    return Promise.resolve(entry.data);
+  }
+  if (age < staleTtl) {
+    // Stale while revalidate: answer now, refresh for the next caller
+    waitFor(fetchShared(key, url, params)).catch((error) => {
+      console.error(`Error revalidating ${key}:`, error);
+    });
+    return Promise.resolve(entry.data);
+  }
+  return waitFor(fetchShared(key, url, params), signal);
+};
+
+// Drop cached responses whose key starts with `prefix`, or everything
+export const invalidateQueries = (prefix = '') => {
+  for (const key of queryCache.keys()) {
+    if (key.startsWith(prefix)) {
+      queryCache.delete(key);
+    }
+  }
+};
+
 // Materials API
 export const materialsApi = {
-  // Get all materials with optional filtering and sorting
-  getMaterials: async (params = {}) => {
+  // Get all materials with optional filtering and sorting; pass a signal to cancel superseded searches
+  getMaterials: async (params = {}, { signal } = {}) => {
     try {
-      const response = await apiClient.get('/materials', { params });
-      return response.data;
+      return await cachedGet('/materials', params, { ...CATALOG_CACHE, signal });
     } catch (error) {
-      console.error('Error fetching materials:', error);
+      if (!isAbortError(error)) {
+        console.error('Error fetching materials:', error);
+      }
       throw error;
     }
   },
@@ -38,12 +181,24 @@ export const materialsApi = {
   // Get material by ID
   getMaterialById: async (id) => {
     try {
-      const response = await apiClient.get(`/materials?id=${id}`);
-      return response.data[0];
+      return await cachedGet(`/materials/${id}`, {}, CATALOG_CACHE);
     } catch (error) {
       console.error('Error fetching material:', error);
       throw error;
     }
+  },
+
+  // Get several materials by ID in a single request
+  getMaterialsByIds: async (ids = []) => {
+    try {
+      if (ids.length === 0) {
+        return [];
+      }
+      return await cachedGet('/materials', { ids: ids.join(',') }, CATALOG_CACHE);
+    } catch (error) {
+      console.error('Error fetching materials:', error);
+      throw error;
+    }
   }
 };
 
@@ -51,8 +206,7 @@ export const materialsApi = {
 export const categoriesApi = {
   getCategories: async () => {
     try {
-      const response = await apiClient.get('/categories');
-      return response.data;
+      return await cachedGet('/categories', {}, REFERENCE_CACHE);
     } catch (error) {
       console.error('Error fetching categories:', error);
       throw error;
@@ -64,8 +218,7 @@ export const categoriesApi = {
 export const suppliersApi = {
   getSuppliers: async () => {
     try {
-      const response = await apiClient.get('/suppliers');
-      return response.data;
+      return await cachedGet('/suppliers', {}, REFERENCE_CACHE);
     } catch (error) {
       console.error('Error fetching suppliers:', error);
       throw error;
@@ -73,14 +226,42 @@ export const suppliersApi = {
   }
 };
 
+// Sync API
+export const syncApi = {
+  // Catalog changes since `version` (0 for a full snapshot); response.mode tells which was sent
+  sync: async (version = 0) => {
+    try {
+      const response = await apiClient.get('/sync', { params: { since: version } });
+      return response.data;
+    } catch (error) {
+      console.error('Error syncing catalog:', error);
+      throw error;
+    }
+  }
+};
+
+// Search API
+export const searchApi = {
+  // Name completions for the search box, grouped into materials, categories and suppliers
+  suggest: async (query, limit = 5) => {
+    try {
+      const response = await apiClient.get('/search/suggest', { params: { q: query, limit } });
+      return response.data;
+    } catch (error) {
+      console.error('Error fetching search suggestions:', error);
+      throw error;
+    }
+  }
+};
+
 // Cart API
 export const cartApi = {
   // Get cart for current session
   getCart: async () => {
     try {
       const sessionId = getSessionId();
-      const response = await apiClient.get(`/cart/${sessionId}`);
-      return response.data;
+      // Never cached, but concurrent reads (navbar badge, cart drawer) share one request
+      return await cachedGet(`/cart/${sessionId}`);
     } catch (error) {
       console.error('Error fetching cart:', error);
       throw error;
@@ -96,6 +277,7 @@ export const cartApi = {
         quantity: quantity,
         is_group: isGroup
       });
+      // { message, cart } with the cart after the change
       return response.data;
     } catch (error) {
       console.error('Error adding to cart:', error);
@@ -151,6 +333,8 @@ export const ordersApi = {
       const response = await apiClient.post('/orders', {
         session_id: sessionId
       });
+      // Stock and popularity ordering changed with the order
+      invalidateQueries('/materials');
       return response.data;
     } catch (error) {
       console.error('Error creating order:', error);
@@ -168,6 +352,20 @@ export const ordersApi = {
       console.error('Error fetching orders:', error);
       throw error;
     }
+  },
+
+  // Add every still-available item of a previous order to the current cart
+  reorder: async (orderId) => {
+    try {
+      const sessionId = getSessionId();
+      const response = await apiClient.post(`/orders/${orderId}/reorder`, {
+        session_id: sessionId
+      });
+      return response.data;
+    } catch (error) {
+      console.error('Error reordering:', error);
+      throw error;
+    }
   }
 };
 
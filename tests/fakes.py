@@ -0,0 +1,146 @@
+import copy
+from typing import Dict, List, Optional
+
+from pymongo import DeleteOne, ReplaceOne, UpdateOne
+
+OPERATORS = {
+    "$in": lambda value, arg: value in arg,
+    "$gt": lambda value, arg: value is not None and value > arg,
+    "$gte": lambda value, arg: value is not None and value >= arg,
+    "$lt": lambda value, arg: value is not None and value < arg,
+    "$lte": lambda value, arg: value is not None and value <= arg,
+}
+
+
+def matches(document: Dict, query: Dict) -> bool:
+    for field, condition in query.items():
+        value = document.get(field)
+        if isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition):
+            for operator, arg in condition.items():
+                if operator == "$exists":
+                    if (field in document) != arg:
+                        return False
+                elif not OPERATORS[operator](value, arg):
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+
+def project(document: Dict, projection: Optional[Dict]) -> Dict:
+    if not projection:
+        return copy.deepcopy(document)
+    if not any(flag for field, flag in projection.items() if field != "_id"):
+        # Exclusion projection: everything but the fields set to 0
+        return {field: copy.deepcopy(value) for field, value in document.items() if projection.get(field, 1)}
+    included = [field for field, flag in projection.items() if flag and field != "_id"]
+    # Like Mongo, _id comes along unless the projection excludes it
+    if projection.get("_id", 1):
+        included.insert(0, "_id")
+    return {field: copy.deepcopy(document[field]) for field in included if field in document}
+
+
+class FakeCursor:
+    def __init__(self, documents: List[Dict], projection: Optional[Dict] = None):
+        self.documents = documents
+        self.projection = projection
+
+    def sort(self, field: str, direction: int = 1) -> "FakeCursor":
+        # Like Mongo, sorting may use fields the projection leaves out
+        self.documents.sort(key=lambda document: document[field], reverse=direction < 0)
+        return self
+
+    def batch_size(self, size: int) -> "FakeCursor":
+        return self
+
+    async def __aiter__(self):
+        for document in self.documents:
+            yield project(document, self.projection)
+
+    async def to_list(self, length=None):
+        documents = [project(document, self.projection) for document in self.documents]
+        return documents if length is None else documents[:length]
+
+
+class FakeCollection:
+    """
+    The handful of Motor collection methods the unit tests touch, over a list of
+    dicts. Records every bulk_write so tests can count round trips.
+    """
+
+    def __init__(self, documents: Optional[List[Dict]] = None):
+        self.documents = [copy.deepcopy(document) for document in documents or []]
+        self.bulk_writes: List[List] = []
+
+    async def find_one(self, query: Dict, projection: Optional[Dict] = None, session=None) -> Optional[Dict]:
+        document = next((document for document in self.documents if matches(document, query)), None)
+        return None if document is None else project(document, projection)
+
+    def find(self, query: Dict, projection: Optional[Dict] = None, session=None) -> FakeCursor:
+        return FakeCursor([document for document in self.documents if matches(document, query)], projection)
+
+    async def insert_one(self, document: Dict, session=None) -> None:
+        self.documents.append(copy.deepcopy(document))
+
+    async def insert_many(self, documents: List[Dict], session=None) -> None:
+        self.documents.extend(copy.deepcopy(document) for document in documents)
+
+    async def find_one_and_update(self, query: Dict, update: Dict, projection: Optional[Dict] = None,
+                                  session=None) -> Optional[Dict]:
+        """Returns the matched document as it was before the update, like Motor's default"""
+        document = next((document for document in self.documents if matches(document, query)), None)
+        if document is None:
+            return None
+        before = project(document, projection)
+        await self.update_many({"_id": document["_id"]}, update)
+        return before
+
+    async def update_one(self, query: Dict, update: Dict, upsert: bool = False, session=None) -> None:
+        document = next((document for document in self.documents if matches(document, query)), None)
+        if document is not None:
+            await self.update_many({"_id": document["_id"]}, update)
+        elif upsert:
+            await self.update_many(query, update, upsert=True)
+
+    async def delete_many(self, query: Dict, session=None) -> None:
+        self.documents = [document for document in self.documents if not matches(document, query)]
+
+    async def count_documents(self, query: Dict, session=None) -> int:
+        return sum(1 for document in self.documents if matches(document, query))
+
+    async def distinct(self, field: str, query: Optional[Dict] = None, session=None) -> List:
+        values = []
+        for document in self.documents:
+            if matches(document, query or {}) and field in document and document[field] not in values:
+                values.append(document[field])
+        return values
+
+    async def update_many(self, query: Dict, update: Dict, upsert: bool = False, session=None) -> None:
+        targets = [document for document in self.documents if matches(document, query)]
+        if not targets and upsert:
+            targets = [{field: value for field, value in query.items() if not isinstance(value, dict)}]
+            self.documents.append(targets[0])
+        for document in targets:
+            document.update(copy.deepcopy(update.get("$set", {})))
+            for field in update.get("$unset", {}):
+                document.pop(field, None)
+            for field, amount in update.get("$inc", {}).items():
+                document[field] = document.get(field, 0) + amount
+            for field, value in update.get("$push", {}).items():
+                document.setdefault(field, []).append(copy.deepcopy(value))
+            for field, value in update.get("$min", {}).items():
+                document[field] = value if field not in document else min(document[field], value)
+            for field, value in update.get("$max", {}).items():
+                document[field] = value if field not in document else max(document[field], value)
+
+    async def bulk_write(self, operations: List, ordered: bool = True) -> None:
+        self.bulk_writes.append(operations)
+        for operation in operations:
+            query = operation._filter
+            if isinstance(operation, ReplaceOne):
+                self.documents = [document for document in self.documents if not matches(document, query)]
+                self.documents.append(copy.deepcopy(operation._doc))
+            elif isinstance(operation, DeleteOne):
+                self.documents = [document for document in self.documents if not matches(document, query)]
+            elif isinstance(operation, UpdateOne):
+                await self.update_many(query, operation._doc, upsert=bool(operation._upsert))
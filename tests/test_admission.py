@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+
+from admission import (
+    AdmissionControlMiddleware, AdmissionController, InMemoryRateLimitBackend, PriorityClass, RateLimitBackend,
+    client_key, default_priority_classes, parse_networks
+)
+
+
+def priority_class(name, priority, max_concurrency=10, share=1.0, latency_budget=1.0):
+    return PriorityClass(
+        name, priority=priority, max_concurrency=max_concurrency, share=share,
+        latency_budget=latency_budget, max_queue=10, rate=100.0, burst=100
+    )
+
+
+def scope(client="203.0.113.7", headers=(), method="GET", path="/api/materials"):
+    return {"type": "http", "method": method, "path": path, "client": (client, 1234), "headers": list(headers)}
+
+
+def test_default_classes_cap_each_class_below_capacity():
+    classes = default_priority_classes(200)
+    assert all(cls.max_concurrency < 200 for cls in classes.values())
+    # Together the caps cover the capacity, so no class can starve the others
+    assert sum(cls.max_concurrency for cls in classes.values()) >= 200
+
+
+def test_freed_slot_goes_to_highest_priority_waiter():
+    browse, cart, checkout = priority_class("browse", 1), priority_class("cart", 2), priority_class("checkout", 3)
+    controller = AdmissionController(1, {"browse": browse, "cart": cart, "checkout": checkout})
+    order = []
+
+    async def request(cls, delay):
+        await asyncio.sleep(delay)
+        if await controller.acquire(cls):
+            order.append(cls.name)
+            await asyncio.sleep(0.01)
+            controller.release(cls)
+
+    async def scenario():
+        assert await controller.acquire(browse)
+        # Queue in the worst order: lowest priority first
+        waiting = asyncio.gather(request(browse, 0), request(cart, 0.001), request(checkout, 0.002))
+        await asyncio.sleep(0.01)
+        controller.release(browse)
+        await waiting
+
+    asyncio.run(scenario())
+    assert order == ["checkout", "cart", "browse"]
+
+
+def test_class_cap_leaves_room_for_other_classes():
+    browse = priority_class("browse", 1, max_concurrency=1)
+    cart = priority_class("cart", 2)
+    controller = AdmissionController(3, {"browse": browse, "cart": cart})
+
+    async def scenario():
+        assert await controller.acquire(browse)
+        browse.latency_budget = 0.01
+        shed = not await controller.acquire(browse)
+        return shed, await controller.acquire(cart)
+
+    assert asyncio.run(scenario()) == (True, True)
+    assert browse.shed == 1 and controller.stats()["queued"] == 0
+
+
+def test_rate_limit_key_ignores_client_chosen_values():
+    spoofed = [(b"x-forwarded-for", b"198.51.100.1"), (b"x-session-id", b"fresh")]
+    assert client_key(scope(headers=spoofed, path="/api/cart/any")) == "ip:203.0.113.7"
+
+
+def test_forwarded_for_is_trusted_only_from_proxies():
+    proxies = parse_networks("10.0.0.0/8")
+    headers = [(b"x-forwarded-for", b"198.51.100.1, 192.0.2.9, 10.1.1.1")]
+    # The first untrusted hop from the right; anything left of it could be forged
+    assert client_key(scope(client="10.0.0.5", headers=headers), proxies) == "ip:192.0.2.9"
+    assert client_key(scope(headers=headers), proxies) == "ip:203.0.113.7"
+
+
+def test_rate_limit_backend_is_abstract():
+    with pytest.raises(TypeError):
+        RateLimitBackend()
+
+
+def test_burst_is_answered_with_429_and_retry_after():
+    checkout = priority_class("checkout", 3)
+    checkout.rate, checkout.burst = 1.0, 2
+    controller = AdmissionController(10, {"checkout": checkout, "cart": priority_class("cart", 2),
+                                          "browse": priority_class("browse", 1)})
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    middleware = AdmissionControlMiddleware(app, controller=controller, rate_limiter=InMemoryRateLimitBackend())
+
+    async def call():
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        await middleware(scope(method="POST", path="/api/orders"), None, send)
+        return sent[0]
+
+    async def burst():
+        return [await call() for _ in range(3)]
+
+    responses = asyncio.run(burst())
+    assert [response["status"] for response in responses] == [200, 200, 429]
+    assert dict(responses[2]["headers"])[b"retry-after"] == b"1"
+    assert checkout.rate_limited == 1
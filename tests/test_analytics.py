@@ -0,0 +1,87 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+import analytics
+from tests.fakes import FakeCollection
+
+CREATED = datetime(2026, 3, 2, 12, 0)
+
+
+def order(order_id, quantity=2):
+    return {"_id": order_id, "items": [{"material_id": 1, "quantity": quantity, "price": 40.0}], "created_at": CREATED}
+
+
+@pytest.fixture
+def collections(monkeypatch):
+    orders = FakeCollection([order(1), order(2, quantity=3)])
+    materials = FakeCollection([{"_id": "m1", "id": 1, "supplier_id": 7, "category": "vegetables"}])
+    rollups = FakeCollection()
+    monkeypatch.setattr(analytics, "orders_collection", orders)
+    monkeypatch.setattr(analytics, "materials_collection", materials)
+    monkeypatch.setattr(analytics, "sales_rollups_collection", rollups)
+    return orders, materials, rollups
+
+
+def material_rollup(rollups):
+    return next(document for document in rollups.documents if document["dimension"] == "material")
+
+
+def test_backfill_and_live_update_count_an_order_once(collections):
+    orders, materials, rollups = collections
+
+    async def scenario():
+        result = await analytics.backfill_rollups()
+        # The live updater for order 1 runs after the backfill already claimed it
+        await analytics.record_order_sales(order(1))
+        return result
+
+    assert asyncio.run(scenario())["orders_processed"] == 2
+    assert material_rollup(rollups)["orders"] == 2 and material_rollup(rollups)["quantity"] == 5
+    assert materials.documents[0]["order_count"] == 2
+    assert all(document["rollup_applied"] is True and "rollup_claim" not in document for document in orders.documents)
+
+
+def test_backfill_skips_orders_claimed_by_the_live_updater(collections, monkeypatch):
+    _, _, rollups = collections
+
+    async def failing_popularity(batch):
+        raise ConnectionError("primary stepped down")
+
+    async def scenario():
+        with monkeypatch.context() as patch:
+            patch.setattr(analytics, "apply_popularity", failing_popularity)
+            with pytest.raises(ConnectionError):
+                await analytics.record_order_sales(order(1))
+        return await analytics.backfill_rollups()
+
+    result = asyncio.run(scenario())
+    # Order 1's rollup increments were applied before the failure; it must not be counted again
+    assert result == {"orders_processed": 1, "rollups_upserted": 3, "orders_claimed": 1}
+    assert material_rollup(rollups)["orders"] == 2
+
+
+def test_failure_before_any_write_leaves_the_order_to_backfill(collections, monkeypatch):
+    _, _, rollups = collections
+
+    async def failing_dimensions(material_ids):
+        raise ConnectionError("primary stepped down")
+
+    async def scenario():
+        with monkeypatch.context() as patch:
+            patch.setattr(analytics, "material_dimensions", failing_dimensions)
+            with pytest.raises(ConnectionError):
+                await analytics.record_order_sales(order(1))
+        return await analytics.backfill_rollups()
+
+    assert asyncio.run(scenario())["orders_processed"] == 2
+    assert material_rollup(rollups)["orders"] == 2
+
+
+def test_rebuild_recounts_orders_left_claimed(collections):
+    orders, _, rollups = collections
+    orders.documents[0]["rollup_applied"] = analytics.CLAIMED
+    result = asyncio.run(analytics.backfill_rollups(rebuild=True))
+    assert result["orders_processed"] == 2 and result["orders_claimed"] == 0
+    assert material_rollup(rollups)["orders"] == 2
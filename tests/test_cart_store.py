@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+
+from cart_store import CartStore, WriteBehindCartStore
+from tests.fakes import FakeCollection
+
+
+def cart(session_id, *quantities):
+    return {"session_id": session_id, "items": [{"material_id": 1, "quantity": quantity} for quantity in quantities]}
+
+
+async def add(store, session_id, quantity):
+    async with store.edit(session_id) as edit:
+        current = edit.cart or cart(session_id)
+        edit.save(cart(session_id, *[item["quantity"] for item in current["items"]], quantity))
+
+
+def stored(collection, session_id):
+    return next((document for document in collection.documents if document["session_id"] == session_id), None)
+
+
+def test_repeated_edits_coalesce_into_one_write():
+    collection = FakeCollection()
+    store = WriteBehindCartStore(collection)
+
+    async def scenario():
+        for quantity in range(1, 11):
+            await add(store, "a", quantity)
+        await add(store, "b", 5)
+        return await store.flush()
+
+    assert asyncio.run(scenario()) == 2
+    # Ten edits of one cart and one of another: a single bulk write, one operation per cart
+    assert len(collection.bulk_writes) == 1 and len(collection.bulk_writes[0]) == 2
+    assert stored(collection, "a") == cart("a", *range(1, 11))
+    assert store.stats() == {"backend": "memory", "carts": 2, "dirty": 0, "edits": 11, "writes": 2}
+
+
+def test_nothing_is_written_before_a_flush():
+    collection = FakeCollection([cart("a", 1)])
+    store = WriteBehindCartStore(collection)
+
+    async def scenario():
+        await add(store, "a", 2)
+        return await store.get("a"), await store.flush(), await store.flush()
+
+    latest, written, again = asyncio.run(scenario())
+    assert latest == cart("a", 1, 2)
+    assert (written, again) == (1, 0)
+    assert stored(collection, "a") == cart("a", 1, 2)
+
+
+def test_checkout_reads_unflushed_edits_and_flushes_only_its_cart():
+    collection = FakeCollection()
+    store = WriteBehindCartStore(collection)
+
+    async def checkout(session_id):
+        # As POST /orders does: read and clear the cart under its lock, then flush it
+        async with store.edit(session_id) as edit:
+            items = edit.cart["items"]
+            edit.delete()
+        await store.flush([session_id])
+        return items
+
+    async def scenario():
+        await add(store, "a", 3)
+        await add(store, "b", 4)
+        return await checkout("a")
+
+    assert asyncio.run(scenario()) == [{"material_id": 1, "quantity": 3}]
+    assert [type(operation).__name__ for operation in collection.bulk_writes[0]] == ["DeleteOne"]
+    assert stored(collection, "b") is None and store.dirty == {"b"}
+
+
+def test_close_flushes_pending_carts_and_stops_the_task():
+    collection = FakeCollection()
+    store = WriteBehindCartStore(collection, flush_interval=3600)
+
+    async def scenario():
+        store.start()
+        task = store._task
+        await add(store, "a", 1)
+        await add(store, "a", 2)
+        await store.close()
+        return task
+
+    task = asyncio.run(scenario())
+    assert task.cancelled() and store._task is None
+    assert stored(collection, "a") == cart("a", 1, 2)
+    assert len(collection.bulk_writes) == 1
+
+
+def test_failed_flush_keeps_carts_dirty():
+    collection = FakeCollection()
+    store = WriteBehindCartStore(collection)
+
+    async def failing(operations, ordered=True):
+        raise ConnectionError("primary stepped down")
+
+    async def scenario():
+        await add(store, "a", 1)
+        collection.bulk_write = failing
+        try:
+            await store.flush()
+        except ConnectionError:
+            pass
+        del collection.bulk_write
+        return await store.flush()
+
+    assert asyncio.run(scenario()) == 1
+    assert stored(collection, "a") == cart("a", 1)
+
+
+def test_cart_store_contract_is_abstract():
+    with pytest.raises(TypeError):
+        CartStore()
+
+    class Incomplete(CartStore):
+        async def get(self, session_id, projection=None):
+            return None
+
+    with pytest.raises(TypeError):
+        Incomplete()
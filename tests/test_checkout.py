@@ -0,0 +1,116 @@
+from contextlib import asynccontextmanager
+
+import pytest
+from fastapi.testclient import TestClient
+
+from cart_store import WriteBehindCartStore
+from tests.fakes import FakeCollection
+
+CART = {
+    "session_id": "s1",
+    "items": [{
+        "material_id": 1, "material_name": "Onions", "quantity": 2, "price": 40.0, "unit": "kg",
+        "is_group": False, "supplier_name": "Fresh Farms"
+    }]
+}
+
+
+class FakeOutbox:
+    def __init__(self, transactional=False, fail_enqueue=False):
+        self.transactional = transactional
+        self.fail_enqueue = fail_enqueue
+        self.events = []
+
+    async def transactions_supported(self):
+        return self.transactional
+
+    @asynccontextmanager
+    async def transaction(self, session=None):
+        yield session
+
+    async def enqueue(self, event_type, payload, session=None):
+        if self.fail_enqueue:
+            raise ConnectionError("outbox unavailable")
+        self.events.append(event_type)
+
+    def notify(self):
+        pass
+
+
+@pytest.fixture
+def checkout(monkeypatch):
+    import server
+    orders, carts, released = FakeCollection(), FakeCollection([CART]), []
+
+    async def reserve_stock(items):
+        pass
+
+    async def release_stock(quantities):
+        released.append(quantities)
+
+    monkeypatch.setattr(server, "orders_collection", orders)
+    monkeypatch.setattr(server, "cart_store", WriteBehindCartStore(carts))
+    monkeypatch.setattr(server, "reserve_stock", reserve_stock)
+    monkeypatch.setattr(server, "release_stock", release_stock)
+    monkeypatch.setattr(server, "schedule_order_rollup", lambda order: None)
+
+    def place(outbox):
+        monkeypatch.setattr(server, "outbox", outbox)
+        # Startup is not run, so no database is needed
+        return TestClient(server.app).post("/api/orders", json={"session_id": "s1"})
+
+    return place, orders, carts, released
+
+
+def test_checkout_places_order_and_clears_cart(checkout):
+    place, orders, carts, released = checkout
+    outbox = FakeOutbox()
+    response = place(outbox)
+    assert response.status_code == 200
+    assert response.json()["order_id"] == str(orders.documents[0]["_id"])
+    assert outbox.events == ["order.created"] and released == []
+    assert carts.documents == []
+
+
+def test_failed_enqueue_without_transactions_keeps_the_committed_order(checkout):
+    place, orders, _, released = checkout
+    response = place(FakeOutbox(fail_enqueue=True))
+    # The order is already written, so its stock stays reserved and checkout succeeds
+    assert response.status_code == 200
+    assert len(orders.documents) == 1 and released == []
+
+
+def test_failed_transaction_releases_stock_of_the_unwritten_order(checkout, monkeypatch):
+    place, orders, _, released = checkout
+
+    async def insert_one(document, session=None):
+        raise ConnectionError("primary stepped down")
+
+    monkeypatch.setattr(orders, "insert_one", insert_one)
+    response = place(FakeOutbox(transactional=True))
+    assert response.status_code == 500
+    assert released == [{1: 2}]
+
+
+def test_unknown_commit_result_does_not_release_a_persisted_order(checkout):
+    place, orders, _, released = checkout
+    # The transaction aborts on enqueue, but this fake outbox cannot roll back the insert:
+    # from the handler's view the commit outcome is unknown and the order exists
+    response = place(FakeOutbox(transactional=True, fail_enqueue=True))
+    assert response.status_code == 200
+    assert len(orders.documents) == 1 and released == []
+
+
+def test_failed_cart_flush_does_not_fail_a_placed_order(checkout, monkeypatch):
+    import server
+    place, orders, carts, _ = checkout
+
+    async def failing_bulk_write(operations, ordered=True):
+        raise ConnectionError("primary stepped down")
+
+    monkeypatch.setattr(carts, "bulk_write", failing_bulk_write)
+    response = place(FakeOutbox())
+    assert response.status_code == 200 and len(orders.documents) == 1
+    # The cleared cart is still pending, so the background loop writes it later
+    assert server.cart_store.dirty == {"s1"}
+    assert TestClient(server.app).get("/api/cart/s1").json()["items"] == []
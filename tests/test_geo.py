@@ -0,0 +1,40 @@
+import time
+
+from geo import CITY_COORDINATES, SupplierGrid, haversine_km
+
+
+def grid(points):
+    supplier_grid = SupplierGrid()
+    for supplier_id, (lat, lng) in enumerate(points, start=1):
+        supplier_grid.cells[supplier_grid._cell(lat, lng)].append((supplier_id, lat, lng))
+    supplier_grid.size, supplier_grid.loaded = len(points), True
+    return supplier_grid
+
+
+CITIES = grid(list(CITY_COORDINATES.values()))
+
+
+def test_nearby_orders_suppliers_by_distance_within_radius():
+    found = CITIES.nearby(28.6, 77.2, radius_km=1500)
+    assert found[0][0] == 2 and found[0][1] < 5
+    assert all(distance <= 1500 for _, distance in found)
+    assert [distance for _, distance in found] == sorted(distance for _, distance in found)
+    assert len(found) < CITIES.size
+
+
+def test_far_away_origin_is_answered_without_scanning_empty_cells():
+    started = time.perf_counter()
+    everything = CITIES.nearby(-60, -120)
+    within = CITIES.nearby(-60, -120, radius_km=20000)
+    # Scanning every empty cell out to India took tens of seconds
+    assert time.perf_counter() - started < 0.5
+    assert len(everything) == len(within) == CITIES.size
+    assert CITIES.nearby(-60, -120, radius_km=100) == []
+
+
+def test_radius_reaches_across_the_antimeridian():
+    pacific = grid([(0.0, 179.9), (0.0, -179.9)])
+    found = pacific.nearby(0.0, -179.95, radius_km=20)
+    assert sorted(supplier_id for supplier_id, _ in found) == [1, 2]
+    assert all(abs(distance - haversine_km(0.0, -179.95, 0.0, 179.9 if supplier_id == 1 else -179.9)) < 1e-9
+               for supplier_id, distance in found)
@@ -0,0 +1,74 @@
+import asyncio
+
+import inventory
+from inventory import LowStockWatcher
+from tests.fakes import FakeCollection
+
+
+def make_watcher(monkeypatch, available_qty: int):
+    materials = FakeCollection([
+        {"id": 1, "name": "Fresh Tomatoes", "supplier_id": 1, "available_qty": available_qty, "inStock": True}
+    ])
+    alerts = FakeCollection()
+    monkeypatch.setattr(inventory, "materials_collection", materials)
+    monkeypatch.setattr(inventory, "supplier_alerts_collection", alerts)
+    return LowStockWatcher(threshold=10), materials, alerts
+
+
+def checkout(materials: FakeCollection, quantity: int) -> dict:
+    """What reserve_stock hands the watcher: the material after its $inc"""
+    material = materials.documents[0]
+    material["available_qty"] -= quantity
+    return {key: material[key] for key in ("id", "name", "supplier_id", "available_qty")}
+
+
+def test_low_stock_alerts_once_per_material(monkeypatch):
+    watcher, materials, alerts = make_watcher(monkeypatch, 12)
+
+    watcher.observe([checkout(materials, 4)])
+    asyncio.run(watcher.flush())
+    watcher.observe([checkout(materials, 1)])
+    asyncio.run(watcher.flush())
+
+    assert len(alerts.documents) == 1
+    assert alerts.documents[0]["materials"][0]["available_qty"] == 8
+    assert materials.documents[0]["inStock"] is True
+
+
+def test_alerted_material_is_marked_out_of_stock_when_it_sells_out(monkeypatch):
+    watcher, materials, alerts = make_watcher(monkeypatch, 12)
+    changed = []
+
+    async def on_change(material_ids):
+        changed.extend(material_ids)
+
+    watcher.on_change = on_change
+
+    watcher.observe([checkout(materials, 4)])
+    asyncio.run(watcher.flush())
+    watcher.observe([checkout(materials, 8)])
+    result = asyncio.run(watcher.flush())
+
+    # The second pass sends no new alert but still flips inStock
+    assert len(alerts.documents) == 1
+    assert result == {"alerts": 0, "stock_changed": 1}
+    assert materials.documents[0]["inStock"] is False
+    assert changed == [1]
+
+
+def test_restock_clears_alert_and_stock_flag(monkeypatch):
+    watcher, materials, alerts = make_watcher(monkeypatch, 5)
+
+    watcher.observe([checkout(materials, 5)])
+    asyncio.run(watcher.flush())
+    assert materials.documents[0]["inStock"] is False
+
+    materials.documents[0]["available_qty"] = 3
+    watcher.restocked([1])
+    asyncio.run(watcher.flush())
+    assert materials.documents[0]["inStock"] is True
+
+    # Running low again after a restock alerts again
+    watcher.observe([checkout(materials, 1)])
+    asyncio.run(watcher.flush())
+    assert len(alerts.documents) == 2
@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+
+import price_history
+import pricelist
+from tests.fakes import FakeCollection
+
+
+async def entries(*rows):
+    for line, row in enumerate(rows, start=1):
+        yield line, row
+
+
+@pytest.fixture
+def collections(monkeypatch):
+    materials = FakeCollection([
+        {"id": 1, "supplier_id": 7, "price": 40.0, "groupPrice": 36.0, "inStock": True, "available_qty": 10},
+        {"id": 2, "supplier_id": 7, "price": 20.0, "groupPrice": 18.0, "inStock": True, "available_qty": 10},
+    ])
+    history = FakeCollection()
+    monkeypatch.setattr(pricelist, "materials_collection", materials)
+    monkeypatch.setattr(price_history, "price_history_collection", history)
+    price_history.latest_points_cache.clear()
+    return materials, history
+
+
+def latest(material_id):
+    return [(point["price"], point["groupPrice"]) for point in asyncio.run(price_history.get_latest_points(material_id))]
+
+
+def test_first_change_records_the_old_price_as_baseline(collections):
+    asyncio.run(pricelist.apply_pricelist(7, entries({"material_id": 1, "price": 45.0})))
+    # Newest first: the new price, then the price it replaced
+    assert latest(1) == [(45.0, 36.0), (40.0, 36.0)]
+    points = [point["t"] for point in reversed(asyncio.run(price_history.get_latest_points(1)))]
+    assert points[0] < points[1]
+
+
+def test_later_changes_record_only_the_new_price(collections):
+    asyncio.run(pricelist.apply_pricelist(7, entries({"material_id": 1, "price": 45.0})))
+    asyncio.run(pricelist.apply_pricelist(7, entries({"material_id": 1, "groupPrice": 41.0})))
+    assert latest(1) == [(45.0, 41.0), (45.0, 36.0), (40.0, 36.0)]
+
+
+def test_stock_only_changes_record_no_prices(collections):
+    _, history = collections
+    asyncio.run(pricelist.apply_pricelist(7, entries({"material_id": 2, "available_qty": 0})))
+    assert history.documents == [] and latest(2) == []
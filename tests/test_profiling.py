@@ -0,0 +1,159 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+from pymongo.errors import CollectionInvalid
+
+import profiling
+from profiling import MongoProfileStore, ProfileStore, ProfilingMiddleware, token_matches
+from tests.fakes import FakeCollection
+
+
+async def busy_handler(scope, receive, send):
+    # Something for the sampler to see, awaited like a Motor call would be
+    await asyncio.sleep(0.02)
+    await send({"type": "http.response.start", "status": 201, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+
+def call(middleware, path="/api/materials", headers=()):
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": path, "query_string": b"q=1", "headers": list(headers)}
+    asyncio.run(middleware(scope, None, send))
+    return dict(sent[0]["headers"])
+
+
+def test_ring_buffer_keeps_latest_profiles():
+    store = ProfileStore(capacity=2)
+
+    async def fill():
+        for _ in range(3):
+            await store.save({"id": store.new_id(), "folded": []})
+        return await store.get("1"), await store.summaries()
+
+    oldest, summaries = asyncio.run(fill())
+    assert oldest is None
+    assert [record["id"] for record in summaries] == ["3", "2"]
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.created = {}
+
+    async def create_collection(self, name, **options):
+        if name in self.created:
+            raise CollectionInvalid(f"collection {name} already exists")
+        self.created[name] = options
+
+
+def profiles_collection():
+    collection = FakeCollection()
+    collection.name, collection.database = "request_profiles", FakeDatabase()
+    return collection
+
+
+def test_profiles_are_kept_in_a_capped_collection():
+    collection = profiles_collection()
+    store = MongoProfileStore(collection, capacity=20)
+
+    async def scenario():
+        with pytest.raises(RuntimeError):
+            await store.save({"id": store.new_id(), "folded": []})
+        # Every worker runs the setup; only the first one creates the collection
+        await store.ensure_collection()
+        await MongoProfileStore(collection, capacity=20).ensure_collection()
+
+    asyncio.run(scenario())
+    assert collection.database.created["request_profiles"]["capped"] is True
+    assert collection.database.created["request_profiles"]["max"] == 20
+    assert collection.documents == []
+
+
+def test_profiles_from_one_worker_are_served_by_another():
+    # Two workers, each with its own store object over the same collection
+    collection = profiles_collection()
+    worker, other = MongoProfileStore(collection), MongoProfileStore(collection)
+    ids = [worker.new_id(), other.new_id()]
+    assert len(set(ids)) == 2
+
+    async def scenario():
+        await worker.ensure_collection()
+        await worker.save({"id": ids[0], "path": "/api/materials", "folded": ["main 10"]})
+        return await other.get(ids[0]), await other.get("3"), await worker.get(ids[1])
+
+    record, unknown, unsaved = asyncio.run(scenario())
+    assert record == {"id": ids[0], "path": "/api/materials", "folded": ["main 10"]}
+    assert unknown is None and unsaved is None
+
+
+def test_token_is_required_and_compared():
+    assert not token_matches("secret", None)
+    assert not token_matches(None, "secret")
+    assert not token_matches("guess", "secret")
+    assert token_matches("secret", "secret")
+
+
+def test_requests_are_profiled_only_with_the_token():
+    store = ProfileStore()
+    middleware = ProfilingMiddleware(busy_handler, store=store, token="secret")
+
+    assert b"x-profile-id" not in call(middleware, headers=[(b"x-profile", b"wrong")])
+    assert asyncio.run(store.summaries()) == []
+
+    headers = call(middleware, headers=[(b"x-profile", b"secret")])
+    record = asyncio.run(store.get(headers[b"x-profile-id"].decode()))
+    assert record["status"] == 201 and record["query"] == "q=1"
+    assert record["duration_ms"] >= 20
+    assert record["folded"] and all(line.rsplit(" ", 1)[1].isdigit() for line in record["folded"])
+
+
+def test_profile_endpoints_are_never_profiled():
+    store = ProfileStore()
+    middleware = ProfilingMiddleware(busy_handler, store=store, token="secret", sample_rate=1.0)
+    call(middleware, path="/api/admin/profiles", headers=[(b"x-profile", b"secret")])
+    assert asyncio.run(store.summaries()) == []
+
+
+def test_profiling_is_a_no_op_without_pyinstrument(monkeypatch):
+    monkeypatch.setattr(profiling, "_pyinstrument", False)
+    store = ProfileStore()
+    middleware = ProfilingMiddleware(busy_handler, store=store, sample_rate=1.0)
+    assert b"x-profile-id" not in call(middleware)
+    assert asyncio.run(store.summaries()) == []
+
+
+@pytest.fixture
+def api(monkeypatch):
+    import server
+    store = ProfileStore()
+    monkeypatch.setattr(server, "profiling_token", "secret")
+    monkeypatch.setattr(server, "profile_store", store)
+    # Startup is not run, so no database is needed
+    return TestClient(server.app), store
+
+
+def test_admin_endpoints_require_the_token(api):
+    client, _ = api
+    assert client.get("/api/admin/profiles").status_code == 403
+    assert client.get("/api/admin/profiles", headers={"X-Profile": "wrong"}).status_code == 403
+    assert client.get("/api/admin/profiles/1").status_code == 403
+
+
+def test_admin_endpoints_serve_stored_profiles(api):
+    client, store = api
+    profile_id = store.new_id()
+    asyncio.run(store.save({"id": profile_id, "path": "/api/materials", "status": 200, "folded": ["main;handler 1500"]}))
+    auth = {"X-Profile": "secret"}
+
+    listed = client.get("/api/admin/profiles", headers=auth).json()
+    assert [(record["id"], "folded" in record) for record in listed] == [(profile_id, False)]
+    folded = client.get(f"/api/admin/profiles/{profile_id}", headers=auth)
+    assert folded.text == "main;handler 1500\n"
+    as_json = client.get(f"/api/admin/profiles/{profile_id}", params={"format": "json"}, headers=auth)
+    assert as_json.json()["id"] == profile_id
+    assert client.get("/api/admin/profiles/999", headers=auth).status_code == 404
+    assert client.get("/api/admin/profiles/not-an-id", headers=auth).status_code == 404
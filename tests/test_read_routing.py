@@ -0,0 +1,127 @@
+import asyncio
+
+from bson import Timestamp
+from pymongo.read_preferences import Primary, SecondaryPreferred
+
+from read_routing import CAUSAL_TOKEN_HEADER, CausalSessions, CausalTimes, CausalTokenMiddleware
+
+HEADER = CAUSAL_TOKEN_HEADER.lower().encode()
+
+
+class FakeSession:
+    def __init__(self, clock):
+        self.clock = clock
+        self.cluster_time = None
+        self.operation_time = None
+        self.replayed = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def advance_cluster_time(self, cluster_time):
+        self.cluster_time = cluster_time
+
+    def advance_operation_time(self, operation_time):
+        self.replayed = operation_time
+        self.operation_time = operation_time
+
+    def write(self):
+        """What the server reports after a write in this session"""
+        self.clock[0] += 1
+        self.operation_time = Timestamp(self.clock[0], 1)
+        self.cluster_time = {"clusterTime": self.operation_time, "signature": {"hash": b"\0" * 20, "keyId": 0}}
+
+
+class FakeClient:
+    def __init__(self, clock):
+        self.clock = clock
+        self.sessions = []
+
+    async def start_session(self, causal_consistency=False):
+        session = FakeSession(self.clock)
+        self.sessions.append(session)
+        return session
+
+
+class FakeCollection:
+    def with_options(self, read_preference):
+        return ("routed", read_preference)
+
+
+def worker(clock):
+    """One server process: its own client and CausalSessions, like a uvicorn worker"""
+    client = FakeClient(clock)
+    return client, CausalSessions(client, read_pref=SecondaryPreferred())
+
+
+def call(sessions, write: bool, token=None):
+    """Run one request through the middleware; returns (read target, response token)"""
+    outcome = {}
+
+    async def app(scope, receive, send):
+        async with sessions.start() as session:
+            if write:
+                session.write()
+            outcome["reader"] = sessions.reader(FakeCollection())
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            outcome["token"] = dict(message["headers"]).get(HEADER)
+
+    headers = [(HEADER, token)] if token else []
+    asyncio.run(CausalTokenMiddleware(app, sessions)({"type": "http", "headers": headers}, None, send))
+    return outcome["reader"], outcome["token"]
+
+
+def test_reads_without_token_stay_on_primary():
+    _, sessions = worker([0])
+    reader, token = call(sessions, write=False)
+    assert not isinstance(reader, tuple)
+    assert token is None
+    assert sessions.stats()["primary_reads"] == 1
+
+
+def test_token_from_one_worker_is_replayed_on_another():
+    clock = [100]
+    _, writer = worker(clock)
+    client, other = worker(clock)
+
+    _, token = call(writer, write=True)
+    assert token is not None
+
+    reader, echoed = call(other, write=False, token=token)
+    # The read may leave the primary, but only in a session that waits for the write
+    assert reader[0] == "routed"
+    assert client.sessions[0].replayed == Timestamp(101, 1)
+    # Nothing new was written, so no token comes back
+    assert echoed is None
+
+
+def test_malformed_token_reads_from_primary():
+    _, sessions = worker([0])
+    reader, _ = call(sessions, write=False, token=b"1.2.not-bson")
+    assert not isinstance(reader, tuple)
+
+
+def test_token_orders_by_operation_time():
+    older = CausalTimes({"clusterTime": Timestamp(5, 1)}, Timestamp(5, 1)).encode()
+    newer = CausalTimes({"clusterTime": Timestamp(5, 2)}, Timestamp(5, 2)).encode()
+    assert older.split(".")[:2] == ["5", "1"] and newer.split(".")[:2] == ["5", "2"]
+    assert CausalTimes.decode(newer).operation_time == Timestamp(5, 2)
+
+
+def test_primary_preference_starts_no_sessions():
+    client = FakeClient([0])
+    sessions = CausalSessions(client, read_pref=Primary())
+
+    async def use():
+        async with sessions.start() as session:
+            return session
+
+    assert asyncio.run(use()) is None
+    assert client.sessions == []
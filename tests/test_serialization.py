@@ -0,0 +1,25 @@
+import json
+
+from models import PartialRawMaterial, RawMaterial, Supplier
+from serialization import model_projection, model_response
+
+
+def test_projection_is_exactly_the_model_fields():
+    assert model_projection(Supplier) == {
+        "_id": 0, "id": 1, "name": 1, "verified": 1, "location": 1, "distance_km": 1
+    }
+
+
+def test_partial_materials_are_served_as_selected():
+    selected = [{"id": 1, "supplier": {"name": "Fresh Farms"}}]
+    response = model_response(PartialRawMaterial, selected, trusted=True)
+    assert json.loads(response.body) == selected
+
+
+def test_materials_schema_documents_field_selection():
+    import server
+    schema = server.app.openapi()
+    response = schema["paths"]["/api/materials"]["get"]["responses"]["200"]["content"]["application/json"]["schema"]
+    refs = {option["items"]["$ref"].rsplit("/", 1)[1] for option in response["anyOf"]}
+    assert refs == {RawMaterial.__name__, PartialRawMaterial.__name__}
+    assert "required" not in schema["components"]["schemas"]["PartialRawMaterial"]
@@ -0,0 +1,103 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+from dotenv import dotenv_values
+from fastapi.testclient import TestClient
+
+from cache import LRUCache
+from startup import StartupState
+from tests.fakes import FakeCursor
+
+ENV_FILE = Path(__file__).resolve().parent.parent / "backend" / ".env"
+
+
+@pytest.fixture
+def probes(monkeypatch):
+    import server
+    state = StartupState()
+    for step in ("database", "indexes", "catalog_coherence", "catalog_cache"):
+        state.steps[step] = "done"
+
+    async def ping(database, timeout):
+        return True
+
+    monkeypatch.setattr(server, "startup_state", state)
+    monkeypatch.setattr(server, "ping", ping)
+    monkeypatch.setattr(type(server.catalog_coherence), "running", property(lambda self: True))
+    # Startup is not run, so no database is needed
+    return TestClient(server.app), state, monkeypatch
+
+
+def test_seeding_is_off_by_default():
+    assert dotenv_values(ENV_FILE).get("SEED_ON_STARTUP", "false").lower() != "true"
+
+
+def test_ready_once_every_step_is_done(probes):
+    client, _, _ = probes
+    response = client.get("/readyz")
+    assert response.status_code == 200
+    assert response.json()["checks"] == {
+        "database": True, "indexes": True, "catalog_coherence": True, "catalog_cache": True
+    }
+    assert client.get("/healthz").status_code == 200
+
+
+def test_not_ready_when_coherence_failed_to_start(probes):
+    client, state, _ = probes
+    state.steps["catalog_coherence"] = "failed"
+    state.errors["catalog_coherence"] = "index build failed"
+    response = client.get("/readyz")
+    assert response.status_code == 503
+    assert response.json()["checks"]["catalog_coherence"] is False
+    assert response.json()["errors"] == {"catalog_coherence": "index build failed"}
+
+
+def test_not_ready_when_coherence_loop_died(probes):
+    import server
+    client, _, monkeypatch = probes
+    monkeypatch.setattr(type(server.catalog_coherence), "running", property(lambda self: False))
+    assert client.get("/readyz").status_code == 503
+
+
+def test_liveness_does_not_wait_for_warm_up(probes):
+    client, state, _ = probes
+    state.steps["catalog_cache"] = "running"
+    assert client.get("/readyz").status_code == 503
+    assert client.get("/healthz").status_code == 200
+
+
+class AggregateOnly:
+    def __init__(self, documents=None):
+        self.documents = documents
+        self.pipelines = []
+
+    def aggregate(self, pipeline):
+        if self.documents is None:
+            raise AssertionError("the material cache must not be primed from a secondary")
+        self.pipelines.append(pipeline)
+        return FakeCursor(self.documents)
+
+
+def test_material_cache_is_primed_from_the_primary(monkeypatch):
+    import database
+    import server
+    material = {
+        "id": 1, "name": "Onions", "category": "vegetables", "price": 40.0, "unit": "kg", "image": "",
+        "inStock": True, "description": "", "groupPrice": 36.0, "minGroupQuantity": 10,
+        "supplier": {"id": 7, "name": "Fresh Farms", "verified": True, "location": "Pune"}
+    }
+    primary = AggregateOnly([material])
+    cache = LRUCache(maxsize=10)
+
+    async def load():
+        return 0
+
+    monkeypatch.setattr(database, "materials_collection", primary)
+    monkeypatch.setattr(database, "catalog_materials", AggregateOnly())
+    monkeypatch.setattr(server, "material_cache", cache)
+    monkeypatch.setattr(server.supplier_grid, "load", load)
+
+    assert asyncio.run(server.prime_catalog_cache()) == "1 materials cached"
+    assert cache.get(1)["price"] == 40.0
+    assert {"$limit": 10} in primary.pipelines[0]